@@ -0,0 +1,197 @@
+import numpy as np
+
+from nbody import G, compute_accelerations
+
+
+def acceleration_vjp(positions, masses, cotangent):
+    """
+    Multiplies the transpose of the Jacobian of compute_accelerations() by a vector, i.e. computes
+    sum over i of (d a_i / d x_j)^T w_i for every body j, without ever forming the (n, n, 3, 3) Jacobian
+    :param positions: an (n, 3) array of positions in meters
+    :param masses: an (n,) array of masses in kg
+    :param cotangent: an (n, 3) array w, e.g. the gradient of an objective with respect to the accelerations
+    :return: an (n, 3) array, the gradient of the objective with respect to the positions through the accelerations
+    """
+    separation = positions[:, None, :] - positions[None, :, :]
+    distance = np.sqrt(np.sum(separation ** 2, axis = -1))
+    np.fill_diagonal(distance, np.inf)
+    inv3 = 1 / distance ** 3
+    inv5 = inv3 / distance ** 2
+
+    # The tidal tensor of each pair (i, j), I / r^3 - 3 d d^T / r^5, applied to w_i
+    dot = np.einsum("ijk,ik->ij", separation, cotangent)
+    tidal = cotangent[:, None, :] * inv3[:, :, None] - 3 * separation * (dot * inv5)[:, :, None]
+
+    # Body j pulls on every i (first term), and body j is pulled by every k (second term)
+    return G * (masses[:, None] * np.sum(tidal, axis = 0) - np.einsum("k,jkl->jl", masses, tidal))
+
+
+def distance_objective(body, target):
+    """
+    Makes an objective for propagate_with_gradient(): the final distance between two bodies, e.g. the ship and Mars
+    :param body: the index of the body to steer
+    :param target: the index of the body to reach
+    :return: a function (positions, velocities) -> (value, gradient with respect to positions, gradient with
+             respect to velocities)
+    """
+
+    def objective(positions, velocities):
+        separation = positions[body] - positions[target]
+        distance = np.linalg.norm(separation)
+        grad_positions = np.zeros_like(positions)
+        grad_positions[body] = separation / distance
+        grad_positions[target] = -separation / distance
+        return distance, grad_positions, np.zeros_like(velocities)
+
+    return objective
+
+
+def station_objective(body, station, velocity_weight = 0.0):
+    """
+    Makes an objective for propagate_with_gradient(): half the squared final distance of a body from a point which
+    may depend on the state, such as l2_position(), plus (optionally) half the weighted squared speed relative to a
+    second body, e.g. to arrive at L2 at rest relative to the Earth
+    :param body: the index of the body to steer
+    :param station: a function (positions, velocities) -> (3,) array for the point to reach, e.g. l2_position(); it
+                    is treated as fixed when differentiating, which is accurate when the body barely moves the point
+    :param velocity_weight: a tuple of (index of the reference body, weight in s^2), or 0 to ignore velocity
+    :return: an objective function as from distance_objective()
+    """
+
+    def objective(positions, velocities):
+        offset = positions[body] - station((positions, velocities))
+        grad_positions = np.zeros_like(positions)
+        grad_velocities = np.zeros_like(velocities)
+        grad_positions[body] = offset
+        value = 0.5 * np.sum(offset ** 2)
+        if velocity_weight:
+            reference, weight = velocity_weight
+            relative = velocities[body] - velocities[reference]
+            value += 0.5 * weight * np.sum(relative ** 2)
+            grad_velocities[body] = weight * relative
+            grad_velocities[reference] = -weight * relative
+        return value, grad_positions, grad_velocities
+
+    return objective
+
+
+def propagate_with_gradient(masses, state, dt, n_steps, objective, burns = ()):
+    """
+    Runs the system forward with Euler-Cromer steps exactly like the main simulation loop, then runs the discrete
+    adjoint of those steps backwards, giving the exact gradient of an objective of the final state with respect to the
+    initial state and to any impulsive burns in just one more run's worth of work, whatever the number of variables.
+    The positions at every step are kept for the backward pass, which takes n_steps * n * 3 floats.
+    :param masses: an (n,) array of masses in kg
+    :param state: the initial (positions, velocities), each an (n, 3) array
+    :param dt: the timestep in seconds
+    :param n_steps: the number of steps to run for
+    :param objective: a function (positions, velocities) -> (value, gradient with respect to the positions, gradient
+                      with respect to the velocities), e.g. from distance_objective()
+    :param burns: a list of impulsive burns (step, body index, (3,) change in velocity), each applied to the velocity
+                  at the start of that step; step 0 is a change to the initial velocity
+    :return: a tuple of (the objective, its (n, 3) gradient with respect to the initial positions, its (n, 3) gradient
+             with respect to the initial velocities, a (k, 3) array of its gradient with respect to each burn)
+    """
+    masses = np.asarray(masses, dtype = float)
+    positions, velocities = (np.array(array, dtype = float) for array in state)
+    burns_at = {}
+    for index, (step, body, delta_v) in enumerate(burns):
+        burns_at.setdefault(step, []).append((index, body, np.asarray(delta_v, dtype = float)))
+
+    # Forward pass
+    history = np.empty((n_steps,) + positions.shape)
+    for step in range(n_steps):
+        for _, body, delta_v in burns_at.get(step, ()):
+            velocities[body] += delta_v
+        history[step] = positions
+        velocities = velocities + compute_accelerations(positions, masses) * dt
+        positions = positions + velocities * dt
+    value, grad_positions, grad_velocities = objective(positions, velocities)
+
+    # Backward pass through x' = x + v' dt and v' = v + a(x) dt, from the last step to the first
+    grad_burns = np.zeros((len(burns), 3))
+    for step in reversed(range(n_steps)):
+        grad_velocities = grad_velocities + grad_positions * dt
+        grad_positions = grad_positions + acceleration_vjp(history[step], masses, grad_velocities) * dt
+        for index, body, _ in burns_at.get(step, ()):
+            grad_burns[index] = grad_velocities[body]
+    return value, grad_positions, grad_velocities, grad_burns
+
+
+def _search_direction(inverse_hessian, gradient, max_delta_v):
+    """
+    Picks the next direction to search along: the quasi-Newton step, or steepest descent (starting the inverse Hessian
+    estimate again) if that step would not go downhill; either way scaled down so no component exceeds max_delta_v
+    :return: a tuple of (the direction, the inverse Hessian estimate to keep using)
+    """
+    direction = -inverse_hessian @ gradient
+    if direction @ gradient >= 0:  # not a descent direction; start again from steepest descent
+        inverse_hessian = np.eye(len(gradient))
+        direction = -gradient
+    if max_delta_v is not None and np.max(np.abs(direction)) > max_delta_v:
+        direction = direction * max_delta_v / np.max(np.abs(direction))
+    return direction, inverse_hessian
+
+
+def optimize_burns(masses, state, dt, n_steps, objective, body, burn_steps = (0,), initial_burns = None, tol = 1e-8,
+                   max_runs = 50, max_delta_v = 1e3):
+    """
+    Finds the impulsive burns of one body (e.g. the ship) which minimize an objective, with the BFGS quasi-Newton
+    method on the exact gradients from propagate_with_gradient(), so it usually converges in tens of runs rather than
+    the thousands a sweep over the burns would take
+    :param masses: an (n,) array of masses in kg
+    :param state: the initial (positions, velocities), each an (n, 3) array
+    :param dt: the timestep in seconds
+    :param n_steps: the number of steps to run for
+    :param objective: an objective function, e.g. from distance_objective()
+    :param body: the index of the body which burns
+    :param burn_steps: the steps at which the body burns; step 0 changes its initial velocity
+    :param initial_burns: a (k, 3) array of burns in m/s to start from; zeros by default
+    :param tol: stop once a step would change the objective by less than this fraction
+    :param max_runs: the most forward and backward runs to make
+    :param max_delta_v: the largest change of any burn component in one iteration in m/s, to keep the first steps of
+                        the search from flinging the body out of the system; None for no limit
+    :return: a tuple of (the (k, 3) array of burns in m/s, the objective with those burns, the number of runs made)
+    """
+    k = len(burn_steps)
+    x = np.zeros(3 * k) if initial_burns is None else np.asarray(initial_burns, dtype = float).ravel()
+
+    def evaluate(x):
+        burns = [(step, body, delta_v) for step, delta_v in zip(burn_steps, x.reshape(k, 3))]
+        value, _, _, grad_burns = propagate_with_gradient(masses, state, dt, n_steps, objective, burns)
+        return value, grad_burns.ravel()
+
+    value, gradient = evaluate(x)
+    runs = 1
+    inverse_hessian = np.eye(3 * k)
+    while runs < max_runs:
+        direction, inverse_hessian = _search_direction(inverse_hessian, gradient, max_delta_v)
+
+        # Backtracking line search for a sufficient decrease
+        scale = 1.0
+        while runs < max_runs:
+            new_x = x + scale * direction
+            new_value, new_gradient = evaluate(new_x)
+            runs += 1
+            if new_value <= value + 1e-4 * scale * (direction @ gradient):
+                break
+            scale /= 2
+        else:
+            break
+        if new_value > value:
+            break
+
+        # Update the inverse Hessian estimate from the change in the gradient
+        s, y = new_x - x, new_gradient - gradient
+        converged = abs(value - new_value) <= tol * max(abs(value), 1e-300)
+        x, value, gradient = new_x, new_value, new_gradient
+        if converged:
+            break
+        if s @ y > 0:
+            if runs == 2 or np.array_equal(inverse_hessian, np.eye(3 * k)):
+                inverse_hessian = np.eye(3 * k) * (s @ y) / (y @ y)  # match the scale of the problem first
+            rho = 1 / (s @ y)
+            identity = np.eye(3 * k)
+            inverse_hessian = ((identity - rho * np.outer(s, y)) @ inverse_hessian @ (identity - rho * np.outer(y, s))
+                               + rho * np.outer(s, s))
+    return x.reshape(k, 3), value, runs
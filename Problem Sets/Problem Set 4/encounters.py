@@ -0,0 +1,127 @@
+import numpy as np
+
+from nbody import compute_accelerations, tiled_accelerations
+
+# Large primes to hash the integer cell coordinates with, as in Teschner et al., "Optimized Spatial Hashing for
+# Collision Detection of Deformable Objects" (2003)
+HASH_PRIMES = np.array([73856093, 19349663, 83492791], dtype = np.int64)
+
+# Offsets from a cell to itself and its 26 neighbors
+NEIGHBOR_OFFSETS = np.array([(i, j, k) for i in (-1, 0, 1) for j in (-1, 0, 1) for k in (-1, 0, 1)], dtype = np.int64)
+
+
+def _hash_cells(cells):
+    """Hashes an (n, 3) array of integer cell coordinates into an (n,) array of keys"""
+    return np.bitwise_xor.reduce(cells * HASH_PRIMES, axis = -1)
+
+
+def close_pairs(positions, radii):
+    """
+    Finds every pair of bodies closer together than the sum of their encounter radii, with a spatial hash: space is cut
+    into cubic cells at least as wide as the largest such sum, the bodies are sorted by the hash of their cell, and each
+    body is only checked against the bodies in its own and the 26 neighboring cells. This takes O(n log n) time for the
+    sort and O(n) for the checks while the bodies are spread out, rather than the O(n^2) of checking every pair.
+    :param positions: an (n, 3) array of positions in meters
+    :param radii: the encounter radius of each body in meters, a scalar or an (n,) array
+    :return: a (k, 2) array of the indices (i, j) of each close pair, with i < j
+    """
+    positions = np.asarray(positions, dtype = float)
+    radii = np.broadcast_to(np.asarray(radii, dtype = float), len(positions))
+    cell_size = 2 * np.max(radii, initial = 0.0)
+    if len(positions) < 2 or cell_size <= 0:
+        return np.zeros((0, 2), dtype = int)
+
+    cells = np.floor(positions / cell_size).astype(np.int64)
+    order = np.argsort(_hash_cells(cells), kind = "stable")
+    sorted_keys = _hash_cells(cells)[order]
+    candidates = []
+    for offset in NEIGHBOR_OFFSETS:
+        # The range of sorted bodies whose cell hashes like the neighboring cell of each body
+        keys = _hash_cells(cells + offset)
+        lo = np.searchsorted(sorted_keys, keys, side = "left")
+        counts = np.searchsorted(sorted_keys, keys, side = "right") - lo
+        first = np.repeat(np.arange(len(positions)), counts)
+        within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+        second = order[np.repeat(lo, counts) + within]
+        keep = first < second
+        candidates.append(np.stack([first[keep], second[keep]], axis = 1))
+
+    # Different cells can hash alike, so drop repeats and check the actual distances
+    pairs = np.unique(np.concatenate(candidates), axis = 0)
+    distance = np.linalg.norm(positions[pairs[:, 0]] - positions[pairs[:, 1]], axis = 1)
+    return pairs[distance < radii[pairs[:, 0]] + radii[pairs[:, 1]]]
+
+
+def hill_radii(masses, positions, primary = 0, factor = 3.0):
+    """
+    Computes encounter radii from the Hill radius of each body about a primary: the distance within which the body's
+    own gravity competes with the primary's tides, and so within which a passing body's path bends sharply
+    :param masses: an (n,) array of masses in kg
+    :param positions: an (n, 3) array of positions in meters
+    :param primary: the index of the primary (e.g. the Sun), whose own radius is set to 0
+    :param factor: the number of Hill radii to use
+    :return: an (n,) array of encounter radii in meters
+    """
+    masses = np.asarray(masses, dtype = float)
+    distance = np.linalg.norm(np.asarray(positions, dtype = float) - positions[primary], axis = 1)
+    radii = factor * distance * np.cbrt(masses / (3 * masses[primary]))
+    radii[primary] = 0.0
+    return radii
+
+
+class HybridIntegrator:
+    """
+    This class steps a system with one large Euler-Cromer step (like the main simulation loop) for every body except
+    those in a close encounter, which are found each step with close_pairs(). Those are integrated together over the
+    same step with many small leapfrog substeps, feeling each other's gravity exactly and that of the other bodies at
+    positions interpolated across the step. A rare close pass then no longer forces a small timestep on the whole run.
+    """
+
+    def __init__(self, masses, radii, substeps = 100):
+        """
+        :param masses: an (n,) array of masses in kg
+        :param radii: the encounter radius of each body in meters, a scalar or an (n,) array, e.g. from hill_radii()
+        :param substeps: the number of substeps to split each step into for the bodies in an encounter
+        """
+        self.masses = np.asarray(masses, dtype = float)
+        self.radii = np.broadcast_to(np.asarray(radii, dtype = float), len(self.masses))
+        self.substeps = substeps
+        self.encounters = np.zeros((0, 2), dtype = int)  # the close pairs found in the last step
+
+    def step(self, state, dt):
+        """
+        Advances a state by one step
+        :param state: a tuple of (positions, velocities), each an (n, 3) array
+        :param dt: the timestep in seconds
+        :return: the new (positions, velocities)
+        """
+        positions, velocities = (np.asarray(array, dtype = float) for array in state)
+        self.encounters = close_pairs(positions, self.radii)
+
+        # The fast path for everyone; the bodies in an encounter are then redone below
+        new_velocities = velocities + compute_accelerations(positions, self.masses) * dt
+        new_positions = positions + new_velocities * dt
+        if len(self.encounters) == 0:
+            return new_positions, new_velocities
+
+        close = np.zeros(len(positions), dtype = bool)
+        close[self.encounters.ravel()] = True
+        far = ~close
+        masses, far_masses = self.masses[close], self.masses[far]
+        pos, vel = positions[close], velocities[close]
+        far_start, far_end = positions[far], new_positions[far]
+
+        def accelerations(pos, fraction):
+            # Gravity within the encounter, plus that of the other bodies at their interpolated positions
+            far_pos = far_start + fraction * (far_end - far_start)
+            return tiled_accelerations(pos, np.concatenate([pos, far_pos]), np.concatenate([masses, far_masses]))
+
+        h = dt / self.substeps
+        acceleration = accelerations(pos, 0.0)
+        for substep in range(self.substeps):
+            vel = vel + acceleration * h / 2
+            pos = pos + vel * h
+            acceleration = accelerations(pos, (substep + 1) / self.substeps)
+            vel = vel + acceleration * h / 2
+        new_positions[close], new_velocities[close] = pos, vel
+        return new_positions, new_velocities
@@ -0,0 +1,134 @@
+import numpy as np
+
+from lagrange import SynodicFrame
+
+
+def _body_state(body, pos, vel, bodies):
+    """Returns the (3,) position and velocity of a body, from its row of pos and vel if bodies is given"""
+    if bodies is not None:
+        index = bodies.index(body)
+        return pos[index], vel[index]
+    return np.array([body.x, body.y, body.z]), np.array([body.vx, body.vy, body.vz])
+
+
+class InertialFrame:
+    """
+    The frame the simulation is integrated in; transforming to it does nothing
+    """
+
+    name = "Inertial"
+
+    def transform(self, pos, vel, bodies = None):
+        """
+        Transforms inertial positions and velocities into this frame
+        :param pos: an (n, 3) array of inertial positions
+        :param vel: an (n, 3) array of inertial velocities
+        :param bodies: the list of n Body() instances the rows belong to; if given, the bodies which define the frame
+                       are looked up in pos and vel rather than read from their own attributes, e.g. to draw a
+                       snapshot while the bodies themselves have moved on
+        :return: a tuple of (positions, velocities) in this frame
+        """
+        return pos, vel
+
+
+class BodyCenteredFrame(InertialFrame):
+    """
+    A non-rotating frame which moves along with a body, e.g. to watch the Moon orbit the Earth
+    """
+
+    def __init__(self, body):
+        self.body = body
+        self.name = "Centered on {}".format(body.name)
+
+    def transform(self, pos, vel, bodies = None):
+        origin, origin_vel = _body_state(self.body, pos, vel, bodies)
+        return pos - origin, vel - origin_vel
+
+
+class RotatingFrame(InertialFrame):
+    """
+    A frame which co-rotates with a pair of bodies, e.g. the Sun and the Earth, so that both bodies (and their Lagrange
+    points) appear stationary. The frame is recomputed from the current state of the pair every time it is used, so it
+    follows the pair even if their orbit is not circular. By default the origin is at the barycenter of the pair; pass
+    center to keep a different body (e.g. the Earth) fixed at the origin instead.
+    """
+
+    def __init__(self, primary, secondary, center = None):
+        self.primary = primary
+        self.secondary = secondary
+        self.center = center
+        self.name = "Rotating with {}".format(secondary.name)
+
+    def transform(self, pos, vel, bodies = None):
+        if bodies is None:
+            synodic_frame = SynodicFrame(self.primary, self.secondary)
+        else:
+            primary_pos, primary_vel = _body_state(self.primary, pos, vel, bodies)
+            secondary_pos, secondary_vel = _body_state(self.secondary, pos, vel, bodies)
+            synodic_frame = SynodicFrame.from_states(self.primary.mass, primary_pos, primary_vel,
+                                                     self.secondary.mass, secondary_pos, secondary_vel)
+        rotating_pos, rotating_vel = synodic_frame.from_inertial(pos, vel)
+        if self.center is not None:
+            center_pos, center_vel = synodic_frame.from_inertial(*_body_state(self.center, pos, vel, bodies))
+            rotating_pos = rotating_pos - center_pos
+            rotating_vel = rotating_vel - center_vel
+        return rotating_pos, rotating_vel
+
+
+class TrajectoryRecorder:
+    """
+    Records the (already transformed) positions and velocities of all bodies every few frames, so that trajectories in
+    any frame can be analyzed after a run without simulating it a second time
+    """
+
+    def __init__(self, every = 1, capacity = 1024):
+        self.every = every  # record one out of every this many frames
+        self.n_calls = 0
+        self.n_records = 0
+        self._times = np.zeros(capacity)
+        self._positions = None
+        self._velocities = None
+
+    def record(self, t, pos, vel):
+        """
+        Records the state of all bodies at time t, if this frame falls on the recording cadence
+        :param t: simulation time in seconds
+        :param pos: an (n, 3) array of positions
+        :param vel: an (n, 3) array of velocities
+        """
+        self.n_calls += 1
+        if (self.n_calls - 1) % self.every != 0:
+            return
+
+        # Allocate storage on the first record and double it whenever it fills up
+        if self._positions is None:
+            self._positions = np.zeros((len(self._times),) + pos.shape)
+            self._velocities = np.zeros((len(self._times),) + vel.shape)
+        if self.n_records == len(self._times):
+            self._times = np.concatenate([self._times, np.zeros_like(self._times)])
+            self._positions = np.concatenate([self._positions, np.zeros_like(self._positions)])
+            self._velocities = np.concatenate([self._velocities, np.zeros_like(self._velocities)])
+
+        self._times[self.n_records] = t
+        self._positions[self.n_records] = pos
+        self._velocities[self.n_records] = vel
+        self.n_records += 1
+
+    @property
+    def times(self):
+        """An (n_records,) array of the recorded times"""
+        return self._times[:self.n_records]
+
+    @property
+    def positions(self):
+        """An (n_records, n_bodies, 3) array of the recorded positions"""
+        if self._positions is None:
+            return np.zeros((0, 0, 3))
+        return self._positions[:self.n_records]
+
+    @property
+    def velocities(self):
+        """An (n_records, n_bodies, 3) array of the recorded velocities"""
+        if self._velocities is None:
+            return np.zeros((0, 0, 3))
+        return self._velocities[:self.n_records]
@@ -0,0 +1,279 @@
+import numpy as np
+
+from nbody import BodyArray
+
+# Physical constants
+G = 6.674e-11  # gravitational constant, m^3 kg^-1 s^-2
+
+# Keplerian orbital elements of many orbits, one row per orbit
+ELEMENTS_DTYPE = np.dtype([
+    ("a", float),  # semi-major axis in meters
+    ("e", float),  # eccentricity
+    ("i", float),  # inclination in radians
+    ("Omega", float),  # longitude of the ascending node in radians
+    ("omega", float),  # argument of periapsis in radians
+    ("M", float),  # mean anomaly in radians
+])
+
+
+def solve_kepler(M, e, tol = 1e-14, max_iter = 10):
+    """
+    Solves Kepler's equation M = E - e sin(E) for the eccentric anomaly E of many elliptic orbits at once with Halley's
+    method, which converges cubically, so a few iterations reach machine precision for any eccentricity below 1
+    :param M: mean anomalies in radians, a scalar or an array
+    :param e: eccentricities in [0, 1), a scalar or an array which broadcasts against M
+    :param tol: stop once no eccentric anomaly changes by more than this many radians
+    :param max_iter: the most iterations to make
+    :return: the eccentric anomalies in radians, with the broadcast shape of M and e
+    """
+    # Copy any strided views (such as columns of an ELEMENTS_DTYPE array) into contiguous arrays, which are much faster
+    M, e = (np.array(array) for array in np.broadcast_arrays(np.asarray(M, dtype = float),
+                                                             np.asarray(e, dtype = float)))
+    if np.any((e < 0) | (e >= 1)):
+        raise ValueError("solve_kepler() only handles elliptic orbits, with 0 <= e < 1")
+    M = np.remainder(M + np.pi, 2 * np.pi) - np.pi  # in [-pi, pi), where the starting guess below is good
+    E = M + 0.85 * e * np.where(M < 0, -1.0, 1.0)
+    for _ in range(max_iter):
+        sin_E, cos_E = np.sin(E), np.cos(E)
+        f = E - e * sin_E - M
+        df = 1 - e * cos_E
+        step = f / (df - 0.5 * f * e * sin_E / df)
+        E = E - step
+        if np.max(np.abs(step), initial = 0.0) <= tol:
+            break
+    return E
+
+
+def elements_to_state(a, e, i, Omega, omega, M, mu):
+    """
+    Converts Keplerian orbital elements into positions and velocities relative to the central body
+    :param a: semi-major axes in meters
+    :param e: eccentricities in [0, 1)
+    :param i: inclinations in radians
+    :param Omega: longitudes of the ascending node in radians
+    :param omega: arguments of periapsis in radians
+    :param M: mean anomalies in radians
+    :param mu: G times the mass of the central body (plus that of the orbiting body), in m^3/s^2
+    :return: a tuple of (positions, velocities), each an (n, 3) array, or each a (3,) array if every element is a scalar
+    """
+    a, e, i, Omega, omega, M, mu = (np.array(array) for array in np.broadcast_arrays(
+        *(np.asarray(value, dtype = float) for value in (a, e, i, Omega, omega, M, mu))))
+    E = solve_kepler(M, e)
+    sin_E, cos_E = np.sin(E), np.cos(E)
+    root = np.sqrt(1 - e ** 2)
+
+    # Position and velocity in the plane of the orbit, with x towards periapsis
+    x = a * (cos_E - e)
+    y = a * root * sin_E
+    rate = np.sqrt(mu / a) / (1 - e * cos_E)  # a times dE/dt
+    vx = -rate * sin_E
+    vy = rate * root * cos_E
+
+    # Unit vectors towards periapsis (P) and 90 degrees ahead of it (Q), in the reference frame
+    sin_O, cos_O = np.sin(Omega), np.cos(Omega)
+    sin_w, cos_w = np.sin(omega), np.cos(omega)
+    sin_i, cos_i = np.sin(i), np.cos(i)
+    P = np.stack([cos_w * cos_O - sin_w * cos_i * sin_O, cos_w * sin_O + sin_w * cos_i * cos_O, sin_w * sin_i], -1)
+    Q = np.stack([-sin_w * cos_O - cos_w * cos_i * sin_O, -sin_w * sin_O + cos_w * cos_i * cos_O, cos_w * sin_i], -1)
+    positions = x[..., None] * P + y[..., None] * Q
+    velocities = vx[..., None] * P + vy[..., None] * Q
+    return positions, velocities
+
+
+def _angle(u, w, normal):
+    """The angle in [0, 2 pi) from each vector u to the matching vector w, measured counterclockwise about normal"""
+    angle = np.arctan2(np.sum(np.cross(u, w) * normal, axis = -1), np.sum(u * w, axis = -1))
+    return np.remainder(angle, 2 * np.pi)
+
+
+def state_to_elements(positions, velocities, mu, tol = 1e-11):
+    """
+    Converts positions and velocities relative to a central body into osculating Keplerian elements: the elements of
+    the two-body orbit each body would follow if every other body vanished at this instant. Watching them over time
+    shows what the positions alone do not, e.g. a slowly precessing periapsis (omega drifting) or a decaying orbit (a
+    shrinking). For hyperbolic orbits (e > 1) a is negative and M is the hyperbolic mean anomaly. Where an angle is
+    undefined it is set to 0: Omega for orbits in the x-y plane, in which case omega is measured from the x axis, and
+    omega for circular orbits, in which case M is measured from the ascending node (or the x axis).
+    :param positions: an (n, 3) array of positions relative to the central body in meters
+    :param velocities: an (n, 3) array of velocities relative to the central body in m/s
+    :param mu: G times the mass of the central body (plus that of the orbiting body) in m^3/s^2, a scalar or (n,) array
+    :param tol: eccentricities and sines of the inclination below this count as zero
+    :return: an array with dtype ELEMENTS_DTYPE and one row per body
+    """
+    positions = np.atleast_2d(np.asarray(positions, dtype = float))
+    velocities = np.atleast_2d(np.asarray(velocities, dtype = float))
+    mu = np.broadcast_to(np.asarray(mu, dtype = float), len(positions))
+    r = np.linalg.norm(positions, axis = 1)
+    v_squared = np.sum(velocities ** 2, axis = 1)
+
+    # Angular momentum, line of nodes and eccentricity vectors
+    h = np.cross(positions, velocities)
+    h_mag = np.linalg.norm(h, axis = 1)
+    h_hat = h / h_mag[:, None]
+    nodes = np.stack([-h[:, 1], h[:, 0], np.zeros(len(h))], axis = 1)
+    nodes_mag = np.linalg.norm(nodes, axis = 1)
+    e_vec = ((v_squared - mu / r)[:, None] * positions
+             - np.sum(positions * velocities, axis = 1)[:, None] * velocities) / mu[:, None]
+    e = np.linalg.norm(e_vec, axis = 1)
+
+    # Reference directions: the ascending node (or the x axis), then periapsis (or the node, for circular orbits)
+    inclined = nodes_mag > tol * h_mag
+    node_hat = np.where(inclined[:, None], nodes / np.where(inclined, nodes_mag, 1)[:, None], [1.0, 0.0, 0.0])
+    eccentric = e > tol
+    periapsis_hat = np.where(eccentric[:, None], e_vec / np.where(eccentric, e, 1)[:, None], node_hat)
+    nu = _angle(periapsis_hat, positions, h_hat)  # true anomaly
+
+    elements = np.zeros(len(positions), dtype = ELEMENTS_DTYPE)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        elements["a"] = 1 / (2 / r - v_squared / mu)
+    elements["e"] = e
+    elements["i"] = np.arccos(np.clip(h[:, 2] / h_mag, -1, 1))
+    elements["Omega"] = np.where(inclined, np.remainder(np.arctan2(nodes[:, 1], nodes[:, 0]), 2 * np.pi), 0.0)
+    elements["omega"] = np.where(eccentric, _angle(node_hat, periapsis_hat, h_hat), 0.0)
+
+    # Mean anomaly from the true anomaly, through the eccentric (or hyperbolic) anomaly
+    with np.errstate(invalid = "ignore"):
+        E = 2 * np.arctan2(np.sqrt(np.maximum(1 - e, 0)) * np.sin(nu / 2), np.sqrt(1 + e) * np.cos(nu / 2))
+        F = 2 * np.arctanh(np.sqrt(np.maximum(e - 1, 0) / (e + 1)) * np.tan(nu / 2))
+    elements["M"] = np.where(e < 1, np.remainder(E - e * np.sin(E), 2 * np.pi), e * np.sinh(F) - F)
+    return elements
+
+
+class ElementsRecorder:
+    """
+    Converts the states of all bodies into osculating elements (see state_to_elements()) relative to each body's
+    primary every few steps, and keeps them, so that precession or decay of an orbit can be seen as it happens. Only
+    one vectorized conversion is done per recorded step, and steps which are not recorded cost a counter increment.
+    """
+
+    def __init__(self, masses, primaries, every = 100, callback = None, capacity = 1024):
+        """
+        :param masses: an (n,) array of masses of the bodies in kg
+        :param primaries: an (n,) array of the index of the body each body orbits, or -1 for a body which orbits
+                          nothing (e.g. the Sun); the elements of those bodies are all nan
+        :param every: record one out of every this many steps
+        :param callback: a function (t, elements) called with each new record, e.g. to print it or stream it elsewhere
+        :param capacity: the number of records to make room for; the storage doubles whenever it fills up
+        """
+        self.masses = np.asarray(masses, dtype = float)
+        self.primaries = np.asarray(primaries, dtype = int)
+        self.every = every
+        self.callback = callback
+        self.n_calls = 0
+        self.n_records = 0
+        self._times = np.zeros(capacity)
+        self._elements = np.zeros((capacity, len(self.masses)), dtype = ELEMENTS_DTYPE)
+
+    def due(self):
+        """
+        Counts a step, and says whether it falls on the recording cadence; call record() only if it does
+        :return: True if this step should be recorded
+        """
+        self.n_calls += 1
+        return (self.n_calls - 1) % self.every == 0
+
+    def record(self, t, pos, vel):
+        """
+        Records the osculating elements of all bodies at time t
+        :param t: simulation time in seconds
+        :param pos: an (n, 3) array of inertial positions
+        :param vel: an (n, 3) array of inertial velocities
+        :return: the new record, an array with dtype ELEMENTS_DTYPE and one row per body
+        """
+        orbiting = self.primaries >= 0
+        primaries = self.primaries[orbiting]
+        elements = np.full(len(self.masses), np.nan, dtype = ELEMENTS_DTYPE)
+        elements[orbiting] = state_to_elements(pos[orbiting] - pos[primaries], vel[orbiting] - vel[primaries],
+                                               G * (self.masses[orbiting] + self.masses[primaries]))
+
+        if self.n_records == len(self._times):
+            self._times = np.concatenate([self._times, np.zeros_like(self._times)])
+            self._elements = np.concatenate([self._elements, np.zeros_like(self._elements)])
+        self._times[self.n_records] = t
+        self._elements[self.n_records] = elements
+        self.n_records += 1
+        if self.callback is not None:
+            self.callback(t, elements)
+        return elements
+
+    @property
+    def times(self):
+        """An (n_records,) array of the recorded times"""
+        return self._times[:self.n_records]
+
+    @property
+    def elements(self):
+        """An (n_records, n_bodies) array with dtype ELEMENTS_DTYPE of the recorded elements"""
+        return self._elements[:self.n_records]
+
+    @property
+    def latest(self):
+        """The most recent record, or None if nothing has been recorded yet"""
+        return self._elements[self.n_records - 1] if self.n_records else None
+
+
+def sample_elements(count, a, e = (0.0, 0.0), i = (0.0, 0.0), Omega = (0.0, 2 * np.pi), omega = (0.0, 2 * np.pi),
+                    M = (0.0, 2 * np.pi), seed = None):
+    """
+    Draws the orbital elements of a population, such as an asteroid belt, uniformly from the given ranges
+    :param count: the number of orbits
+    :param a: the (lower, upper) range of semi-major axes in meters
+    :param e: the (lower, upper) range of eccentricities
+    :param i: the (lower, upper) range of inclinations in radians
+    :param Omega: the (lower, upper) range of longitudes of the ascending node in radians
+    :param omega: the (lower, upper) range of arguments of periapsis in radians
+    :param M: the (lower, upper) range of mean anomalies in radians
+    :param seed: the seed for the random number generator, so the population can be made again exactly
+    :return: an array with dtype ELEMENTS_DTYPE and one row per orbit
+    """
+    rng = np.random.default_rng(seed)
+    elements = np.zeros(count, dtype = ELEMENTS_DTYPE)
+    for name, (lower, upper) in zip(ELEMENTS_DTYPE.names, (a, e, i, Omega, omega, M)):
+        elements[name] = rng.uniform(lower, upper, count)
+    return elements
+
+
+def asteroid_belt(count, seed = None):
+    """
+    Draws the orbital elements of a main asteroid belt between 2.1 and 3.3 AU, with eccentricities up to 0.3 and
+    inclinations up to 20 degrees
+    :param count: the number of asteroids
+    :param seed: the seed for the random number generator
+    :return: an array with dtype ELEMENTS_DTYPE and one row per asteroid
+    """
+    return sample_elements(count, a = (3.14e11, 4.94e11), e = (0.0, 0.3), i = (0.0, np.radians(20)), seed = seed)
+
+
+def comet_cloud(count, seed = None):
+    """
+    Draws the orbital elements of a population of long-period comets on eccentric orbits, with perihelia of a few AU,
+    aphelia out to about 100 AU and inclinations in every direction
+    :param count: the number of comets
+    :param seed: the seed for the random number generator
+    :return: an array with dtype ELEMENTS_DTYPE and one row per comet
+    """
+    return sample_elements(count, a = (1.5e12, 7.5e12), e = (0.6, 0.98), i = (0.0, np.pi), seed = seed)
+
+
+def bodies_from_elements(elements, central_mass, center = (0.0, 0.0, 0.0), center_velocity = (0.0, 0.0, 0.0),
+                         masses = 0.0, radii = 1e3, bodies = None):
+    """
+    Makes bodies on the given orbits around a central body, writing their states straight into a BodyArray(), e.g. to
+    add a million asteroids to a simulation without making a Body() for each
+    :param elements: an array with dtype ELEMENTS_DTYPE, e.g. from asteroid_belt()
+    :param central_mass: the mass of the central body in kg
+    :param center: the (3,) position of the central body in meters
+    :param center_velocity: the (3,) velocity of the central body in m/s
+    :param masses: the masses of the bodies in kg, a scalar or an (n,) array; 0 for test particles
+    :param radii: the radii of the bodies in meters, a scalar or an (n,) array
+    :param bodies: a BodyArray() to add the bodies to the end of; a new one is made if not given
+    :return: the BodyArray()
+    """
+    positions, velocities = elements_to_state(elements["a"], elements["e"], elements["i"], elements["Omega"],
+                                              elements["omega"], elements["M"], G * (central_mass + np.asarray(masses)))
+    positions += center
+    velocities += center_velocity
+    if bodies is None:
+        bodies = BodyArray(capacity = len(elements))
+    bodies.extend(masses, positions, velocities, radii)
+    return bodies
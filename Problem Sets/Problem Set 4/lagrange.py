@@ -0,0 +1,440 @@
+import numpy as np
+
+# Physical constants
+G = 6.674e-11  # gravitational constant, m^3 kg^-1 s^-2
+
+
+class SynodicFrame:
+    """
+    This class represents the co-rotating (synodic) frame of a pair of bodies, such as the Sun and the Earth. The origin
+    is at the barycenter of the pair, the x axis points from the primary to the secondary, and the z axis is along the
+    orbital angular momentum of the pair. The frame is computed from the instantaneous positions and velocities of the
+    two bodies, so it works for any pair of bodies in a SolarSystem, not only for perfectly circular orbits.
+    """
+
+    def __init__(self, primary, secondary):
+        # Register the pair of bodies
+        self.primary = primary
+        self.secondary = secondary
+        self._setup(primary.mass, [primary.x, primary.y, primary.z], [primary.vx, primary.vy, primary.vz],
+                    secondary.mass, [secondary.x, secondary.y, secondary.z], [secondary.vx, secondary.vy, secondary.vz])
+
+    @classmethod
+    def from_states(cls, m1, r1, v1, m2, r2, v2):
+        """
+        Makes the synodic frame of two bodies given as arrays rather than Body() instances, e.g. in an event function
+        :param m1, r1, v1: mass, (3,) position and (3,) velocity of the primary
+        :param m2, r2, v2: mass, (3,) position and (3,) velocity of the secondary
+        :return: a SynodicFrame() instance
+        """
+        frame = cls.__new__(cls)
+        frame.primary = frame.secondary = None
+        frame._setup(m1, r1, v1, m2, r2, v2)
+        return frame
+
+    def _setup(self, m1, r1, v1, m2, r2, v2):
+        """Computes the origin, orientation and rotation rate of the frame"""
+        self.mu = m2 / (m1 + m2)
+        r1, r2, v1, v2 = (np.asarray(vector, dtype = float) for vector in (r1, r2, v1, v2))
+
+        # Barycenter position and velocity
+        self.origin = (1 - self.mu) * r1 + self.mu * r2
+        self.origin_velocity = (1 - self.mu) * v1 + self.mu * v2
+
+        # Orientation of the frame: rows of self.axes are the x, y, z unit vectors of the frame in inertial coordinates
+        separation = r2 - r1
+        angular_momentum = np.cross(separation, v2 - v1)
+        self.distance = np.linalg.norm(separation)
+        x_hat = separation / self.distance
+        z_hat = angular_momentum / np.linalg.norm(angular_momentum)
+        y_hat = np.cross(z_hat, x_hat)
+        self.axes = np.array([x_hat, y_hat, z_hat])
+
+        # Angular velocity of the frame, and the characteristic time (1 / mean motion) used for nondimensionalization
+        self.omega = angular_momentum / self.distance ** 2
+        self.mean_motion = np.linalg.norm(self.omega)
+
+    def to_inertial(self, pos, vel = None, nondimensional = False):
+        """
+        Converts positions (and optionally velocities) in the rotating frame to the inertial frame
+        :param pos: an (..., 3) array of positions in the rotating frame
+        :param vel: an (..., 3) array of velocities in the rotating frame, or None
+        :param nondimensional: if True, pos and vel are in CR3BP units (distance = 1, mean motion = 1)
+        :return: inertial positions, or a tuple of (positions, velocities) if vel is given
+        """
+        pos = np.asarray(pos, dtype = float)
+        if nondimensional:
+            pos = pos * self.distance
+        inertial_pos = self.origin + pos @ self.axes
+        if vel is None:
+            return inertial_pos
+
+        vel = np.asarray(vel, dtype = float)
+        if nondimensional:
+            vel = vel * self.distance * self.mean_motion
+        inertial_vel = self.origin_velocity + vel @ self.axes + np.cross(self.omega, inertial_pos - self.origin)
+        return inertial_pos, inertial_vel
+
+    def from_inertial(self, pos, vel = None, nondimensional = False):
+        """
+        Converts inertial positions (and optionally velocities) to the rotating frame
+        :param pos: an (..., 3) array of inertial positions
+        :param vel: an (..., 3) array of inertial velocities, or None
+        :param nondimensional: if True, return pos and vel in CR3BP units (distance = 1, mean motion = 1)
+        :return: rotating-frame positions, or a tuple of (positions, velocities) if vel is given
+        """
+        relative_pos = np.asarray(pos, dtype = float) - self.origin
+        rotating_pos = relative_pos @ self.axes.T
+        if vel is not None:
+            relative_vel = np.asarray(vel, dtype = float) - self.origin_velocity
+            rotating_vel = (relative_vel - np.cross(self.omega, relative_pos)) @ self.axes.T
+        if nondimensional:
+            rotating_pos = rotating_pos / self.distance
+            if vel is not None:
+                rotating_vel = rotating_vel / (self.distance * self.mean_motion)
+        if vel is None:
+            return rotating_pos
+        return rotating_pos, rotating_vel
+
+
+# Lagrange points ======================================================================================================
+
+def collinear_points(mu, tol = 1e-14, max_iter = 50):
+    """
+    Computes the x coordinates of the collinear Lagrange points L1, L2, L3 in the CR3BP rotating frame, where the
+    primary is at x = -mu and the secondary is at x = 1 - mu. All three points are solved simultaneously with Newton's
+    method on the x component of the gradient of the effective potential.
+    :param mu: mass ratio m2 / (m1 + m2)
+    :return: an array of [x_L1, x_L2, x_L3]
+    """
+    hill_radius = (mu / 3) ** (1 / 3)
+    x = np.array([1 - mu - hill_radius, 1 - mu + hill_radius, -1 - 5 * mu / 12])
+    for _ in range(max_iter):
+        r1 = np.abs(x + mu)
+        r2 = np.abs(x - 1 + mu)
+        f = x - (1 - mu) * (x + mu) / r1 ** 3 - mu * (x - 1 + mu) / r2 ** 3
+        df = 1 + 2 * (1 - mu) / r1 ** 3 + 2 * mu / r2 ** 3
+        step = f / df
+        x -= step
+        if np.all(np.abs(step) < tol):
+            break
+    return x
+
+
+def lagrange_points_nondimensional(mu):
+    """
+    Computes all five Lagrange points in the CR3BP rotating frame
+    :param mu: mass ratio m2 / (m1 + m2)
+    :return: a (5, 3) array of the positions of L1 through L5
+    """
+    points = np.zeros((5, 3))
+    points[:3, 0] = collinear_points(mu)
+    points[3] = [0.5 - mu, np.sqrt(3) / 2, 0]
+    points[4] = [0.5 - mu, -np.sqrt(3) / 2, 0]
+    return points
+
+
+def lagrange_points(primary, secondary):
+    """
+    Computes the inertial positions and velocities of all five Lagrange points of a pair of bodies. The velocities are
+    those of a point co-rotating with the pair, so a massless Body placed at one of these states will (ideally) keep
+    station at the Lagrange point.
+    :param primary: a Body() instance (e.g. the Sun)
+    :param secondary: a Body() instance (e.g. the Earth)
+    :return: a tuple of (positions, velocities), each a (5, 3) array with rows L1 through L5
+    """
+    frame = SynodicFrame(primary, secondary)
+    points = lagrange_points_nondimensional(frame.mu)
+    return frame.to_inertial(points, np.zeros_like(points), nondimensional = True)
+
+
+# Vectorized CR3BP propagator ==========================================================================================
+
+def cr3bp_acceleration(states, mu):
+    """
+    Computes the acceleration of many test particles in the CR3BP rotating frame
+    :param states: an (n, 6) array of [x, y, z, vx, vy, vz] in nondimensional units
+    :param mu: mass ratio m2 / (m1 + m2)
+    :return: an (n, 3) array of accelerations
+    """
+    x, y, z, vx, vy = states[:, 0], states[:, 1], states[:, 2], states[:, 3], states[:, 4]
+    r1 = np.sqrt((x + mu) ** 2 + y ** 2 + z ** 2)
+    r2 = np.sqrt((x - 1 + mu) ** 2 + y ** 2 + z ** 2)
+    k1 = (1 - mu) / r1 ** 3
+    k2 = mu / r2 ** 3
+    ax = 2 * vy + x - k1 * (x + mu) - k2 * (x - 1 + mu)
+    ay = -2 * vx + y - k1 * y - k2 * y
+    az = -k1 * z - k2 * z
+    return np.stack([ax, ay, az], axis = -1)
+
+
+def _cr3bp_jacobian(states, mu):
+    """
+    Computes the Jacobian of the CR3BP equations of motion, used to propagate the state transition matrix
+    :param states: an (n, 6) array of [x, y, z, vx, vy, vz] in nondimensional units
+    :param mu: mass ratio m2 / (m1 + m2)
+    :return: an (n, 6, 6) array
+    """
+    n = len(states)
+    x, y, z = states[:, 0], states[:, 1], states[:, 2]
+    d1 = np.stack([x + mu, y, z], axis = -1)
+    d2 = np.stack([x - 1 + mu, y, z], axis = -1)
+    r1 = np.linalg.norm(d1, axis = -1)[:, None, None]
+    r2 = np.linalg.norm(d2, axis = -1)[:, None, None]
+
+    # Hessian of the effective potential
+    identity = np.eye(3)
+    hessian = ((1 - mu) * (3 * d1[:, :, None] * d1[:, None, :] / r1 ** 5 - identity / r1 ** 3)
+               + mu * (3 * d2[:, :, None] * d2[:, None, :] / r2 ** 5 - identity / r2 ** 3))
+    hessian[:, 0, 0] += 1
+    hessian[:, 1, 1] += 1
+
+    jacobian = np.zeros((n, 6, 6))
+    jacobian[:, :3, 3:] = identity
+    jacobian[:, 3:, :3] = hessian
+    jacobian[:, 3, 4] = 2
+    jacobian[:, 4, 3] = -2
+    return jacobian
+
+
+def _cr3bp_derivatives(states, stm, mu):
+    """Time derivatives of the states and (optionally) the state transition matrices"""
+    derivatives = np.concatenate([states[:, 3:], cr3bp_acceleration(states, mu)], axis = -1)
+    if stm is None:
+        return derivatives, None
+    return derivatives, _cr3bp_jacobian(states, mu) @ stm
+
+
+def _rk4_step(states, stm, mu, dt):
+    """Advances the states (and state transition matrices) by dt, which may be a scalar or an (n,) array"""
+    dt = np.broadcast_to(np.asarray(dt, dtype = float), (len(states),))
+    h = dt[:, None]
+    hm = dt[:, None, None]
+    k1, m1 = _cr3bp_derivatives(states, stm, mu)
+    k2, m2 = _cr3bp_derivatives(states + h / 2 * k1, None if stm is None else stm + hm / 2 * m1, mu)
+    k3, m3 = _cr3bp_derivatives(states + h / 2 * k2, None if stm is None else stm + hm / 2 * m2, mu)
+    k4, m4 = _cr3bp_derivatives(states + h * k3, None if stm is None else stm + hm * m3, mu)
+    states = states + h / 6 * (k1 + 2 * k2 + 2 * k3 + k4)
+    if stm is not None:
+        stm = stm + hm / 6 * (m1 + 2 * m2 + 2 * m3 + m4)
+    return states, stm
+
+
+def propagate_cr3bp(states, mu, duration, n_steps = 1000, stm = False):
+    """
+    Propagates many test particles in the CR3BP at once with a fixed-step RK4 integrator
+    :param states: an (n, 6) array of [x, y, z, vx, vy, vz] in nondimensional units
+    :param mu: mass ratio m2 / (m1 + m2)
+    :param duration: the nondimensional time to propagate for, either a scalar or an (n,) array
+    :param n_steps: number of RK4 steps to take
+    :param stm: if True, also propagate the state transition matrix of each particle
+    :return: the final (n, 6) states, or a tuple of (states, (n, 6, 6) state transition matrices) if stm is True
+    """
+    states = np.array(states, dtype = float, ndmin = 2)
+    phi = np.tile(np.eye(6), (len(states), 1, 1)) if stm else None
+    dt = np.asarray(duration, dtype = float) / n_steps
+    for _ in range(n_steps):
+        states, phi = _rk4_step(states, phi, mu, dt)
+    return (states, phi) if stm else states
+
+
+def _propagate_to_crossing(states, mu, max_time, n_steps = 600, refine_iter = 3):
+    """
+    Propagates each state (and its state transition matrix) until it next crosses the y = 0 plane, which for the
+    symmetric periodic orbits below happens after half a period
+    :return: a tuple of (states at crossing, state transition matrices at crossing, crossing times)
+    """
+    n = len(states)
+    phi = np.tile(np.eye(6), (n, 1, 1))
+    dt = max_time / n_steps
+    time = np.zeros(n)
+    crossed = np.zeros(n, dtype = bool)
+    crossing_states = states.copy()
+    crossing_phi = phi.copy()
+    crossing_time = np.full(n, np.nan)
+
+    # Coarse search: keep the last state before each particle's first y sign change (after leaving the plane)
+    for step in range(n_steps):
+        new_states, new_phi = _rk4_step(states, phi, mu, dt)
+        just_crossed = ~crossed & (step > 0) & (np.sign(new_states[:, 1]) != np.sign(states[:, 1]))
+        crossing_states[just_crossed] = states[just_crossed]
+        crossing_phi[just_crossed] = phi[just_crossed]
+        crossing_time[just_crossed] = time[just_crossed]
+        crossed |= just_crossed
+        if crossed.all():
+            break
+        states, phi = new_states, new_phi
+        time += dt
+
+    # Refine the crossing time of every particle at once with Newton's method on y(t) = 0
+    states, phi, time = crossing_states, crossing_phi, crossing_time
+    for _ in range(refine_iter):
+        step = np.where(crossed, -states[:, 1] / states[:, 4], 0.0)
+        states, phi = _rk4_step(states, phi, mu, step)
+        time = time + step
+    return states, phi, time
+
+
+# Periodic orbits by differential correction ===========================================================================
+
+def _linearized_frequency(mu, x_point):
+    """In-plane frequency and y/x amplitude ratio of the linearized motion about a collinear point"""
+    c2 = (1 - mu) / np.abs(x_point + mu) ** 3 + mu / np.abs(x_point - 1 + mu) ** 3
+    frequency = np.sqrt((2 - c2 + np.sqrt(9 * c2 ** 2 - 8 * c2)) / 2)
+    amplitude_ratio = (frequency ** 2 + 1 + 2 * c2) / (2 * frequency)
+    return frequency, amplitude_ratio
+
+
+def _continuation_stages(amplitudes, gamma, max_fraction = 0.05):
+    """Number of continuation stages needed so the amplitude never grows by more than max_fraction * gamma per stage"""
+    return max(1, int(np.ceil(np.max(amplitudes) / (max_fraction * gamma))))
+
+
+def _differential_correction(states, mu, free, max_time, tol, max_iter):
+    """
+    Corrects the free components of many initial states at once, so that each orbit crosses the y = 0 plane
+    perpendicularly (vx = vz = 0) after half a period, using the state transition matrix to linearize the crossing
+    :param states: an (n, 6) array of initial states on the y = 0 plane; corrected in place
+    :param free: the indices of the state components to adjust, e.g. [4] for vy or [0, 4] for x and vy
+    :return: a tuple of (corrected states, periods)
+    """
+    targets = [3, 5][:len(free)]
+    for _ in range(max_iter):
+        final, phi, half_period = _propagate_to_crossing(states, mu, max_time)
+        error = final[:, targets]
+        if np.all(np.abs(error) < tol):
+            break
+
+        # d(error) = (Phi - a / vy * dy/dx0) dx0, accounting for the change in crossing time
+        acceleration = cr3bp_acceleration(final, mu)
+        jacobian = (phi[:, targets][:, :, free]
+                    - acceleration[:, np.array(targets) - 3, None] / final[:, 4, None, None] * phi[:, None, 1, free])
+        correction = np.linalg.solve(jacobian, error[:, :, None])[:, :, 0]
+        states[:, free] -= correction
+    return states, 2 * half_period
+
+
+def lyapunov_orbits(mu, point = 2, amplitudes = (1e-3,), tol = 1e-11, max_iter = 20):
+    """
+    Finds initial conditions of planar Lyapunov orbits about L1 or L2 by differential correction. Every amplitude is
+    corrected simultaneously, and large amplitudes are reached by continuation from the linearized solution, so a whole
+    family of orbits costs about as much as a single one.
+    :param mu: mass ratio m2 / (m1 + m2)
+    :param point: which collinear point to orbit, 1 or 2
+    :param amplitudes: nondimensional x amplitudes of the orbits (distance from the Lagrange point at y = 0)
+    :return: a tuple of ((n, 6) initial states in the rotating frame, (n,) periods), in nondimensional units
+    """
+    x_point = collinear_points(mu)[point - 1]
+    frequency, amplitude_ratio = _linearized_frequency(mu, x_point)
+    amplitudes = np.atleast_1d(np.asarray(amplitudes, dtype = float))
+    n_stages = _continuation_stages(amplitudes, np.abs(x_point - 1 + mu))
+
+    states = np.zeros((len(amplitudes), 6))
+    previous_vy = None
+    for stage in range(1, n_stages + 1):
+        stage_amplitudes = amplitudes * stage / n_stages
+        states[:, 0] = x_point - stage_amplitudes
+        if previous_vy is None:
+            # Initial guess from the linearized solution x = x_L - A cos(wt), y = k A sin(wt)
+            states[:, 4] = amplitude_ratio * stage_amplitudes * frequency
+        else:
+            # Extrapolate the corrected vy from the previous stage
+            states[:, 4] = previous_vy * stage / (stage - 1)
+        states, periods = _differential_correction(states, mu, [4], 2 * np.pi / frequency, tol, max_iter)
+        previous_vy = states[:, 4].copy()
+
+    return states, periods
+
+
+def _richardson_guess(mu, point, z_amplitudes, northern = True):
+    """
+    Third-order analytical approximation of a halo orbit (Richardson, 1980), used as the initial guess for the
+    differential correction
+    """
+    x_point = collinear_points(mu)[point - 1]
+    gamma = np.abs(x_point - 1 + mu)
+    sign = 1 if point == 1 else -1
+
+    def c(n):
+        return (sign ** n * mu + (-1) ** n * (1 - mu) * gamma ** (n + 1) / (1 - sign * gamma) ** (n + 1)) / gamma ** 3
+
+    c2, c3, c4 = c(2), c(3), c(4)
+    lam = np.sqrt((2 - c2 + np.sqrt(9 * c2 ** 2 - 8 * c2)) / 2)
+    k = 2 * lam / (lam ** 2 + 1 - c2)
+    delta = lam ** 2 - c2
+
+    d1 = 3 * lam ** 2 / k * (k * (6 * lam ** 2 - 1) - 2 * lam)
+    d2 = 8 * lam ** 2 / k * (k * (11 * lam ** 2 - 1) - 2 * lam)
+    a21 = 3 * c3 * (k ** 2 - 2) / (4 * (1 + 2 * c2))
+    a22 = 3 * c3 / (4 * (1 + 2 * c2))
+    a23 = -3 * c3 * lam / (4 * k * d1) * (3 * k ** 3 * lam - 6 * k * (k - lam) + 4)
+    a24 = -3 * c3 * lam / (4 * k * d1) * (2 + 3 * k * lam)
+    b21 = -3 * c3 * lam / (2 * d1) * (3 * k * lam - 4)
+    b22 = 3 * c3 * lam / d1
+    d21 = -c3 / (2 * lam ** 2)
+    a31 = (-9 * lam / (4 * d2) * (4 * c3 * (k * a23 - b21) + k * c4 * (4 + k ** 2))
+           + (9 * lam ** 2 + 1 - c2) / (2 * d2) * (3 * c3 * (2 * a23 - k * b21) + c4 * (2 + 3 * k ** 2)))
+    a32 = -1 / d2 * (9 * lam / 4 * (4 * c3 * (k * a24 - b22) + k * c4)
+                     + 3 / 2 * (9 * lam ** 2 + 1 - c2) * (c3 * (k * b22 + d21 - 2 * a24) - c4))
+    b31 = 3 / (8 * d2) * (8 * lam * (3 * c3 * (k * b21 - 2 * a23) - c4 * (2 + 3 * k ** 2))
+                          + (9 * lam ** 2 + 1 + 2 * c2) * (4 * c3 * (k * a23 - b21) + k * c4 * (4 + k ** 2)))
+    b32 = 1 / d2 * (9 * lam * (c3 * (k * b22 + d21 - 2 * a24) - c4)
+                    + 3 / 8 * (9 * lam ** 2 + 1 + 2 * c2) * (4 * c3 * (k * a24 - b22) + k * c4))
+    d31 = 3 / (64 * lam ** 2) * (4 * c3 * a24 + c4)
+    d32 = 3 / (64 * lam ** 2) * (4 * c3 * (a23 - d21) + c4 * (4 + k ** 2))
+    s_denominator = 2 * lam * (lam * (1 + k ** 2) - 2 * k)
+    s1 = (3 / 2 * c3 * (2 * a21 * (k ** 2 - 2) - a23 * (k ** 2 + 2) - 2 * k * b21)
+          - 3 / 8 * c4 * (3 * k ** 4 - 8 * k ** 2 + 8)) / s_denominator
+    s2 = (3 / 2 * c3 * (2 * a22 * (k ** 2 - 2) + a24 * (k ** 2 + 2) + 2 * k * b22 + 5 * d21)
+          + 3 / 8 * c4 * (12 - k ** 2)) / s_denominator
+    l1 = -3 / 2 * c3 * (2 * a21 + a23 + 5 * d21) - 3 / 8 * c4 * (12 - k ** 2) + 2 * lam ** 2 * s1
+    l2 = 3 / 2 * c3 * (a24 - 2 * a22) + 9 / 8 * c4 + 2 * lam ** 2 * s2
+
+    # Amplitudes in units of gamma; the in-plane amplitude is fixed by the out-of-plane amplitude
+    az = np.atleast_1d(np.asarray(z_amplitudes, dtype = float)) / gamma
+    ax = np.sqrt(np.maximum((-delta - l2 * az ** 2) / l1, 0.0))
+    frequency = lam * (1 + s1 * ax ** 2 + s2 * az ** 2)
+    dm = 1 if northern else -1
+
+    # Evaluate the series at phase zero, where y = vx = vz = 0
+    x = a21 * ax ** 2 + a22 * az ** 2 - ax + a23 * ax ** 2 - a24 * az ** 2 + a31 * ax ** 3 - a32 * ax * az ** 2
+    z = dm * (az + d21 * ax * az * (1 - 3) + d32 * az * ax ** 2 - d31 * az ** 3)
+    vy = frequency * (k * ax + 2 * (b21 * ax ** 2 - b22 * az ** 2) + 3 * (b31 * ax ** 3 - b32 * ax * az ** 2))
+
+    # Scale from units of gamma about the Lagrange point to the barycentric rotating frame
+    states = np.zeros((len(az), 6))
+    states[:, 0] = x_point + gamma * x
+    states[:, 2] = gamma * z
+    states[:, 4] = gamma * vy
+    return states, frequency, gamma
+
+
+def halo_orbits(mu, point = 2, z_amplitudes = (1e-3,), northern = True, tol = 1e-11, max_iter = 20):
+    """
+    Finds initial conditions of halo orbits about L1 or L2 by differential correction, starting from Richardson's
+    third-order approximation. The out-of-plane amplitude z0 is held fixed while x0 and vy0 are corrected so that the
+    orbit crosses the y = 0 plane perpendicularly. Every amplitude is corrected simultaneously, and large amplitudes are
+    reached by continuation.
+    :param mu: mass ratio m2 / (m1 + m2)
+    :param point: which collinear point to orbit, 1 or 2
+    :param z_amplitudes: approximate nondimensional out-of-plane amplitudes of the orbits
+    :param northern: whether to return the northern (z > 0 at y = 0) or southern family member
+    :return: a tuple of ((n, 6) initial states in the rotating frame, (n,) periods), in nondimensional units
+    """
+    z_amplitudes = np.atleast_1d(np.asarray(z_amplitudes, dtype = float))
+    _, _, gamma = _richardson_guess(mu, point, z_amplitudes, northern)
+    n_stages = _continuation_stages(z_amplitudes, gamma)
+
+    states = None
+    previous_guess = None
+    for stage in range(1, n_stages + 1):
+        guess, frequency, _ = _richardson_guess(mu, point, z_amplitudes * stage / n_stages, northern)
+        if states is None:
+            states = guess
+        else:
+            # Shift the previous solution by the change in the analytical approximation
+            states = states + guess - previous_guess
+        previous_guess = guess
+        states, periods = _differential_correction(states, mu, [0, 4], 2 * np.pi / frequency.min(), tol, max_iter)
+
+    return states, periods
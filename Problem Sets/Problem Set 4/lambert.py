@@ -0,0 +1,246 @@
+import numpy as np
+
+from kepler import ELEMENTS_DTYPE, elements_to_state, state_to_elements
+from nbody import G, euler_cromer_step
+
+# Columns of the arrays returned by porkchop(), one cell per pair of departure and arrival times
+PORKCHOP_DTYPE = np.dtype([
+    ("departure_time", float),  # simulation time of departure in seconds
+    ("arrival_time", float),  # simulation time of arrival in seconds
+    ("departure_dv", float),  # change in velocity needed to leave the departure body onto the transfer, m/s
+    ("arrival_dv", float),  # change in velocity needed to match the arrival body at the end of the transfer, m/s
+    ("total_dv", float),  # departure_dv + arrival_dv, m/s; nan where there is no transfer
+])
+
+
+def stumpff(z):
+    """
+    Computes the Stumpff functions S(z) and C(z) of the universal-variable formulation of Kepler's problem, using
+    their series near z = 0, where the closed forms lose all their precision to cancellation
+    :param z: an array of z = alpha * chi^2, positive for ellipses and negative for hyperbolas
+    :return: a tuple of (S(z), C(z))
+    """
+    z = np.asarray(z, dtype = float)
+    root = np.sqrt(np.abs(z))
+    with np.errstate(divide = "ignore", invalid = "ignore", over = "ignore"):
+        S = np.where(z > 0, (root - np.sin(root)) / root ** 3, (np.sinh(root) - root) / root ** 3)
+        C = np.where(z > 0, (1 - np.cos(root)) / z, (np.cosh(root) - 1) / -z)
+    small = np.abs(z) < 1e-3
+    S = np.where(small, 1 / 6 - z / 120 + z ** 2 / 5040, S)
+    C = np.where(small, 1 / 2 - z / 24 + z ** 2 / 720, C)
+    return S, C
+
+
+def solve_lambert(r1, r2, tof, mu, prograde = True, iterations = 60):
+    """
+    Solves Lambert's problem for many transfers at once: finds the two-body orbit which goes from position r1 to
+    position r2 in a time of flight tof, in less than one revolution. This uses the universal-variable formulation,
+    solved by bisection on z, which always converges since the time of flight grows steadily with z; a fixed number
+    of bisections keeps every transfer in step, so the whole batch is a handful of array operations per iteration.
+    :param r1: a (..., 3) array of departure positions relative to the central body in meters
+    :param r2: a (..., 3) array of arrival positions relative to the central body in meters
+    :param tof: a (...) array of times of flight in seconds
+    :param mu: G times the mass of the central body in m^3/s^2
+    :param prograde: if True, go around the same way as the planets (counterclockwise seen from +z)
+    :param iterations: the number of bisections; 60 brings the interval down to the precision of the floats
+    :return: a tuple of (departure velocities, arrival velocities), each a (..., 3) array in m/s; nan where the time
+             of flight is not positive or the transfer angle is 0 or 180 degrees, where the orbit plane is undefined
+    """
+    r1, r2 = np.asarray(r1, dtype = float), np.asarray(r2, dtype = float)
+    tof = np.asarray(tof, dtype = float)
+    r1_mag, r2_mag = np.linalg.norm(r1, axis = -1), np.linalg.norm(r2, axis = -1)
+    cos_angle = np.clip(np.sum(r1 * r2, axis = -1) / (r1_mag * r2_mag), -1, 1)
+    clockwise = np.cross(r1, r2)[..., 2] < 0
+    long_way = clockwise if prograde else ~clockwise
+    sin_angle = np.sqrt(1 - cos_angle ** 2) * np.where(long_way, -1, 1)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        A = sin_angle * np.sqrt(r1_mag * r2_mag / (1 - cos_angle))
+
+    def y_of(z):
+        S, C = stumpff(z)
+        return r1_mag + r2_mag + A * (z * S - 1) / np.sqrt(C), S, C
+
+    # Bisection for the z at which the time of flight matches; where y < 0 the orbit does not exist, which only
+    # happens below the solution, so it counts as too short
+    shape = np.broadcast(r1_mag, r2_mag, tof).shape
+    lower = np.full(shape, -1e3)  # very fast hyperbolic transfers
+    upper = np.full(shape, 4 * np.pi ** 2 * (1 - 1e-12))  # one full revolution
+    with np.errstate(divide = "ignore", invalid = "ignore", over = "ignore"):
+        for _ in range(iterations):
+            z = (lower + upper) / 2
+            y, S, C = y_of(z)
+            t = ((y / C) ** 1.5 * S + A * np.sqrt(y)) / np.sqrt(mu)
+            too_short = (y < 0) | (t < tof)
+            lower = np.where(too_short, z, lower)
+            upper = np.where(too_short, upper, z)
+
+        # Lagrange coefficients of the transfer orbit
+        y = y_of((lower + upper) / 2)[0]
+        f = 1 - y / r1_mag
+        g = A * np.sqrt(y / mu)
+        g_dot = 1 - y / r2_mag
+        v1 = (r2 - f[..., None] * r1) / g[..., None]
+        v2 = (g_dot[..., None] * r2 - r1) / g[..., None]
+    invalid = (tof <= 0) | ~np.isfinite(A) | (A == 0)
+    v1[invalid], v2[invalid] = np.nan, np.nan
+    return v1, v2
+
+
+class Ephemeris:
+    """
+    This class holds the positions and velocities of every body at regular times, e.g. from simulating the solar
+    system ahead, and interpolates them at any time in between with cubic Hermite interpolation, which uses the
+    velocities as well as the positions and so stays accurate with samples a few days apart. It can be saved and
+    loaded, so a long run only needs to be simulated once.
+    """
+
+    def __init__(self, times, positions, velocities):
+        """
+        :param times: an (s,) array of evenly spaced sample times in seconds
+        :param positions: an (s, n, 3) array of the positions of n bodies at those times in meters
+        :param velocities: an (s, n, 3) array of the velocities of the bodies at those times in m/s
+        """
+        self.times = np.asarray(times, dtype = float)
+        self.positions = np.asarray(positions, dtype = float)
+        self.velocities = np.asarray(velocities, dtype = float)
+
+    @classmethod
+    def from_simulation(cls, masses, state, t0, duration, dt, sample_every = 100):
+        """
+        Simulates the bodies ahead with the same Euler-Cromer steps as the main simulation loop, so the ephemeris
+        agrees with where the simulation will actually put the bodies
+        :param masses: an (n,) array of masses in kg
+        :param state: the (positions, velocities) at time t0, each an (n, 3) array
+        :param t0: the simulation time of the state in seconds
+        :param duration: the time to simulate ahead in seconds
+        :param dt: the timestep in seconds
+        :param sample_every: keep one out of every this many steps
+        :return: an Ephemeris() instance
+        """
+        n_samples = int(np.ceil(duration / (dt * sample_every))) + 1
+        positions = np.empty((n_samples,) + np.shape(state[0]))
+        velocities = np.empty_like(positions)
+        for sample in range(n_samples):
+            positions[sample], velocities[sample] = state
+            for _ in range(sample_every):
+                state = euler_cromer_step(state, masses, dt)
+        return cls(t0 + dt * sample_every * np.arange(n_samples), positions, velocities)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an ephemeris saved with save()
+        :param path: the .npz file to read
+        :return: an Ephemeris() instance
+        """
+        with np.load(path) as data:
+            return cls(data["times"], data["positions"], data["velocities"])
+
+    def save(self, path):
+        """
+        Saves the ephemeris, e.g. to reuse it in later runs
+        :param path: the .npz file to write
+        """
+        np.savez(path, times = self.times, positions = self.positions, velocities = self.velocities)
+
+    def at(self, times, bodies = None):
+        """
+        Interpolates the states of bodies at some times
+        :param times: an array of times in seconds within the span of the ephemeris
+        :param bodies: the indices of the bodies to interpolate; all of them by default
+        :return: a tuple of (positions, velocities), each of shape times.shape + (number of bodies, 3)
+        """
+        times = np.asarray(times, dtype = float)
+        if np.any(times < self.times[0]) or np.any(times > self.times[-1]):
+            raise ValueError("Times outside of the ephemeris, which spans {:.6e}s to {:.6e}s".format(self.times[0],
+                                                                                                   self.times[-1]))
+        bodies = slice(None) if bodies is None else bodies
+        h = self.times[1] - self.times[0]
+        index = np.minimum(((times - self.times[0]) // h).astype(int), len(self.times) - 2)
+        s = ((times - self.times[index]) / h)[..., None, None]
+        p0, p1 = self.positions[index][..., bodies, :], self.positions[index + 1][..., bodies, :]
+        m0, m1 = h * self.velocities[index][..., bodies, :], h * self.velocities[index + 1][..., bodies, :]
+
+        # Cubic Hermite basis functions and their derivatives
+        positions = ((2 * s ** 3 - 3 * s ** 2 + 1) * p0 + (s ** 3 - 2 * s ** 2 + s) * m0
+                     + (-2 * s ** 3 + 3 * s ** 2) * p1 + (s ** 3 - s ** 2) * m1)
+        velocities = ((6 * s ** 2 - 6 * s) * p0 + (3 * s ** 2 - 4 * s + 1) * m0
+                      + (-6 * s ** 2 + 6 * s) * p1 + (3 * s ** 2 - 2 * s) * m1) / h
+        return positions, velocities
+
+
+def porkchop(ephemeris, origin, destination, departure_times, arrival_times, central = 0, central_mass = None):
+    """
+    Computes the change in velocity needed for a transfer between two bodies for every combination of departure and
+    arrival times (a "porkchop plot", after the shape of its contours). Each transfer is the two-body (Lambert) orbit
+    about the central body between the bodies' positions at those times, ignoring the pull of the two bodies
+    themselves, so the cheapest cell is a starting point for fine-tuning, e.g. with plan_burns().
+    :param ephemeris: an Ephemeris() of the bodies
+    :param origin: the index of the body to depart from, e.g. the Earth
+    :param destination: the index of the body to arrive at, e.g. Mars
+    :param departure_times: a (d,) array of departure times in seconds
+    :param arrival_times: an (a,) array of arrival times in seconds
+    :param central: the index of the central body, e.g. the Sun
+    :param central_mass: the mass of the central body in kg
+    :return: a (d, a) array with dtype PORKCHOP_DTYPE
+    """
+    departure_times = np.asarray(departure_times, dtype = float)
+    arrival_times = np.asarray(arrival_times, dtype = float)
+    origin_pos, origin_vel = (array[:, 1] - array[:, 0] for array in ephemeris.at(departure_times, [central, origin]))
+    target_pos, target_vel = (array[:, 1] - array[:, 0] for array in ephemeris.at(arrival_times,
+                                                                                  [central, destination]))
+    tof = arrival_times[None, :] - departure_times[:, None]
+    v1, v2 = solve_lambert(origin_pos[:, None, :], target_pos[None, :, :], tof, G * central_mass)
+
+    result = np.zeros(tof.shape, dtype = PORKCHOP_DTYPE)
+    result["departure_time"] = departure_times[:, None]
+    result["arrival_time"] = arrival_times[None, :]
+    result["departure_dv"] = np.linalg.norm(v1 - origin_vel[:, None, :], axis = -1)
+    result["arrival_dv"] = np.linalg.norm(v2 - target_vel[None, :, :], axis = -1)
+    result["total_dv"] = result["departure_dv"] + result["arrival_dv"]
+    return result
+
+
+def best_transfer(result, key = "total_dv"):
+    """
+    Finds the cheapest cell of a porkchop plot
+    :param result: an array from porkchop()
+    :param key: what to minimize: "total_dv" for a rendezvous, or "departure_dv" for a flyby
+    :return: the row of the cheapest cell
+    """
+    return result[np.unravel_index(np.nanargmin(result[key]), result.shape)]
+
+
+def transfer_state(ephemeris, transfer, origin, destination, t, central = 0, central_mass = None, clearance = 0.0):
+    """
+    Finds the state at time t of a ship on the transfer orbit of a cell of a porkchop plot, e.g. to start the ship on
+    it now even though it departs later: the ship then coasts along the same orbit and passes the origin at the
+    departure time. The transfer is re-solved from a point clearance meters further from the central body than the
+    origin, so the ship does not pass through the origin's center.
+    :param ephemeris: the Ephemeris() used for the porkchop plot
+    :param transfer: a row of the porkchop plot, e.g. from best_transfer()
+    :param origin: the index of the body to depart from
+    :param destination: the index of the body to arrive at
+    :param t: the time to find the ship's state at, in seconds
+    :param central: the index of the central body
+    :param central_mass: the mass of the central body in kg
+    :param clearance: the distance from the origin's center to depart from, in meters
+    :return: a tuple of ((3,) position, (3,) velocity) of the ship at time t, in the frame of the ephemeris
+    """
+    departure, arrival = transfer["departure_time"], transfer["arrival_time"]
+    start_pos, start_vel = ephemeris.at(departure, [central, origin])
+    end_pos = ephemeris.at(arrival, [central, destination])[0]
+    r1 = start_pos[1] - start_pos[0]
+    r1 = r1 + clearance * r1 / np.linalg.norm(r1)
+    mu = G * central_mass
+    v1 = solve_lambert(r1, end_pos[1] - end_pos[0], arrival - departure, mu)[0]
+
+    # Slide the ship along its orbit from the departure time to t, then move back to the frame of the ephemeris
+    elements = state_to_elements(r1, v1, mu)[0]
+    if not elements["e"] < 1:
+        raise ValueError("The transfer orbit is not elliptic, so it cannot be followed back in time here")
+    shifted = np.array(elements, dtype = ELEMENTS_DTYPE)
+    shifted["M"] += np.sqrt(mu / elements["a"] ** 3) * (t - departure)
+    positions, velocities = elements_to_state(*(shifted[name] for name in ELEMENTS_DTYPE.names), mu)
+    central_pos, central_vel = (array[0] for array in ephemeris.at(t, [central]))
+    return positions + central_pos, velocities + central_vel
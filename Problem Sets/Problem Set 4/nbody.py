@@ -0,0 +1,678 @@
+import os
+
+import numpy as np
+
+from records import RecordArray, RecordHandle, record_field
+
+# Physical constants
+G = 6.674e-11  # gravitational constant, m^3 kg^-1 s^-2
+
+
+def body_states(bodies):
+    """
+    Gathers the positions and velocities of many bodies into arrays
+    :param bodies: a list of Body() instances, or a BodyArray()
+    :return: a tuple of (positions, velocities), each an (n, 3) array
+    """
+    if isinstance(bodies, BodyArray):
+        return bodies.positions.copy(), bodies.velocities.copy()
+    pos = np.array([[body.x, body.y, body.z] for body in bodies], dtype = float)
+    vel = np.array([[body.vx, body.vy, body.vz] for body in bodies], dtype = float)
+    return pos, vel
+
+
+def set_body_states(bodies, state):
+    """
+    Writes positions and velocities from arrays back into many bodies
+    :param bodies: a list of Body() instances, or a BodyArray()
+    :param state: a tuple of (positions, velocities), each an (n, 3) array
+    """
+    if isinstance(bodies, BodyArray):
+        bodies.state = state
+        return
+    for body, (x, y, z), (vx, vy, vz) in zip(bodies, *state):
+        body.x, body.y, body.z = x, y, z
+        body.vx, body.vy, body.vz = vx, vy, vz
+
+
+def pairwise_sum(values, axis = 0):
+    """
+    Sums an array along an axis by adding neighboring pairs, then neighboring pairs of those sums, and so on. Each step
+    is an elementwise addition, and the order of the additions depends only on the length of the axis, so the result
+    is bitwise identical however NumPy (or the BLAS library behind einsum) would have vectorized or threaded the sum.
+    :param values: an array to sum
+    :param axis: the axis to sum along
+    :return: the array of sums, with that axis removed
+    """
+    values = np.moveaxis(values, axis, 0)
+    if len(values) == 0:
+        return np.zeros(values.shape[1:], dtype = values.dtype)
+    while len(values) > 1:
+        pairs = values[:len(values) - len(values) % 2:2] + values[1::2]
+        values = np.concatenate([pairs, values[-1:]]) if len(values) % 2 else pairs
+    return values[0]
+
+
+def compute_accelerations(positions, masses, deterministic = False):
+    """
+    Computes the gravitational acceleration of every body due to every other body at once; this is the vectorized
+    equivalent of calling compute_acceleration(body1, body2) for every pair of bodies
+    :param positions: an (n, 3) array of positions in meters, either float64 or float32
+    :param masses: an (n,) array of masses in kg, of the same dtype as positions
+    :param deterministic: if True, add everything up in a fixed order with pairwise_sum(), so the result is bitwise
+                          reproducible across machines and libraries; this is slower than the default einsum
+    :return: an (n, 3) array of accelerations in m/s^2, of the same dtype as positions
+    """
+    separation = positions[:, None, :] - positions[None, :, :]
+    if deterministic:
+        distance = np.sqrt(separation[..., 0] ** 2 + separation[..., 1] ** 2 + separation[..., 2] ** 2)
+    else:
+        distance = np.sqrt(np.sum(separation ** 2, axis = -1))
+    np.fill_diagonal(distance, np.inf)  # a body does not attract itself
+
+    # A unit vector over distance squared rather than separation over distance cubed, since the cube of a solar system
+    # distance overflows float32
+    distance = distance[:, :, None]
+    if deterministic:
+        return -G * pairwise_sum(masses[None, :, None] * (separation / distance / distance ** 2), axis = 1)
+    return -G * np.einsum("j,ijk->ik", masses, separation / distance / distance ** 2)
+
+
+def euler_cromer_step(state, masses, dt, deterministic = False):
+    """
+    Advances a state by one step in the same way as the main simulation loop: every velocity is updated from the
+    accelerations at the current positions, then every position is updated with the new velocities
+    :param state: a tuple of (positions, velocities), each an (n, 3) array
+    :param masses: an (n,) array of masses in kg
+    :param dt: the timestep in seconds
+    :param deterministic: if True, compute the accelerations in a fixed order, for bitwise reproducible runs
+    :return: the new (positions, velocities)
+    """
+    positions, velocities = state
+    velocities = velocities + compute_accelerations(positions, masses, deterministic) * dt
+    return positions + velocities * dt, velocities
+
+
+def euler_cromer_propagator(masses, deterministic = False):
+    """
+    Makes a function (state, tau) -> state which advances a state by any time tau with euler_cromer_step(), for use with
+    an EventDetector()
+    :param masses: an (n,) array of masses in kg
+    :param deterministic: if True, compute the accelerations in a fixed order, for bitwise reproducible runs
+    """
+    return lambda state, tau: euler_cromer_step(state, masses, tau, deterministic)
+
+
+def kahan_add(total, compensation, increment):
+    """
+    Adds an increment to a running total in place with Kahan compensated summation: the low-order bits which are lost
+    when a small increment is added to a large total are kept in compensation and fed back into the next addition, so
+    the error stays at the level of one rounding instead of growing with the number of additions
+    :param total: an array to add to, modified in place
+    :param compensation: an array of the same shape holding the lost bits (start it at zero), modified in place
+    :param increment: an array of the same shape to add
+    """
+    corrected = increment - compensation
+    new_total = total + corrected
+    compensation[...] = (new_total - total) - corrected
+    total[...] = new_total
+
+
+class MixedPrecisionState:
+    """
+    This class stores the positions and velocities of many bodies in float32, which halves the memory traffic of the
+    gravity kernel. Positions are stored as offsets from a float64 reference origin, so they only need to resolve
+    distances within the system rather than from wherever the coordinates happen to start, and every update is added
+    with Kahan compensation, so the rounding of millions of small steps does not add up and destroy long-term orbits.
+    """
+
+    def __init__(self, state, origin = None, dtype = np.float32):
+        """
+        :param state: a tuple of (positions, velocities), each an (n, 3) array
+        :param origin: the (3,) float64 reference origin; defaults to the mean position of the bodies
+        :param dtype: the storage dtype
+        """
+        positions, velocities = (np.asarray(array, dtype = float) for array in state)
+        self.origin = positions.mean(axis = 0) if origin is None else np.array(origin, dtype = float)
+        self.offsets = (positions - self.origin).astype(dtype)
+        self.offset_compensation = np.zeros_like(self.offsets)
+        self.velocities = velocities.astype(dtype)
+        self.velocity_compensation = np.zeros_like(self.velocities)
+
+    @property
+    def state(self):
+        """The (positions, velocities) in float64, including the bits held in the compensation terms"""
+        positions = self.origin + (self.offsets.astype(float) - self.offset_compensation)
+        return positions, self.velocities.astype(float) - self.velocity_compensation
+
+    def step(self, masses, dt, deterministic = False):
+        """
+        Advances the bodies by one timestep in the same way as euler_cromer_step()
+        :param masses: an (n,) array of masses in kg, of the storage dtype
+        :param dt: the timestep in seconds
+        :param deterministic: if True, compute the accelerations in a fixed order, for bitwise reproducible runs
+        """
+        dt = self.offsets.dtype.type(dt)
+        accelerations = compute_accelerations(self.offsets, masses, deterministic)
+        kahan_add(self.velocities, self.velocity_compensation, accelerations * dt)
+        kahan_add(self.offsets, self.offset_compensation, self.velocities * dt)
+
+
+class NBodySimulation:
+    """
+    This class represents a gravitational simulation with no visuals: the same physics as the main loop of the solar
+    system simulator, done on arrays. It keeps its clock in its own SimulationContext(), so many simulations can run
+    side by side in one interpreter. With precision = "float32" the bodies are stored in a MixedPrecisionState(),
+    for large ensembles of test particles where memory bandwidth matters more than the last few digits. With
+    deterministic = True every step is bitwise reproducible, so two runs can be compared exactly in regression tests.
+    """
+
+    def __init__(self, masses, state, context, precision = "float64", deterministic = False):
+        """
+        :param masses: an (n,) array of masses in kg
+        :param state: a tuple of (positions, velocities), each an (n, 3) array
+        :param context: a SimulationContext() holding the clock and timestep
+        :param precision: "float64", or "float32" for mixed-precision storage
+        :param deterministic: if True, add up the forces in a fixed order so runs are bitwise reproducible
+        """
+        if precision not in ("float64", "float32"):
+            raise ValueError("Unknown precision: {}".format(precision))
+        self.precision = precision
+        self.deterministic = deterministic
+        self.masses = np.asarray(masses, dtype = precision)
+        if precision == "float32":
+            self.mixed = MixedPrecisionState(state)
+        else:
+            self.mixed = None
+            self._state = tuple(np.array(array, dtype = float) for array in state)
+        self.context = context
+
+    @classmethod
+    def from_bodies(cls, bodies, context, precision = "float64", deterministic = False):
+        """
+        Makes a simulation starting from the current state of some bodies
+        :param bodies: a list of Body() instances, or a BodyArray()
+        :param context: a SimulationContext() holding the clock and timestep
+        :param precision: "float64", or "float32" for mixed-precision storage
+        :param deterministic: if True, add up the forces in a fixed order so runs are bitwise reproducible
+        :return: an NBodySimulation() instance
+        """
+        masses = bodies.masses if isinstance(bodies, BodyArray) else [body.mass for body in bodies]
+        return cls(masses, body_states(bodies), context, precision, deterministic)
+
+    @property
+    def state(self):
+        """The (positions, velocities) of the bodies in float64"""
+        return self.mixed.state if self.mixed is not None else self._state
+
+    @property
+    def positions(self):
+        return self.state[0]
+
+    def step(self):
+        """Advances the simulation by one timestep"""
+        if self.mixed is not None:
+            self.mixed.step(self.masses, self.context.dt, self.deterministic)
+        else:
+            self._state = euler_cromer_step(self._state, self.masses, self.context.dt, self.deterministic)
+        self.context.advance()
+
+    def snapshot(self):
+        """
+        Freezes the current state of the simulation, so any number of branches can be forked from it
+        :return: a StateSnapshot() instance
+        """
+        return StateSnapshot(self.masses.astype(float), self.state, self.context)
+
+
+class StateSnapshot:
+    """
+    This class holds a frozen, read-only copy of the state of a simulation at some time t. Any number of branches can
+    be forked from it to try different maneuvers; the branches share the snapshot's arrays rather than copying them.
+    """
+
+    def __init__(self, masses, state, context, copy = True):
+        """
+        :param masses: an (n,) array of masses in kg
+        :param state: a tuple of (positions, velocities), each an (n, 3) array; copied unless already read-only
+        :param context: the SimulationContext() of the simulation; copied, so the snapshot keeps the time t
+        :param copy: if False, take over masses and state (e.g. the fresh arrays from body_states()) and make them
+                     read-only rather than copying them; nothing else may hold on to them then
+        """
+        self.masses, *state = (_frozen(array, copy) for array in (masses, *state))
+        self.state = tuple(state)
+        self.context = context.copy()
+
+    def fork(self, deterministic = False):
+        """
+        Starts a new branch from this snapshot
+        :param deterministic: if True, add up the forces in a fixed order so the branch is bitwise reproducible
+        :return: an NBodyBranch() instance
+        """
+        return NBodyBranch(self, deterministic)
+
+
+def _frozen(array, copy = True):
+    """
+    Returns a read-only float64 array with the contents of array, copying it only if it could still change; with copy
+    False, a writeable array which owns its memory is made read-only in place instead
+    """
+    array = np.asarray(array, dtype = float)
+    if array.flags.writeable or array.base is not None and array.base.flags.writeable:
+        if copy or array.base is not None:
+            array = array.copy()
+        array.flags.writeable = False
+    return array
+
+
+class NBodyBranch(NBodySimulation):
+    """
+    This class is a simulation forked from a StateSnapshot(), e.g. to try one of several burns of a spaceship from the
+    same moment. Until it takes its first step it shares the snapshot's arrays, and the only memory it allocates is for
+    the changes made to individual bodies with apply_burn(); euler_cromer_step() always makes new arrays rather than
+    writing into old ones, so stepping a branch can never change the snapshot or its other branches.
+    """
+
+    def __init__(self, snapshot, deterministic = False):
+        """
+        :param snapshot: the StateSnapshot() to start from
+        :param deterministic: if True, add up the forces in a fixed order so the branch is bitwise reproducible
+        """
+        self.parent = snapshot
+        self.precision = "float64"
+        self.deterministic = deterministic
+        self.masses = snapshot.masses
+        self.mixed = None
+        self._state = snapshot.state
+        self.context = snapshot.context.copy()
+        self.burns = {}  # body index -> change in velocity in m/s, not yet applied to the state
+
+    def apply_burn(self, index, delta_v):
+        """
+        Changes the velocity of one body, e.g. to fire a spaceship's engine
+        :param index: the index of the body
+        :param delta_v: the (3,) change in velocity in m/s
+        """
+        self.burns[index] = self.burns.get(index, 0.0) + np.asarray(delta_v, dtype = float)
+
+    def _apply_burns(self):
+        """Copies the velocities (the positions stay shared) and applies the pending burns to them"""
+        if self.burns:
+            velocities = np.array(self._state[1])
+            for index, delta_v in self.burns.items():
+                velocities[index] += delta_v
+            self._state = (self._state[0], velocities)
+            self.burns = {}
+
+    @property
+    def state(self):
+        """The (positions, velocities) of the bodies; these may be the snapshot's read-only arrays"""
+        self._apply_burns()
+        return self._state
+
+    def step(self):
+        """Advances the branch by one timestep"""
+        self._apply_burns()
+        super().step()
+
+
+# Compact body storage =================================================================================================
+
+# Everything the physics needs to know about a body, packed into 64 bytes; a million bodies take 64 MB
+BODY_DTYPE = np.dtype([
+    ("mass", float),  # mass of the body in kg
+    ("pos", float, 3),  # x, y, z coordinates of the body in meters
+    ("vel", float, 3),  # vx, vy, vz of the body in m/s
+    ("radius", float),  # radius of the body in meters
+])
+
+
+class BodyHandle(RecordHandle):
+    """
+    This class is a lightweight view of one body in a BodyArray(), with the same .mass, .x ... .vz and .radius
+    attributes as a Body(), plus .pos and .vel as (3,) arrays. It stores nothing but the array and an index, so
+    reading or writing its attributes changes the array directly.
+    """
+
+    __slots__ = ()
+
+    mass = record_field("mass")
+    radius = record_field("radius")
+    pos = record_field("pos")
+    vel = record_field("vel")
+    x, y, z = (record_field("pos", axis) for axis in range(3))
+    vx, vy, vz = (record_field("vel", axis) for axis in range(3))
+
+    def __repr__(self):
+        return "BodyHandle({}, mass = {:.3e}, pos = {}, vel = {})".format(self.index, self.mass, self.pos, self.vel)
+
+
+class BodyArray(RecordArray):
+    """
+    This class stores many bodies in one NumPy structured array rather than as separate objects, so they take 64 bytes
+    each and the positions, velocities and masses are array views that the vectorized functions in this module can use
+    directly. Indexing it gives a BodyHandle() which behaves like a Body().
+    """
+
+    dtype = BODY_DTYPE
+    handle = BodyHandle
+
+    @classmethod
+    def from_arrays(cls, masses, positions, velocities, radii = 1e8):
+        """
+        Makes an array of bodies from arrays of their properties, without making any per-body objects
+        :param masses: an (n,) array of masses in kg
+        :param positions: an (n, 3) array of positions in meters
+        :param velocities: an (n, 3) array of velocities in m/s
+        :param radii: the radii of the bodies in meters, a scalar or an (n,) array
+        :return: a BodyArray() instance
+        """
+        bodies = cls(capacity = len(positions))
+        bodies.extend(masses, positions, velocities, radii)
+        return bodies
+
+    @classmethod
+    def from_bodies(cls, bodies):
+        """
+        Copies the state of some Body() instances into a new array
+        :param bodies: a list of Body() instances
+        :return: a BodyArray() instance
+        """
+        return cls.from_arrays([body.mass for body in bodies], *body_states(bodies), [body.radius for body in bodies])
+
+    def append(self, mass, pos = (0.0, 0.0, 0.0), vel = (0.0, 0.0, 0.0), radius = 1e8):
+        """
+        Adds a body to the end of the array, doubling its capacity if it is full
+        :return: a BodyHandle() of the new body
+        """
+        self._grow(1)[0] = (mass, pos, vel, radius)
+        return self[-1]
+
+    def extend(self, masses, positions, velocities, radii = 1e8):
+        """
+        Adds many bodies to the end of the array at once, growing it at most once
+        :param masses: the masses of the new bodies in kg, a scalar or an (n,) array
+        :param positions: an (n, 3) array of positions in meters
+        :param velocities: an (n, 3) array of velocities in m/s
+        :param radii: the radii of the new bodies in meters, a scalar or an (n,) array
+        """
+        new = self._grow(len(positions))
+        new["mass"], new["pos"], new["vel"], new["radius"] = masses, positions, velocities, radii
+
+    @property
+    def masses(self):
+        return self.records["mass"][:self.count]
+
+    @property
+    def positions(self):
+        return self.records["pos"][:self.count]
+
+    @property
+    def velocities(self):
+        return self.records["vel"][:self.count]
+
+    @property
+    def radii(self):
+        return self.records["radius"][:self.count]
+
+    @property
+    def state(self):
+        """The (positions, velocities) of the bodies, as views into the array"""
+        return self.positions, self.velocities
+
+    @state.setter
+    def state(self, state):
+        self.positions[:] = state[0]
+        self.velocities[:] = state[1]
+
+    def step(self, dt):
+        """
+        Advances every body by one timestep in place, in the same way as the main simulation loop
+        :param dt: the timestep in seconds
+        """
+        self.state = euler_cromer_step(self.state, self.masses, dt)
+
+
+# Batched ensembles ====================================================================================================
+
+# Per-system diagnostics returned by BatchedNBodySimulation.diagnostics(), one row per system
+DIAGNOSTICS_DTYPE = np.dtype([
+    ("kinetic_energy", float),  # J
+    ("potential_energy", float),  # J
+    ("energy", float),  # J
+    ("energy_error", float),  # relative change in the total energy since the start of the run
+    ("angular_momentum", float, 3),  # total angular momentum in kg m^2/s
+    ("angular_momentum_error", float),  # relative change in the magnitude of the angular momentum since the start
+    ("min_separation", float),  # smallest distance between any two bodies in meters, at this step
+])
+
+
+def compute_batched_accelerations(positions, masses):
+    """
+    Computes the gravitational accelerations of the bodies of many independent systems at once, in the same way as
+    compute_accelerations() does for one system
+    :param positions: a (b, n, 3) array of the positions of n bodies in each of b systems, in meters
+    :param masses: an (n,) array of masses in kg shared by every system, or a (b, n) array
+    :return: a (b, n, 3) array of accelerations in m/s^2
+    """
+    masses = np.broadcast_to(masses, positions.shape[:2])
+    separation = positions[:, :, None, :] - positions[:, None, :, :]
+    distance = np.sqrt(np.sum(separation ** 2, axis = -1))
+    distance[:, np.arange(positions.shape[1]), np.arange(positions.shape[1])] = np.inf
+    distance = distance[..., None]
+    return -G * np.einsum("bj,bijk->bik", masses, separation / distance / distance ** 2)
+
+
+def batched_euler_cromer_step(state, masses, dt):
+    """
+    Advances many independent systems by one step in the same way as euler_cromer_step()
+    :param state: a tuple of (positions, velocities), each a (b, n, 3) array
+    :param masses: an (n,) array of masses in kg, or a (b, n) array
+    :param dt: the timestep in seconds
+    :return: the new (positions, velocities)
+    """
+    positions, velocities = state
+    velocities = velocities + compute_batched_accelerations(positions, masses) * dt
+    return positions + velocities * dt, velocities
+
+
+class BatchedNBodySimulation:
+    """
+    This class advances many copies of the same system (e.g. the solar system with slightly different initial
+    conditions) together. The states of all b systems are stored as (b, n, 3) arrays and each step is one vectorized
+    call, so the Python overhead of a step is paid once for the whole batch rather than once per system, as it would be
+    with one NBodySimulation() per system. The systems share one SimulationContext(), and hence one clock and timestep.
+    """
+
+    def __init__(self, masses, state, context):
+        """
+        :param masses: an (n,) array of masses in kg shared by every system, or a (b, n) array
+        :param state: a tuple of (positions, velocities), each a (b, n, 3) array
+        :param context: a SimulationContext() holding the clock and timestep
+        """
+        self.state = tuple(np.array(array, dtype = float) for array in state)
+        if self.state[0].ndim != 3 or self.state[0].shape != self.state[1].shape:
+            raise ValueError("Expected (b, n, 3) positions and velocities, got {} and {}".format(
+                    self.state[0].shape, self.state[1].shape))
+        self.masses = np.broadcast_to(np.asarray(masses, dtype = float), self.state[0].shape[:2])
+        self.context = context
+        self.initial = self.diagnostics()
+
+    @classmethod
+    def from_perturbations(cls, masses, state, context, count, position_scale = 0.0, velocity_scale = 0.0,
+                           seed = None):
+        """
+        Makes a batch of copies of one system, each with small random (normally distributed) changes to the positions
+        and velocities of its bodies
+        :param masses: an (n,) array of masses in kg
+        :param state: a tuple of (positions, velocities), each an (n, 3) array
+        :param context: a SimulationContext() holding the clock and timestep
+        :param count: the number of systems to make
+        :param position_scale: the standard deviation of the change in each position coordinate, in meters
+        :param velocity_scale: the standard deviation of the change in each velocity component, in m/s
+        :param seed: the seed for the random number generator, so the batch can be made again exactly
+        :return: a BatchedNBodySimulation() instance
+        """
+        rng = np.random.default_rng(seed)
+        positions, velocities = (np.asarray(array, dtype = float) for array in state)
+        positions = positions + rng.normal(scale = position_scale, size = (count,) + positions.shape)
+        velocities = velocities + rng.normal(scale = velocity_scale, size = (count,) + velocities.shape)
+        return cls(masses, (positions, velocities), context)
+
+    def __len__(self):
+        return len(self.state[0])
+
+    @property
+    def positions(self):
+        return self.state[0]
+
+    def step(self, steps = 1):
+        """
+        Advances every system by some number of timesteps
+        :param steps: the number of timesteps to take
+        """
+        for _ in range(steps):
+            self.state = batched_euler_cromer_step(self.state, self.masses, self.context.dt)
+            self.context.advance()
+
+    def diagnostics(self):
+        """
+        Computes the conserved quantities of every system, and how far each has drifted since the start of the run
+        :return: an array with dtype DIAGNOSTICS_DTYPE and one row per system
+        """
+        positions, velocities = self.state
+        separation = positions[:, :, None, :] - positions[:, None, :, :]
+        distance = np.sqrt(np.sum(separation ** 2, axis = -1))
+        n = positions.shape[1]
+        distance[:, np.arange(n), np.arange(n)] = np.inf
+
+        result = np.zeros(len(positions), dtype = DIAGNOSTICS_DTYPE)
+        result["kinetic_energy"] = 0.5 * np.einsum("bi,bik,bik->b", self.masses, velocities, velocities)
+        result["potential_energy"] = -0.5 * G * np.einsum("bi,bj,bij->b", self.masses, self.masses, 1 / distance)
+        result["energy"] = result["kinetic_energy"] + result["potential_energy"]
+        result["angular_momentum"] = np.einsum("bi,bik->bk", self.masses, np.cross(positions, velocities))
+        result["min_separation"] = distance.reshape(len(positions), -1).min(axis = 1)
+
+        initial = getattr(self, "initial", result)
+        magnitude = np.linalg.norm(result["angular_momentum"], axis = 1)
+        initial_magnitude = np.linalg.norm(initial["angular_momentum"], axis = 1)
+        with np.errstate(divide = "ignore", invalid = "ignore"):  # a system may start with zero energy or spin
+            result["energy_error"] = np.abs((result["energy"] - initial["energy"]) / initial["energy"])
+            result["angular_momentum_error"] = np.abs(magnitude - initial_magnitude) / initial_magnitude
+        return result
+
+
+# Tiled and out-of-core kernels ========================================================================================
+
+def tiled_accelerations(targets, sources, masses, tile_size = 64, out = None):
+    """
+    Computes the gravitational acceleration of many targets due to many sources, in square blocks of at most
+    tile_size targets by tile_size sources, so the scratch memory is bounded by tile_size ** 2 rather than growing with
+    the number of targets times the number of sources. A source at exactly the position of a target (such as a body
+    and itself, when targets and sources are the same array) exerts no force on it.
+    :param targets: an (n, 3) array of positions in meters, e.g. of test particles
+    :param sources: an (m, 3) array of positions of the attracting bodies in meters
+    :param masses: an (m,) array of masses of the sources in kg
+    :param tile_size: the number of targets and of sources in each block; 64 keeps each block's scratch arrays (three
+                      of 64 * 64 * 3 floats, about 300 KB) within the L2 cache of most CPUs
+    :param out: an (n, 3) array to write the accelerations into; a new one is made if not given
+    :return: the (n, 3) array of accelerations in m/s^2
+    """
+    targets = np.asarray(targets, dtype = float)
+    sources = np.asarray(sources, dtype = float)
+    masses = np.asarray(masses, dtype = float)
+    if out is None:
+        out = np.empty_like(targets)
+    for start in range(0, len(targets), tile_size):
+        block = targets[start:start + tile_size]
+        acceleration = np.zeros_like(block)
+        for source_start in range(0, len(sources), tile_size):
+            separation = block[:, None, :] - sources[None, source_start:source_start + tile_size, :]
+            distance = np.sqrt(np.sum(separation ** 2, axis = -1))
+            distance[distance == 0] = np.inf
+            distance = distance[:, :, None]
+            acceleration += np.einsum("j,ijk->ik", masses[source_start:source_start + tile_size],
+                                      separation / distance / distance ** 2)
+        out[start:start + tile_size] = -G * acceleration
+    return out
+
+
+def create_particle_file(path, positions = None, velocities = None, count = None, chunk_size = 65536):
+    """
+    Makes a .npy file holding the state of many test particles, as a (2, n, 3) array of positions then velocities,
+    which TestParticleSimulation() can memory-map. It is written chunk by chunk, so the particles never all need to be
+    in memory at once.
+    :param path: the file to write
+    :param positions: an (n, 3) array (or memory-mapped array) of positions in meters; zeros if not given
+    :param velocities: an (n, 3) array (or memory-mapped array) of velocities in m/s; zeros if not given
+    :param count: the number of particles, if neither positions nor velocities are given
+    :param chunk_size: the number of particles to copy at a time
+    :return: the file, memory-mapped for reading and writing
+    """
+    if count is None:
+        count = len(positions if positions is not None else velocities)
+    particles = np.lib.format.open_memmap(path, mode = "w+", dtype = float, shape = (2, count, 3))
+    for start in range(0, count, chunk_size):
+        for index, array in enumerate((positions, velocities)):
+            if array is not None:
+                particles[index, start:start + chunk_size] = array[start:start + chunk_size]
+    particles.flush()
+    return particles
+
+
+class TestParticleSimulation:
+    """
+    This class represents a few massive bodies (such as the solar system) moving many massless test particles, such as
+    asteroids or spacecraft debris, which feel the gravity of the bodies but do not pull on them or on each other. The
+    particles can be a memory-mapped file made by create_particle_file(), and are read, stepped and written back a
+    chunk at a time, so the memory used stays the same however many particles there are, even more than fit in RAM.
+    """
+
+    def __init__(self, masses, state, particles, context, chunk_size = 65536, tile_size = 64):
+        """
+        :param masses: an (m,) array of the masses of the massive bodies in kg
+        :param state: a tuple of (positions, velocities) of the massive bodies, each an (m, 3) array
+        :param particles: a (2, n, 3) array of the positions then velocities of the test particles, or the path (a
+                          str or os.PathLike) of a file made by create_particle_file(); it is updated in place
+        :param context: a SimulationContext() holding the clock and timestep
+        :param chunk_size: the number of test particles to load and step at a time
+        :param tile_size: the block size for tiled_accelerations()
+        """
+        self.masses = np.asarray(masses, dtype = float)
+        self.state = tuple(np.array(array, dtype = float) for array in state)
+        if isinstance(particles, (str, os.PathLike)):
+            particles = np.load(os.fspath(particles), mmap_mode = "r+")
+        self.particles = particles
+        self.context = context
+        self.chunk_size = chunk_size
+        self.tile_size = tile_size
+
+    def __len__(self):
+        return self.particles.shape[1]
+
+    @property
+    def positions(self):
+        """The positions of the massive bodies; the test particles are in self.particles"""
+        return self.state[0]
+
+    def step(self):
+        """Advances the massive bodies and every test particle by one timestep, as in euler_cromer_step()"""
+        dt = self.context.dt
+        sources = self.state[0]
+        acceleration = None
+        for start in range(0, len(self), self.chunk_size):
+            positions = np.array(self.particles[0, start:start + self.chunk_size])
+            velocities = np.array(self.particles[1, start:start + self.chunk_size])
+            if acceleration is None or len(acceleration) != len(positions):
+                acceleration = np.empty_like(positions)
+            velocities += tiled_accelerations(positions, sources, self.masses, self.tile_size, acceleration) * dt
+            positions += velocities * dt
+            self.particles[0, start:start + self.chunk_size] = positions
+            self.particles[1, start:start + self.chunk_size] = velocities
+        self.state = euler_cromer_step(self.state, self.masses, dt)
+        self.context.advance()
+
+    def flush(self):
+        """Writes the test particles back to their file, if they are memory-mapped"""
+        if isinstance(self.particles, np.memmap):
+            self.particles.flush()
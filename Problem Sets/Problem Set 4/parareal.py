@@ -0,0 +1,128 @@
+import math
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from nbody import compute_accelerations, euler_cromer_step
+
+
+def leapfrog_step(state, masses, dt):
+    """
+    Advances a state by one step with the kick-drift-kick leapfrog (velocity Verlet) method, which is second order and
+    so far more accurate than euler_cromer_step() for the same timestep, at the cost of one more force evaluation
+    :param state: a tuple of (positions, velocities), each an (n, 3) array
+    :param masses: an (n,) array of masses in kg
+    :param dt: the timestep in seconds
+    :return: the new (positions, velocities)
+    """
+    positions, velocities = state
+    velocities = velocities + compute_accelerations(positions, masses) * dt / 2
+    positions = positions + velocities * dt
+    return positions, velocities + compute_accelerations(positions, masses) * dt / 2
+
+
+STEPPERS = {
+    "euler_cromer": euler_cromer_step,
+    "leapfrog": leapfrog_step,
+}
+
+
+class Propagator:
+    """
+    This class advances a state by any length of time with fixed steps of at most dt. Unlike euler_cromer_propagator()
+    it can be pickled, so it can be sent to the worker processes of parareal().
+    """
+
+    def __init__(self, masses, dt, method = "euler_cromer"):
+        """
+        :param masses: an (n,) array of masses in kg
+        :param dt: the longest timestep to take in seconds
+        :param method: "euler_cromer" (like the main simulation loop) or "leapfrog"
+        """
+        if method not in STEPPERS:
+            raise ValueError("Unknown method: {}".format(method))
+        self.masses = np.asarray(masses, dtype = float)
+        self.dt = dt
+        self.method = method
+
+    def __call__(self, state, tau):
+        """
+        Advances a state by a time tau, in as few equal steps of at most dt as possible
+        :param state: a tuple of (positions, velocities), each an (n, 3) array
+        :param tau: the time to advance by in seconds
+        :return: the new (positions, velocities)
+        """
+        step = STEPPERS[self.method]
+        n_steps = max(math.ceil(abs(tau) / self.dt - 1e-9), 1)
+        for _ in range(n_steps):
+            state = step(state, self.masses, tau / n_steps)
+        return state
+
+
+def _run_slice(args):
+    """Runs the fine propagator over one time slice in a worker process"""
+    fine, state, tau = args
+    return fine(state, tau)
+
+
+def parareal(state, duration, slices, coarse, fine, tol = 1e-9, max_iterations = None, processes = None):
+    """
+    Integrates a state over a long time with the Parareal method, which spreads the work of an accurate (fine)
+    integrator across processes even though time itself is serial. The run is cut into time slices; the cheap coarse
+    integrator guesses the state at the start of every slice, the fine integrator then runs every slice from its guess
+    at the same time, one per process, and the coarse integrator carries the corrections forward from slice to slice.
+    This repeats until the states at the slice boundaries stop changing; after k iterations the first k slices are
+    exactly what a serial fine run would give, so it never takes more than one iteration per slice. It only saves wall
+    time when it converges in well under that, which needs a coarse integrator good enough to follow the orbits across
+    one slice, so keep the slices to a fraction of the shortest orbital period that matters. On Windows and macOS this
+    must be called from under if __name__ == "__main__", since the worker processes import the calling script.
+    :param state: the initial (positions, velocities), each an (n, 3) array
+    :param duration: the time to integrate for in seconds
+    :param slices: the number of time slices; usually the number of processes
+    :param coarse: a function (state, tau) -> state, e.g. Propagator(masses, dt = 5 days)
+    :param fine: a picklable function (state, tau) -> state, e.g. Propagator(masses, dt = 1 hour, method = "leapfrog")
+    :param tol: stop once no boundary position changes by more than this fraction of the size of the system
+    :param max_iterations: the most iterations to make; defaults to the number of slices, after which the result is
+                           the serial fine solution
+    :param processes: the number of worker processes; defaults to one per CPU, and 1 runs everything in this process
+    :return: a tuple of (a list of the slices + 1 states at the slice boundaries, the number of iterations made)
+    """
+    tau = duration / slices
+    if max_iterations is None:
+        max_iterations = slices
+    state = tuple(np.array(array, dtype = float) for array in state)
+    scale = np.max(np.abs(state[0]))
+
+    # Initial guess from the coarse integrator alone
+    boundaries = [state]
+    coarse_results = []
+    for _ in range(slices):
+        coarse_results.append(coarse(boundaries[-1], tau))
+        boundaries.append(coarse_results[-1])
+
+    executor = ProcessPoolExecutor(max_workers = processes) if processes != 1 else None
+    try:
+        iterations = 0
+        converged = 0  # the boundaries before this one are final
+        while iterations < max_iterations and converged < slices:
+            iterations += 1
+            tasks = [(fine, boundaries[k], tau) for k in range(converged, slices)]
+            fine_results = list(executor.map(_run_slice, tasks) if executor else map(_run_slice, tasks))
+
+            # Correct each boundary with the fine result of the slice before it, carrying the change forward with the
+            # coarse integrator: new = coarse(new start) + fine(old start) - coarse(old start)
+            change = 0.0
+            for k in range(converged, slices):
+                new_coarse = coarse(boundaries[k], tau)
+                fine_result = fine_results[k - converged]
+                new_boundary = tuple(g + f - old_g for g, f, old_g in zip(new_coarse, fine_result, coarse_results[k]))
+                change = max(change, np.max(np.abs(new_boundary[0] - boundaries[k + 1][0])) / scale)
+                coarse_results[k] = new_coarse
+                boundaries[k + 1] = new_boundary
+            converged += 1  # the first slice not yet final was just run exactly from an exact start
+            if change <= tol:
+                break
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return boundaries, iterations
@@ -0,0 +1,153 @@
+import json
+import time
+
+# Shared with the other problem set's simulator; see test_shared_modules.py before changing it.
+
+
+class _Phase:
+    """Times one named phase of the simulation loop; used as a context manager, e.g. with profiler.phase("forces")"""
+
+    __slots__ = ("name", "profiler", "total", "calls", "start")
+
+    def __init__(self, name, profiler):
+        self.name = name
+        self.profiler = profiler
+        self.total = 0  # nanoseconds
+        self.calls = 0
+        self.start = 0
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+
+    def __exit__(self, *exc_info):
+        end = time.perf_counter_ns()
+        self.total += end - self.start
+        self.calls += 1
+        trace = self.profiler.trace
+        if len(trace) < self.profiler.trace_limit:
+            trace.append((self.name, self.start, end))
+
+
+class _NullPhase:
+    """Does nothing, so a disabled profiler costs only a method call per phase"""
+
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class Profiler:
+    """
+    This class records how much wall time each phase of the simulation loop (e.g. forces, positions, polarity,
+    visuals) takes, and how many steps per second the simulation makes. Wrap each phase of the loop in
+    with profiler.phase(name): and call profiler.step() once per step. The results can be printed, saved as JSON, or
+    saved in the Chrome trace format to view in chrome://tracing or https://ui.perfetto.dev.
+    """
+
+    def __init__(self, enabled = True, trace_limit = 100000):
+        """
+        :param enabled: whether to record anything; this can be changed while the simulation runs
+        :param trace_limit: the most phase timings to keep for the trace; the totals keep counting after that
+        """
+        self.enabled = enabled
+        self.trace_limit = trace_limit
+        self.phases = {}
+        self.trace = []
+        self.steps = 0
+        self.elapsed = 0  # nanoseconds spent enabled, not counting the current stretch
+        self.enabled_since = time.perf_counter_ns() if enabled else None
+
+    def phase(self, name):
+        """
+        Gets the timer for a phase of the loop
+        :param name: the name of the phase
+        :return: a context manager which times the code inside it
+        """
+        if not self.enabled:
+            return _NULL_PHASE
+        timer = self.phases.get(name)
+        if timer is None:
+            timer = self.phases[name] = _Phase(name, self)
+        return timer
+
+    def step(self):
+        """Counts one step of the simulation"""
+        if self.enabled:
+            self.steps += 1
+
+    def set_enabled(self, enabled):
+        """
+        Starts or stops recording
+        :param enabled: whether to record
+        """
+        now = time.perf_counter_ns()
+        if self.enabled and not enabled:
+            self.elapsed += now - self.enabled_since
+        elif enabled and not self.enabled:
+            self.enabled_since = now
+        self.enabled = enabled
+
+    def wall_time(self):
+        """The wall time in seconds spent recording"""
+        elapsed = self.elapsed
+        if self.enabled:
+            elapsed += time.perf_counter_ns() - self.enabled_since
+        return elapsed / 1e9
+
+    def report(self):
+        """
+        Summarizes the recorded timings
+        :return: a dictionary with the total wall time, step count, steps per second, and the total time, number of
+                 calls and fraction of the wall time of each phase
+        """
+        wall_time = self.wall_time()
+        phases = {}
+        for name, timer in self.phases.items():
+            phases[name] = {
+                "seconds": timer.total / 1e9,
+                "calls": timer.calls,
+                "mean_microseconds": timer.total / 1e3 / max(timer.calls, 1),
+                "fraction": timer.total / 1e9 / wall_time if wall_time > 0 else 0.0,
+            }
+        return {
+            "wall_seconds": wall_time,
+            "steps": self.steps,
+            "steps_per_second": self.steps / wall_time if wall_time > 0 else 0.0,
+            "phases": phases,
+        }
+
+    def summary(self):
+        """A text table of the recorded timings"""
+        report = self.report()
+        lines = ["{} steps in {:.3f}s ({:.1f} steps/s)".format(report["steps"], report["wall_seconds"],
+                                                              report["steps_per_second"])]
+        for name, phase in sorted(report["phases"].items(), key = lambda item: -item[1]["seconds"]):
+            lines.append("  {:<12} {:8.3f}s {:6.1%} {:10.1f}us/call".format(
+                    name, phase["seconds"], phase["fraction"], phase["mean_microseconds"]))
+        return "\n".join(lines)
+
+    def save_json(self, path):
+        """
+        Saves the report as JSON
+        :param path: the file to write
+        """
+        with open(path, "w") as file:
+            json.dump(self.report(), file, indent = 2)
+
+    def save_chrome_trace(self, path):
+        """
+        Saves the recorded phase timings in the Chrome trace event format
+        :param path: the file to write
+        """
+        origin = min((start for _, start, _ in self.trace), default = 0)
+        events = [{"name": name, "ph": "X", "ts": (start - origin) / 1e3, "dur": (end - start) / 1e3, "pid": 0,
+                   "tid": 0} for name, start, end in self.trace]
+        with open(path, "w") as file:
+            json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
@@ -0,0 +1,85 @@
+import numpy as np
+
+# Shared with the other problem set's simulator; see test_shared_modules.py before changing it.
+#
+# This module stores many bodies or particles in one NumPy structured array rather than as separate objects, so each
+# takes a few dozen bytes and every field is an array view the vectorized code can use directly. Indexing the array
+# gives a lightweight handle which reads and writes one record in place.
+
+
+def record_field(name, axis = None):
+    """
+    Makes a property of a RecordHandle() subclass which reads and writes one field (or one component of a vector
+    field) of the handle's record
+    :param name: the name of the field in the structured dtype
+    :param axis: the component to read and write, for a vector field; None for the whole field
+    :return: a property
+    """
+
+    def get(self):
+        value = self.array.records[name][self.index]
+        return float(value) if value.ndim == 0 else value if axis is None else float(value[axis])
+
+    def set(self, value):
+        if axis is None:
+            self.array.records[name][self.index] = value
+        else:
+            self.array.records[name][self.index, axis] = value
+
+    return property(get, set)
+
+
+class RecordHandle:
+    """
+    This class is a lightweight view of one record in a RecordArray(). It stores nothing but the array and an index,
+    so reading or writing the properties its subclasses make with record_field() changes the array directly.
+    """
+
+    __slots__ = ("array", "index")
+
+    def __init__(self, array, index):
+        self.array = array
+        self.index = index
+
+
+class RecordArray:
+    """
+    This class stores records in one NumPy structured array which grows as needed, like a list. Subclasses set dtype,
+    the structured dtype of a record, and handle, the RecordHandle() subclass which indexing gives.
+    """
+
+    dtype = None
+    handle = RecordHandle
+
+    def __init__(self, capacity = 16):
+        """
+        :param capacity: the number of records to make room for; the array grows as needed
+        """
+        self.records = np.zeros(capacity, dtype = self.dtype)
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        if not -self.count <= index < self.count:
+            raise IndexError("Index {} out of range for a {} of {}".format(index, type(self).__name__, self.count))
+        return self.handle(self, index % self.count)
+
+    def __iter__(self):
+        return (self.handle(self, index) for index in range(self.count))
+
+    def _grow(self, count):
+        """
+        Adds records to the end of the array, at least doubling its capacity if they do not fit, so appending one at a
+        time takes amortized constant time
+        :param count: the number of records to add
+        :return: a view of the new records, all zero
+        """
+        start, stop = self.count, self.count + count
+        if stop > len(self.records):
+            records = np.zeros(max(2 * len(self.records), stop), dtype = self.dtype)
+            records[:self.count] = self.records[:self.count]
+            self.records = records
+        self.count = stop
+        return self.records[start:stop]
@@ -0,0 +1,256 @@
+import asyncio
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Shared with the other problem set's simulator; see test_shared_modules.py before changing it.
+#
+# This module serves any headless simulation with a step() method, a context (a SimulationContext()) and an (n, 3) array
+# of positions, such as an NBodySimulation() or a CyclotronBunch().
+#
+# Every message on the wire is a 4-byte little-endian length followed by that many bytes. A client first sends one
+# message holding the uint16 ids of the simulations it wants (empty for all of them); the server then sends frames,
+# each a FRAME_HEADER followed by n * 3 float32 values. A key frame holds the positions themselves, and a delta frame
+# holds the change since the last frame sent to that client, so the small motions between frames keep their precision
+# in float32 even when the positions themselves are large.
+
+FRAME_HEADER = struct.Struct("<HBxIQd")  # simulation id, frame kind, number of positions, iteration, time
+KEY_FRAME = 0
+DELTA_FRAME = 1
+LENGTH = struct.Struct("<I")
+
+
+async def read_message(reader):
+    """
+    Reads one length-prefixed message from a stream
+    :param reader: an asyncio.StreamReader
+    :return: the message as bytes, or None if the stream was closed
+    """
+    try:
+        (length,) = LENGTH.unpack(await reader.readexactly(LENGTH.size))
+        return await reader.readexactly(length)
+    except asyncio.IncompleteReadError:
+        return None
+
+
+def write_message(writer, message):
+    """
+    Writes one length-prefixed message to a stream; await writer.drain() afterwards to respect backpressure
+    :param writer: an asyncio.StreamWriter
+    :param message: the message as bytes
+    """
+    writer.write(LENGTH.pack(len(message)) + message)
+
+
+class FrameEncoder:
+    """
+    This class encodes the positions of one simulation for one subscriber. It remembers exactly what the subscriber
+    has reconstructed so far, so deltas never accumulate float32 rounding error, and frames may be skipped freely.
+    """
+
+    def __init__(self, simulation_id, keyframe_interval = 100):
+        """
+        :param simulation_id: the id of the simulation, sent in every frame
+        :param keyframe_interval: send a key frame after this many delta frames, so a client can resynchronize
+        """
+        self.simulation_id = simulation_id
+        self.keyframe_interval = keyframe_interval
+        self.reconstructed = None  # the positions as the subscriber has decoded them
+        self.frames_since_key = 0
+
+    def encode(self, positions, iteration, t):
+        """
+        Encodes a frame
+        :param positions: an (n, 3) array of positions
+        :param iteration: the number of steps the simulation has taken
+        :param t: the simulation time in seconds
+        :return: the frame as bytes
+        """
+        positions = np.asarray(positions, dtype = float)
+        key = (self.reconstructed is None or self.reconstructed.shape != positions.shape
+               or self.frames_since_key >= self.keyframe_interval)
+        if key:
+            values = positions.astype(np.float32)
+            self.reconstructed = values.astype(float)
+            self.frames_since_key = 0
+        else:
+            values = (positions - self.reconstructed).astype(np.float32)
+            self.reconstructed = self.reconstructed + values
+            self.frames_since_key += 1
+        header = FRAME_HEADER.pack(self.simulation_id, KEY_FRAME if key else DELTA_FRAME, len(positions), iteration, t)
+        return header + values.astype("<f4").tobytes()
+
+
+class FrameDecoder:
+    """
+    This class rebuilds the positions of every simulation a client subscribed to from the frames it receives
+    """
+
+    def __init__(self):
+        self.positions = {}  # simulation id -> (n, 3) array of positions
+
+    def decode(self, frame):
+        """
+        Decodes a frame
+        :param frame: the frame as bytes
+        :return: a tuple of (simulation id, iteration, time, (n, 3) array of positions)
+        """
+        simulation_id, kind, n, iteration, t = FRAME_HEADER.unpack_from(frame)
+        values = np.frombuffer(frame, dtype = "<f4", count = 3 * n, offset = FRAME_HEADER.size).reshape(n, 3)
+        if kind == KEY_FRAME:
+            positions = values.astype(float)
+        elif simulation_id in self.positions:
+            positions = self.positions[simulation_id] + values
+        else:
+            raise ValueError("Delta frame for simulation {} before its key frame".format(simulation_id))
+        self.positions[simulation_id] = positions
+        return simulation_id, iteration, t, positions
+
+
+class SimulationServer:
+    """
+    This class hosts many headless simulations, steps them together in a pool of worker threads, and streams their
+    positions to any number of subscribers over a local TCP or Unix socket. Each subscriber always gets the newest
+    state: a slow subscriber simply receives fewer frames, rather than making the server buffer frames for it without
+    limit or slowing down the simulations.
+    """
+
+    def __init__(self, steps_per_frame = 1, frame_interval = 1 / 30, workers = None, keyframe_interval = 100):
+        """
+        :param steps_per_frame: the number of steps each simulation takes between frames
+        :param frame_interval: the shortest time between frames in (real) seconds
+        :param workers: the number of worker threads to step the simulations in; defaults to one per CPU
+        :param keyframe_interval: send a key frame after this many delta frames
+        """
+        self.steps_per_frame = steps_per_frame
+        self.frame_interval = frame_interval
+        self.keyframe_interval = keyframe_interval
+        self.executor = ThreadPoolExecutor(max_workers = workers)
+        self.simulations = {}
+        self.snapshots = {}  # simulation id -> (positions, iteration, time) of the latest frame
+        self.new_frame = asyncio.Condition()
+        self.server = None
+        self.writers = set()  # the stream writer of each connected subscriber
+        self.running = False
+
+    def add(self, simulation):
+        """
+        Hosts another simulation
+        :param simulation: a simulation with step(), context and positions
+        :return: the id subscribers use to ask for this simulation
+        """
+        simulation_id = len(self.simulations)
+        self.simulations[simulation_id] = simulation
+        self._snapshot(simulation_id)
+        return simulation_id
+
+    def _snapshot(self, simulation_id):
+        simulation = self.simulations[simulation_id]
+        self.snapshots[simulation_id] = (np.array(simulation.positions, dtype = float), simulation.context.iteration,
+                                         simulation.context.t)
+
+    def _advance(self, simulation):
+        """Steps one simulation in a worker thread"""
+        for _ in range(self.steps_per_frame):
+            simulation.step()
+
+    async def start(self, host = "127.0.0.1", port = 0, path = None):
+        """
+        Starts listening for subscribers
+        :param host: the address to listen on
+        :param port: the port to listen on; 0 picks a free one
+        :param path: a Unix socket path to listen on instead of TCP
+        :return: the (host, port) or path being listened on
+        """
+        if path is not None:
+            self.server = await asyncio.start_unix_server(self._serve, path = path)
+        else:
+            self.server = await asyncio.start_server(self._serve, host, port)
+        return self.server.sockets[0].getsockname()
+
+    async def run(self, frames = None):
+        """
+        Steps every simulation and publishes a frame, over and over
+        :param frames: the number of frames to run for, or None to run until stop() is called
+        """
+        loop = asyncio.get_running_loop()
+        self.running = True
+        count = 0
+        while self.running and (frames is None or count < frames):
+            started = loop.time()
+            await asyncio.gather(*(loop.run_in_executor(self.executor, self._advance, simulation)
+                                   for simulation in self.simulations.values()))
+            for simulation_id in self.simulations:
+                self._snapshot(simulation_id)
+            async with self.new_frame:
+                self.new_frame.notify_all()
+            count += 1
+            await asyncio.sleep(max(self.frame_interval - (loop.time() - started), 0))
+
+    async def stop(self):
+        """Stops stepping the simulations and disconnects every subscriber"""
+        self.running = False
+        if self.server is not None:
+            self.server.close()
+
+        # Wake the subscribers waiting for a frame and close their connections first: wait_closed() waits for every
+        # connection to finish (since Python 3.12.1), and they can only finish once woken
+        async with self.new_frame:
+            self.new_frame.notify_all()
+        for writer in list(self.writers):
+            writer.close()
+        if self.server is not None:
+            await self.server.wait_closed()
+        self.executor.shutdown(wait = False)
+
+    async def _serve(self, reader, writer):
+        """Streams frames to one subscriber until it disconnects"""
+        request = await read_message(reader)
+        if request is None:
+            writer.close()
+            return
+        ids = np.frombuffer(request, dtype = "<u2").tolist() or list(self.simulations)
+        encoders = {simulation_id: FrameEncoder(simulation_id, self.keyframe_interval) for simulation_id in ids
+                    if simulation_id in self.simulations}
+        self.writers.add(writer)
+        try:
+            while self.server.is_serving():
+                # Send the newest state of each simulation, then wait for the socket to drain; frames which were
+                # published while waiting are skipped, and the next delta covers them
+                for simulation_id, encoder in encoders.items():
+                    write_message(writer, encoder.encode(*self.snapshots[simulation_id]))
+                await writer.drain()
+                async with self.new_frame:
+                    await self.new_frame.wait()
+        except (ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+
+async def subscribe(host = "127.0.0.1", port = None, path = None, ids = ()):
+    """
+    Connects to a SimulationServer() and yields decoded frames as they arrive
+    :param host: the address of the server
+    :param port: the port of the server
+    :param path: the Unix socket path of the server, instead of host and port
+    :param ids: the ids of the simulations to subscribe to; empty for all of them
+    :return: an async generator of (simulation id, iteration, time, (n, 3) array of positions)
+    """
+    if path is not None:
+        reader, writer = await asyncio.open_unix_connection(path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    write_message(writer, np.asarray(ids, dtype = "<u2").tobytes())
+    await writer.drain()
+    decoder = FrameDecoder()
+    try:
+        while True:
+            frame = await read_message(reader)
+            if frame is None:
+                return
+            yield decoder.decode(frame)
+    finally:
+        writer.close()
@@ -2,6 +2,19 @@ import numpy as np
 import vpython as vis
 from vpython import vec
 
+from adjoint import optimize_burns
+from background import CommandQueue, PhysicsThread
+from context import SimulationContext
+from encounters import HybridIntegrator, hill_radii
+from events import EventDetector
+from frames import BodyCenteredFrame, InertialFrame, RotatingFrame
+from kepler import ElementsRecorder
+from lagrange import SynodicFrame, lagrange_points, lagrange_points_nondimensional
+from lambert import Ephemeris, best_transfer, porkchop, transfer_state
+from nbody import StateSnapshot, body_states, euler_cromer_propagator, set_body_states
+from parareal import Propagator, parareal
+from profiling import Profiler
+
 
 class Body:
     """
@@ -34,19 +47,29 @@ class Body:
         self.info = vis.label(pos = self.visual.pos, xoffset = 50, yoffset = -25, height = 9,
                               align = "left", opacity = 0.0, visible = True)
 
-    def update_visuals(self):
+    def update_visuals(self, pos = None, vel = None, elements = None):
         """
         Updates the position of the visual object to render changes to the screen
+        :param pos: the position to draw the body at, e.g. in a rotating frame; defaults to the body's own position
+        :param vel: the velocity to show in the infobox; defaults to the body's own velocity
+        :param elements: the body's latest osculating elements (a row of an ElementsRecorder) to show in the infobox
         """
+        if pos is None:
+            pos = (self.x, self.y, self.z)
+        if vel is None:
+            vel = (self.vx, self.vy, self.vz)
 
         # Update sphere position
-        self.visual.pos = vec(self.x, self.y, self.z)
+        self.visual.pos = vec(*pos)
 
         # Update info text
-        radius = np.sqrt(self.x ** 2 + self.y ** 2 + self.z ** 2)
-        speed = np.sqrt(self.vx ** 2 + self.vy ** 2 + self.vz ** 2)
+        radius = np.sqrt(pos[0] ** 2 + pos[1] ** 2 + pos[2] ** 2)
+        speed = np.sqrt(vel[0] ** 2 + vel[1] ** 2 + vel[2] ** 2)
         self.info.pos = self.visual.pos
         self.info.text = "{}\n|r| = {:.2e}m\n|v| = {:.2e}m/s".format(self.name, radius, speed)
+        if elements is not None and not np.isnan(elements["a"]):
+            self.info.text += "\na = {:.4e}m\ne = {:.5f}\nw = {:.3f} deg".format(elements["a"], elements["e"],
+                                                                                 np.degrees(elements["omega"]))
 
 
 class Star(Body):
@@ -116,10 +139,35 @@ class SolarSystem:
     This class represents a gravitational system which contains many bodies
     """
 
-    def __init__(self, bodies = []):
+    def __init__(self, bodies = [], context = None, frame = None, recorder = None, events = None, profiler = None,
+                 elements_recorder = None, integrator = None):
         # Register the solar system bodies
         self.bodies = bodies
 
+        # Clock and timestep of this simulation
+        self.context = context if context is not None else SimulationContext(dt = 100)
+
+        # Timers for each phase of the main loop; disabled unless a Profiler() is passed or the checkbox is ticked
+        self.profiler = profiler if profiler is not None else Profiler(enabled = False)
+
+        # Frame to render the bodies in (e.g. a RotatingFrame), and an optional TrajectoryRecorder for diagnostics
+        self.frame = frame if frame is not None else InertialFrame()
+        self.recorder = recorder
+
+        # Events (e.g. collisions or periapsis passages) to locate during the simulation, and the ones found so far
+        self.events = events if events is not None else []
+        self.event_log = []
+
+        # Optional ElementsRecorder which tracks the osculating orbital elements of every body, see track_elements()
+        self.elements_recorder = elements_recorder
+
+        # Optional HybridIntegrator to step the bodies with instead of the loops in the main loop, see use_hybrid()
+        self.integrator = integrator
+
+        # Changes from the widgets, made between steps, and the PhysicsThread() stepping the system, see start_physics()
+        self.commands = CommandQueue()
+        self.physics = None
+
         # Make some visual objects to display in the scene
         self.time_label = vis.label(pixel_pos = vec(0, 0, 0), xoffset = 100, yoffset = -1 * (scene.height - 30),
                                     align = "left", box = True, line = False)
@@ -127,18 +175,207 @@ class SolarSystem:
                                         text = "Controls\nScroll: zoom camera\nRight click + drag: orbit camera",
                                         align = "left", box = True, line = False, visible = False)
 
-    def update_visuals(self):
+    def update_visuals(self, snapshot = None):
         """
         Update all visuals for each body in the system
+        :param snapshot: a StateSnapshot() from snapshot() to draw; defaults to the current state of the bodies
         """
 
         # Update time visuals
+        t = self.context.t if snapshot is None else snapshot.context.t
         day = int(t / (60 * 60 * 24))
         self.time_label.text = "t = {:.3e} (Day {})".format(t, day)
 
+        # Transform all bodies into the viewing frame at once; this never modifies the simulated state
+        state = body_states(self.bodies) if snapshot is None else snapshot.state
+        pos, vel = self.frame.transform(*state, bodies = self.bodies)
+        if self.recorder is not None:
+            self.recorder.record(t, pos, vel)
+
         # Update visuals for all bodies
+        latest = self.elements_recorder.latest if self.elements_recorder is not None else None
+        for index, (body, body_pos, body_vel) in enumerate(zip(self.bodies, pos, vel)):
+            body.update_visuals(body_pos, body_vel, None if latest is None else latest[index])
+
+    def snapshot(self):
+        """
+        Copies the current state of the system, e.g. for the render loop to draw while the physics moves on
+        :return: a StateSnapshot() instance
+        """
+        masses = np.array([body.mass for body in self.bodies])
+        return StateSnapshot(masses, body_states(self.bodies), self.context, copy = False)
+
+    def start_physics(self, step, publish_interval = 1 / 60):
+        """
+        Starts stepping the system in a background PhysicsThread(), which applies self.commands before each step and
+        publishes a snapshot() for the render loop about once a frame. From then on only that thread may change the
+        bodies or the context; submit changes to self.commands instead, as the widgets do.
+        :param step: a function () -> None which advances the system by one step, like the body of the main loop
+        :param publish_interval: the shortest time between snapshots in seconds
+        :return: the PhysicsThread() instance; draw its poll() results with update_visuals()
+        """
+        self.physics = PhysicsThread(step, self.snapshot, self.commands, publish_interval)
+        self.physics.start()
+        return self.physics
+
+    def track_elements(self, every = 100, callback = None):
+        """
+        Starts recording the osculating orbital elements of every body relative to its primary: a Moon's parent_body,
+        or else the first body (e.g. the Sun), which itself has none. The elements are shown in the infoboxes.
+        :param every: record one out of every this many steps
+        :param callback: a function (t, elements) called with each new record, e.g. to print it
+        :return: the ElementsRecorder() instance
+        """
+        primaries = [-1] + [self.bodies.index(body.parent_body) if getattr(body, "parent_body", None) is not None
+                            else 0 for body in self.bodies[1:]]
+        self.elements_recorder = ElementsRecorder([body.mass for body in self.bodies], primaries, every, callback)
+        return self.elements_recorder
+
+    def use_hybrid(self, substeps = 100, factor = 3.0):
+        """
+        Switches the main loop to a HybridIntegrator, which takes the usual large step for every body except those
+        passing within a few Hill radii of each other (e.g. the ship flying by a planet, or a moon and its planet),
+        which it sub-steps, so close passes no longer force a small dt on the whole simulation
+        :param substeps: the number of substeps to split each step into for the bodies in a close encounter
+        :param factor: the number of Hill radii (about the first body, e.g. the Sun) that counts as a close encounter
+        :return: the HybridIntegrator() instance
+        """
+        masses = np.array([body.mass for body in self.bodies])
+        radii = hill_radii(masses, body_states(self.bodies)[0], factor = factor)
+        self.integrator = HybridIntegrator(masses, radii, substeps)
+        return self.integrator
+
+    def plan_burns(self, body, objective, duration, burn_times = (0.0,), **kwargs):
+        """
+        Finds the impulsive burns of a body (e.g. the ship) from the current state which minimize an objective, using
+        exact gradients from the adjoint of the same steps as the main loop, with the current dt
+        :param body: the Body() which burns
+        :param objective: an objective of the final state, e.g. distance_objective(11, 5) for the distance from the
+                          ship to Mars, using the indices of the bodies in self.bodies
+        :param duration: the time in seconds after which to evaluate the objective
+        :param burn_times: the times of the burns in seconds from now; a burn at 0 is a change to the current velocity
+        :param kwargs: other arguments to optimize_burns(), e.g. max_runs
+        :return: a tuple of (a (k, 3) array of the burns in m/s, the objective they reach)
+        """
+        dt = self.context.dt
+        masses = np.array([body.mass for body in self.bodies])
+        burns, value, _ = optimize_burns(masses, body_states(self.bodies), dt, int(round(duration / dt)), objective,
+                                         self.bodies.index(body), [int(round(t / dt)) for t in burn_times], **kwargs)
+        return burns, value
+
+    def plan_transfer(self, ship, origin, destination, departure_window, arrival_window, resolution = 500,
+                      ephemeris = None, clearance = 1e7):
+        """
+        Computes a porkchop plot of the transfers from one body to another (see porkchop()), and puts the ship on the
+        cheapest: it starts now on the transfer orbit, so it passes the origin at the departure time and reaches the
+        destination at the arrival time, give or take the pull of the planets themselves, which plan_burns() can fix
+        :param ship: the Body() to launch
+        :param origin: the Body() to depart from, e.g. the Earth
+        :param destination: the Body() to arrive at, e.g. Mars
+        :param departure_window: the (earliest, latest) departure times in seconds from now
+        :param arrival_window: the (earliest, latest) arrival times in seconds from now
+        :param resolution: the number of departure times and of arrival times to try
+        :param ephemeris: an Ephemeris() of self.bodies covering the windows; one is simulated (with hour-long or
+                          longer steps, and daily samples) if not given
+        :param clearance: the distance from the origin's center to depart from, in meters
+        :return: a tuple of (the (resolution, resolution) porkchop array, the chosen row of it)
+        """
+        t = self.context.t
+        if ephemeris is None:
+            dt = max(self.context.dt, 3600)
+            masses = np.array([body.mass for body in self.bodies])
+            ephemeris = Ephemeris.from_simulation(masses, body_states(self.bodies), t, max(arrival_window), dt,
+                                                  sample_every = max(int(24 * 3600 / dt), 1))
+        origin, destination = self.bodies.index(origin), self.bodies.index(destination)
+        grid = porkchop(ephemeris, origin, destination, t + np.linspace(*departure_window, resolution),
+                        t + np.linspace(*arrival_window, resolution), central_mass = self.bodies[0].mass)
+        transfer = best_transfer(grid)
+        pos, vel = transfer_state(ephemeris, transfer, origin, destination, t, central_mass = self.bodies[0].mass,
+                                  clearance = clearance)
+        ship.x, ship.y, ship.z = pos
+        ship.vx, ship.vy, ship.vz = vel
+        ship.visual.clear_trail()
+        print("Transfer departing at t = {:.3e}s and arriving at t = {:.3e}s, total dv = {:.0f}m/s".format(
+                transfer["departure_time"], transfer["arrival_time"], transfer["total_dv"]))
+        return grid, transfer
+
+    def integrate_parareal(self, duration, slices = 4, coarse_dt = None, fine_dt = None, method = "leapfrog",
+                           **kwargs):
+        """
+        Jumps the system forward by a long time with parareal(), which spreads an accurate integration across
+        processes: a coarse Euler-Cromer propagator guesses the state at the start of each time slice, and a fine
+        propagator refines every slice at once, one per process. The bodies end up in the final state, without drawing
+        the steps in between. Keep each slice (duration / slices) to a fraction of the shortest orbit which matters.
+        :param duration: the time to jump forward by in seconds
+        :param slices: the number of time slices, usually the number of processes
+        :param coarse_dt: the timestep of the coarse propagator in seconds; 10 times dt by default
+        :param fine_dt: the timestep of the fine propagator in seconds; dt by default
+        :param method: the fine propagator's method, "leapfrog" or "euler_cromer" (like the main loop)
+        :param kwargs: other arguments to parareal(), e.g. tol or processes; on Windows and macOS, where the worker
+                       processes re-run this script, pass processes = 1
+        :return: a tuple of (the states at the slice boundaries, the number of iterations parareal() made)
+        """
+        fine_dt = self.context.dt if fine_dt is None else fine_dt
+        coarse_dt = 10 * fine_dt if coarse_dt is None else coarse_dt
+        masses = np.array([body.mass for body in self.bodies])
+        boundaries, iterations = parareal(body_states(self.bodies), duration, slices, Propagator(masses, coarse_dt),
+                                          Propagator(masses, fine_dt, method), **kwargs)
+        set_body_states(self.bodies, boundaries[-1])
+        self.context.advance(duration)
+        for body in self.bodies:
+            body.visual.clear_trail()  # the trail would jump straight across the skipped time
+        return boundaries, iterations
+
+    def record_elements(self):
+        """
+        Records the osculating elements of every body now, if an ElementsRecorder is tracking them
+        """
+        self.elements_recorder.record(self.context.t, *body_states(self.bodies))
+
+    def locate_events(self, state, dt):
+        """
+        Finds the exact times of any events which happened during the last step and reports them
+        :param state: the (positions, velocities) of the bodies at the start of the step, from body_states()
+        :param dt: the length of the step in seconds
+        :return: a list of EventRecord() instances, with times measured from t = 0
+        """
+        masses = np.array([body.mass for body in self.bodies])
+        detector = EventDetector(self.events, euler_cromer_propagator(masses))
+        records = detector.locate(state, body_states(self.bodies), dt)
+        for record in records:
+            record.time += self.context.t
+            print("{} (channel {}) at t = {:.6e}s".format(record.name, record.channel, record.time))
+        self.event_log += records
+        return records
+
+    def set_frame(self, frame):
+        """
+        Changes the frame the bodies are rendered in
+        :param frame: an InertialFrame(), BodyCenteredFrame() or RotatingFrame() instance
+        """
+        self.frame = frame
         for body in self.bodies:
-            body.update_visuals()
+            body.visual.clear_trail()  # trails drawn in the old frame would be misleading
+
+    def lagrange_points(self, primary, secondary):
+        """
+        Computes the five Lagrange points of a pair of bodies in the system
+        :param primary: a Body() instance (e.g. the Sun)
+        :param secondary: a Body() instance (e.g. the Earth)
+        :return: a tuple of (positions, velocities), each a (5, 3) array with rows L1 through L5
+        """
+        return lagrange_points(primary, secondary)
+
+    def fork(self, branches = 1):
+        """
+        Snapshots the current state of the system and starts headless branches from it, e.g. to try several burns of
+        the spaceship from this moment and compare the outcomes without rerunning from t = 0. The branches share the
+        snapshot's arrays until they are changed or stepped, so dozens of them cost little more than one.
+        :param branches: the number of branches to start
+        :return: a list of NBodyBranch() instances; use self.bodies.index(body) to find a body's index in them
+        """
+        snapshot = self.snapshot()
+        return [snapshot.fork() for _ in range(branches)]
 
 
 scene = vis.canvas(title = "Solar system simulation!   ", width = 1600, height = 900)
@@ -153,10 +390,12 @@ def add_widgets(scene, solar_system):
     def follow_body(menu):
         scene.camera.follow(solar_system.bodies[menu.index].visual)
 
+    def change_frame(menu):
+        solar_system.set_frame(frames[menu.index])
+
     def change_dt(slider):
-        global dt
-        dt = 10 ** slider.value
-        dt_text.text = "dt={:.2e}s:".format(dt)
+        solar_system.commands.submit(setattr, solar_system.context, "dt", 10 ** slider.value)
+        dt_text.text = "dt={:.2e}s:".format(10 ** slider.value)
 
     def toggle_infobox(checkbox):
         for body in solar_system.bodies:
@@ -165,6 +404,28 @@ def add_widgets(scene, solar_system):
     def toggle_controls(checkbox):
         solar_system.controls_label.visible = checkbox.checked
 
+    def toggle_elements(checkbox):
+        if checkbox.checked:
+            solar_system.commands.submit(solar_system.track_elements)
+        else:
+            solar_system.commands.submit(setattr, solar_system, "elements_recorder", None)
+
+    def toggle_hybrid(checkbox):
+        if checkbox.checked:
+            solar_system.commands.submit(solar_system.use_hybrid)
+        else:
+            solar_system.commands.submit(setattr, solar_system, "integrator", None)
+
+    def set_profiling(enabled):
+        solar_system.profiler.set_enabled(enabled)
+        if not enabled:  # report and save what was recorded
+            print(solar_system.profiler.summary())
+            solar_system.profiler.save_json("profile.json")
+            solar_system.profiler.save_chrome_trace("profile_trace.json")
+
+    def toggle_profiler(checkbox):
+        solar_system.commands.submit(set_profiling, checkbox.checked)
+
     vis.wtext(pos = scene.title_anchor, text = "    ")
     vis.wtext(pos = scene.title_anchor, text = "Focus: ")
     vis.menu(pos = scene.title_anchor,
@@ -172,15 +433,36 @@ def add_widgets(scene, solar_system):
              bind = follow_body)
     vis.wtext(pos = scene.title_anchor, text = "    ")
 
-    dt_text = vis.wtext(pos = scene.title_anchor, text = "dt={:.2e}s:".format(dt))
+    # Frames to choose from: inertial, centered on each body, or rotating with each body about the first body
+    primary = solar_system.bodies[0]
+    frames = [InertialFrame()] + [BodyCenteredFrame(body) for body in solar_system.bodies]
+    frames += [RotatingFrame(primary, body) for body in solar_system.bodies if body is not primary]
+    if solar_system.frame.name != InertialFrame.name:
+        frames.insert(0, solar_system.frame)
+    vis.wtext(pos = scene.title_anchor, text = "Frame: ")
+    vis.menu(pos = scene.title_anchor,
+             choices = list(map(lambda frame: frame.name, frames)),
+             bind = change_frame)
+    vis.wtext(pos = scene.title_anchor, text = "    ")
+
+    dt_text = vis.wtext(pos = scene.title_anchor, text = "dt={:.2e}s:".format(solar_system.context.dt))
     vis.slider(pos = scene.title_anchor,
                min = 0, max = 6,
-               value = np.log10(dt),
+               value = np.log10(solar_system.context.dt),
                bind = change_dt)
     vis.wtext(pos = scene.title_anchor, text = "    ")
     vis.checkbox(pos = scene.title_anchor, text = "Enable infoboxes", checked = True, bind = toggle_infobox)
     vis.wtext(pos = scene.title_anchor, text = "    ")
     vis.checkbox(pos = scene.title_anchor, text = "Show controls", checked = False, bind = toggle_controls)
+    vis.wtext(pos = scene.title_anchor, text = "    ")
+    vis.checkbox(pos = scene.title_anchor, text = "Orbital elements",
+                 checked = solar_system.elements_recorder is not None, bind = toggle_elements)
+    vis.wtext(pos = scene.title_anchor, text = "    ")
+    vis.checkbox(pos = scene.title_anchor, text = "Hybrid encounters", checked = solar_system.integrator is not None,
+                 bind = toggle_hybrid)
+    vis.wtext(pos = scene.title_anchor, text = "    ")
+    vis.checkbox(pos = scene.title_anchor, text = "Profile", checked = solar_system.profiler.enabled,
+                 bind = toggle_profiler)
 
 
 # Define constants and global variables ================================================================================
@@ -207,9 +489,13 @@ COLOR_DARK_GREY = vis.color.gray(0.5)
 G = 6.674e-11  # gravitational constant, m^3 kg^-1 s^-2
 AU = 1.496e11  # 1AU = 1.496 * 10^11 meters: you can also define your orbital parameters in AU instead of meters
 
-# Global time variables
-t = 0  # simulation time in seconds
-dt = 100  # simulation timestep in seconds; this value can be changed by the slider
+# Simulation clock: t is the simulation time in seconds, and dt is the timestep in seconds, which can be changed by the
+# slider. Each SolarSystem() has its own context, so several can run side by side.
+context = SimulationContext(t = 0, dt = 100)
+
+# Set this to True to step the simulation in a background thread, as fast as it can go, while the main loop only draws
+# the latest state, 60 times a second; with False, the main loop steps and draws in turn as usual
+BACKGROUND_PHYSICS = False
 
 
 def compute_acceleration(body1, body2):
@@ -316,9 +602,7 @@ sun = Star(
 #         color = COLOR_LIGHT_GREY)
 
 r_earth = 149.6e9
-r_jwst = 151.1e9
 v_earth = 29.8e3
-v_jwst = v_earth * r_jwst / r_earth
 
 earth_copy = Planet(
         name = "Earth",
@@ -328,13 +612,22 @@ earth_copy = Planet(
         radius = 6378e3,
         color = COLOR_BLUE)
 
+# Place the JWST at the Sun-Earth L2 point, moving so that it co-rotates with the Earth
+lagrange_pos, lagrange_vel = lagrange_points(sun, earth_copy)
+jwst_pos, jwst_vel = lagrange_pos[1], lagrange_vel[1]
 
+# Uncomment these lines to put the JWST on a halo orbit around L2 instead (z amplitude is in units of the Sun-Earth
+# distance, so 1e-3 is about 150,000 km)
+# from lagrange import halo_orbits
+# synodic_frame = SynodicFrame(sun, earth_copy)
+# halo_states, halo_periods = halo_orbits(synodic_frame.mu, point = 2, z_amplitudes = [1e-3])
+# jwst_pos, jwst_vel = synodic_frame.to_inertial(halo_states[0, :3], halo_states[0, 3:], nondimensional = True)
 
 jwst = Spaceship(
         name = "JWST",
         mass = 1e6,
-        x = r_jwst, y = 0, z = 0,
-        vx = 0, vy = v_jwst, vz = 0,
+        x = jwst_pos[0], y = jwst_pos[1], z = jwst_pos[2],
+        vx = jwst_vel[0], vy = jwst_vel[1], vz = jwst_vel[2],
         color = COLOR_MAGENTA)
 
 solar_system = SolarSystem(bodies = [
@@ -351,38 +644,109 @@ solar_system = SolarSystem(bodies = [
     # pluto,
     earth_copy,
     jwst
-])
+], context = context)
+
+
+def l2_position(state):
+    """
+    Finds the current position of the Sun-Earth L2 point, which moves along with the Earth
+    :param state: the (positions, velocities) of the bodies, in the order of solar_system.bodies
+    :return: a (3,) array of the position of L2 in meters
+    """
+    positions, velocities = state
+    frame = SynodicFrame.from_states(sun.mass, positions[0], velocities[0],
+                                     earth_copy.mass, positions[1], velocities[1])
+    return frame.to_inertial(lagrange_points_nondimensional(frame.mu)[1], nondimensional = True)
+
+
+# Uncomment these lines to print the exact time at which the JWST drifts more than 100,000 km away from L2, or comes
+# back; channel 2 is the JWST
+# from events import radius_crossing
+# solar_system.events = [radius_crossing("JWST leaves L2", 1e8, center = l2_position)]
+
+# Uncomment these lines to find the burn which brings the JWST back to L2 after 90 days, at rest relative to the Earth
+# from adjoint import station_objective
+# burns, error = solar_system.plan_burns(jwst, station_objective(2, l2_position, velocity_weight = (1, 1e10)),
+#                                        90 * 24 * 3600, max_runs = 30)
+# jwst.vx, jwst.vy, jwst.vz = jwst.vx + burns[0, 0], jwst.vy + burns[0, 1], jwst.vz + burns[0, 2]
 # End code here ========================================================================================================
 
 add_widgets(scene, solar_system)
 
-# Main simulation loop
-while True:
-    # Update the velocity of each body by computing acceleration to every other body
-    for body1 in solar_system.bodies:
-        for body2 in solar_system.bodies:
-            if body1 != body2:
-                # Compute the acceleration from each other body on body1
-                ax, ay, az = compute_acceleration(body1, body2)
-
-                # TODO: update vx, vy, vz for each planet
+
+def step_simulation():
+    """
+    Advances the solar system by one step: everything the main simulation loop does except drawing
+    """
+    dt = solar_system.context.dt
+    profiler = solar_system.profiler
+
+    # Remember the state at the start of the step, so that events during the step can be located exactly
+    if solar_system.events:
+        with profiler.phase("events"):
+            state = body_states(solar_system.bodies)
+
+    if solar_system.integrator is not None:
+        # Step every body at once, with substeps only for the bodies in a close encounter
+        with profiler.phase("hybrid"):
+            new_state = solar_system.integrator.step(body_states(solar_system.bodies), dt)
+            set_body_states(solar_system.bodies, new_state)
+    else:
+        # Update the velocity of each body by computing acceleration to every other body
+        with profiler.phase("forces"):
+            for body1 in solar_system.bodies:
+                for body2 in solar_system.bodies:
+                    if body1 != body2:
+                        # Compute the acceleration from each other body on body1
+                        ax, ay, az = compute_acceleration(body1, body2)
+
+                        # TODO: update vx, vy, vz for each planet
+                        # Begin code here ==============================================================================
+                        body1.vx += ax * dt
+                        body1.vy += ay * dt
+                        body1.vz += az * dt
+                        # End code here ================================================================================
+
+        # Update the position of each body
+        with profiler.phase("positions"):
+            for body in solar_system.bodies:
+                # TODO: update x, y, z for each planet
                 # Begin code here ======================================================================================
-                body1.vx += ax * dt
-                body1.vy += ay * dt
-                body1.vz += az * dt
+                body.x += body.vx * dt
+                body.y += body.vy * dt
+                body.z += body.vz * dt
                 # End code here ========================================================================================
 
-    # Update the position of each body
-    for body in solar_system.bodies:
-        # TODO: update x, y, z for each planet
-        # Begin code here ==============================================================================================
-        body.x += body.vx * dt
-        body.y += body.vy * dt
-        body.z += body.vz * dt
-        # End code here ================================================================================================
+    # Find the exact times of any events during this step
+    if solar_system.events:
+        with profiler.phase("events"):
+            solar_system.locate_events(state, dt)
 
     # Update time and iteration
-    t += dt
+    solar_system.context.advance()
+    profiler.step()
+
+    # Record the osculating orbital elements of every body every few steps
+    if solar_system.elements_recorder is not None and solar_system.elements_recorder.due():
+        with profiler.phase("elements"):
+            solar_system.record_elements()
 
-    # Update the visuals
-    solar_system.update_visuals()
+
+# Main simulation loop
+if BACKGROUND_PHYSICS:
+    # Step in the background and draw whichever state is newest each frame, skipping any the screen was too slow for
+    physics = solar_system.start_physics(step_simulation)
+    while True:
+        vis.rate(60)
+        snapshot = physics.poll()
+        if snapshot is not None:
+            with solar_system.profiler.phase("visuals"):
+                solar_system.update_visuals(snapshot)
+else:
+    while True:
+        solar_system.commands.apply()
+        step_simulation()
+
+        # Update the visuals
+        with solar_system.profiler.phase("visuals"):
+            solar_system.update_visuals()
@@ -0,0 +1,69 @@
+import numpy as np
+
+from adjoint import _search_direction, distance_objective, optimize_burns, propagate_with_gradient, station_objective
+
+# The Sun, the Earth and a ship just outside the Earth's orbit
+MASSES = np.array([1.989e30, 5.97e24, 1e6])
+POSITIONS = np.array([[0.0, 0.0, 0.0], [1.496e11, 0.0, 0.0], [1.6e11, 0.0, 0.0]])
+VELOCITIES = np.array([[0.0, 0.0, 0.0], [0.0, 29.78e3, 0.0], [0.0, 28.5e3, 1e3]])
+DT = 6 * 3600
+N_STEPS = 200
+
+
+def finite_difference(function, x, step):
+    """The central-difference gradient of a scalar function of an array"""
+    gradient = np.zeros_like(x)
+    for index in np.ndindex(x.shape):
+        shifted = x.copy()
+        shifted[index] += step
+        upper = function(shifted)
+        shifted[index] -= 2 * step
+        gradient[index] = (upper - function(shifted)) / (2 * step)
+    return gradient
+
+
+def test_gradients_match_finite_differences():
+    objective = distance_objective(2, 1)
+    burns = [(0, 2, np.array([10.0, -5.0, 0.0])), (80, 2, np.array([0.0, 3.0, -2.0]))]
+    value, grad_positions, grad_velocities, grad_burns = propagate_with_gradient(
+            MASSES, (POSITIONS, VELOCITIES), DT, N_STEPS, objective, burns)
+
+    def run(positions = POSITIONS, velocities = VELOCITIES, burns = burns):
+        return propagate_with_gradient(MASSES, (positions, velocities), DT, N_STEPS, objective, burns)[0]
+
+    def run_with_burns(delta_v):
+        return run(burns = [(step, body, change) for (step, body, _), change in zip(burns, delta_v)])
+
+    np.testing.assert_allclose(grad_positions, finite_difference(lambda x: run(positions = x), POSITIONS, 1e3),
+                               rtol = 1e-4, atol = 1e-6 * np.max(np.abs(grad_positions)))
+    np.testing.assert_allclose(grad_velocities, finite_difference(lambda v: run(velocities = v), VELOCITIES, 1e-2),
+                               rtol = 1e-4, atol = 1e-6 * np.max(np.abs(grad_velocities)))
+    np.testing.assert_allclose(grad_burns, finite_difference(run_with_burns, np.array([b[2] for b in burns]), 1e-2),
+                               rtol = 1e-4, atol = 1e-6 * np.max(np.abs(grad_burns)))
+
+
+def test_station_objective_velocity_gradient():
+    objective = station_objective(2, lambda state: state[0][1] + [1.5e9, 0.0, 0.0], velocity_weight = (1, 1e6))
+    _, _, grad_velocities, _ = propagate_with_gradient(MASSES, (POSITIONS, VELOCITIES), DT, 50, objective)
+
+    def run(velocities):
+        return propagate_with_gradient(MASSES, (POSITIONS, velocities), DT, 50, objective)[0]
+
+    expected = finite_difference(run, VELOCITIES, 1e-2)
+    np.testing.assert_allclose(grad_velocities[2], expected[2], rtol = 1e-4)
+
+
+def test_optimize_burns_reduces_the_objective():
+    objective = distance_objective(2, 1)
+    initial = propagate_with_gradient(MASSES, (POSITIONS, VELOCITIES), DT, N_STEPS, objective)[0]
+    burns, value, runs = optimize_burns(MASSES, (POSITIONS, VELOCITIES), DT, N_STEPS, objective, 2, max_runs = 30)
+    assert burns.shape == (1, 3) and runs <= 30
+    assert value < 0.1 * initial
+
+
+def test_steepest_descent_fallback_is_clamped():
+    # An inverse Hessian estimate which points uphill falls back to steepest descent, which must be clamped as well
+    gradient = np.array([2e7, -1e7, 0.0])
+    direction, inverse_hessian = _search_direction(-np.eye(3), gradient, max_delta_v = 1e3)
+    np.testing.assert_array_equal(inverse_hessian, np.eye(3))
+    np.testing.assert_allclose(direction, [-1e3, 5e2, 0.0])
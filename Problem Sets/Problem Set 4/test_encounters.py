@@ -0,0 +1,29 @@
+import numpy as np
+
+from encounters import close_pairs
+
+
+def brute_force_pairs(positions, radii):
+    """Every close pair (i, j) with i < j, found by checking every pair"""
+    distance = np.linalg.norm(positions[:, None, :] - positions[None, :, :], axis = -1)
+    i, j = np.nonzero((distance < radii[:, None] + radii[None, :]) & np.triu(np.ones_like(distance, dtype = bool), 1))
+    return np.stack([i, j], axis = 1)
+
+
+def test_close_pairs_match_brute_force():
+    rng = np.random.default_rng(0)
+    for n, spread in ((2, 1.0), (300, 10.0), (2000, 40.0)):
+        positions = rng.uniform(-spread, spread, size = (n, 3))
+        radii = rng.uniform(0.1, 1.0, size = n)
+        np.testing.assert_array_equal(close_pairs(positions, radii), brute_force_pairs(positions, radii))
+
+
+def test_close_pairs_with_negative_coordinates_and_scalar_radius():
+    """Cells on either side of zero must stay neighbors, and a scalar radius applies to every body"""
+    positions = np.array([[-0.1, 0.0, 0.0], [0.1, 0.0, 0.0], [5.0, 5.0, 5.0], [-5.0, -5.0, -5.0]])
+    np.testing.assert_array_equal(close_pairs(positions, 0.15), [[0, 1]])
+
+
+def test_close_pairs_without_bodies_or_radius():
+    assert close_pairs(np.zeros((1, 3)), 1.0).shape == (0, 2)
+    assert close_pairs(np.random.default_rng(1).normal(size = (10, 3)), 0.0).shape == (0, 2)
@@ -0,0 +1,53 @@
+import numpy as np
+
+from events import EventDetector, periapsis, plane_crossing, radius_crossing
+from kepler import elements_to_state, state_to_elements
+
+MU = 1.327e20  # G times the mass of the Sun, m^3/s^2
+A, E, OMEGA = 1.5e11, 0.3, 0.3  # semi-major axis, eccentricity and argument of periapsis of the orbit
+
+
+def kepler_propagate(state, tau):
+    """Advances a body (row 1) around a fixed Sun (row 0) exactly, along its Kepler orbit"""
+    elements = state_to_elements(state[0][1:] - state[0][:1], state[1][1:] - state[1][:1], MU)
+    mean_motion = np.sqrt(MU / elements["a"] ** 3)
+    elements["M"] = elements["M"] + mean_motion * tau
+    positions, velocities = elements_to_state(*(elements[name] for name in elements.dtype.names), MU)
+    return np.vstack([state[0][:1], positions]), np.vstack([state[1][:1], velocities])
+
+
+def time_of_true_anomaly(nu, M0):
+    """The time after mean anomaly M0 at which the orbit reaches true anomaly nu (within the same revolution)"""
+    eccentric_anomaly = 2 * np.arctan(np.sqrt((1 - E) / (1 + E)) * np.tan(nu / 2))
+    return (eccentric_anomaly - E * np.sin(eccentric_anomaly) - M0) / np.sqrt(MU / A ** 3)
+
+
+def test_ascending_node_and_periapsis_in_one_step():
+    M0 = -0.8
+    positions, velocities = elements_to_state(A, E, 0.0, 0.0, OMEGA, M0, MU)
+    state = (np.vstack([np.zeros(3), positions]), np.vstack([np.zeros(3), velocities]))
+    period = 2 * np.pi * np.sqrt(A ** 3 / MU)
+    dt = 0.2 * period  # from M = -0.8 to about 0.46: through y = 0 at nu = -omega, then periapsis at nu = 0
+
+    events = [plane_crossing("ascending node", 0.0, direction = 1), periapsis("periapsis", 1, 0)]
+    seen = []
+    new_state, elapsed, history = EventDetector(events, kepler_propagate).advance(state, dt, seen.append)
+    assert [record.name for record in history] == ["ascending node", "periapsis"] and seen == history
+    assert history[0].channel == 1 and elapsed == dt
+
+    np.testing.assert_allclose(history[0].time, time_of_true_anomaly(-OMEGA, M0), rtol = 0, atol = 1e-8 * dt)
+    np.testing.assert_allclose(history[1].time, time_of_true_anomaly(0.0, M0), rtol = 0, atol = 1e-8 * dt)
+    np.testing.assert_allclose(history[1].state[0][1], [A * (1 - E) * np.cos(OMEGA), A * (1 - E) * np.sin(OMEGA), 0],
+                               rtol = 0, atol = 1e-6 * A)
+    np.testing.assert_allclose(new_state[0], kepler_propagate(state, dt)[0], rtol = 0, atol = 1e-6 * A)
+
+
+def test_terminal_event_stops_the_step():
+    # Particles moving in straight lines, the second of which leaves a sphere of radius 1 partway through the step
+    state = (np.array([[0.0, 0.0, 0.0], [0.5, 0.0, 0.0]]), np.array([[0.1, 0.0, 0.0], [0.0, 2.0, 0.0]]))
+    events = [radius_crossing("escape", 1.0, direction = 1, terminal = True)]
+    detector = EventDetector(events, lambda state, tau: (state[0] + state[1] * tau, state[1]))
+    new_state, elapsed, history = detector.advance(state, 1.0)
+    assert len(history) == 1 and history[0].channel == 1
+    np.testing.assert_allclose(elapsed, np.sqrt(0.75) / 2, rtol = 0, atol = 1e-9)
+    np.testing.assert_allclose(np.linalg.norm(new_state[0][1]), 1.0, rtol = 0, atol = 1e-9)
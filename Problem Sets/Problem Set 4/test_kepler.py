@@ -0,0 +1,27 @@
+import numpy as np
+
+from kepler import elements_to_state, sample_elements, solve_kepler, state_to_elements
+
+MU_SUN = 1.327e20  # G times the mass of the Sun, m^3/s^2
+
+
+def angle_difference(a, b):
+    """The difference of two angles in radians, wrapped into [-pi, pi)"""
+    return np.remainder(a - b + np.pi, 2 * np.pi) - np.pi
+
+
+def test_solve_kepler_satisfies_keplers_equation():
+    M, e = np.meshgrid(np.linspace(0, 2 * np.pi, 101), np.linspace(0, 0.99, 34))
+    E = solve_kepler(M, e)
+    np.testing.assert_allclose(angle_difference(E - e * np.sin(E), M), 0, atol = 1e-12)
+
+
+def test_elements_round_trip():
+    elements = sample_elements(1000, a = (1e10, 1e12), e = (0.01, 0.9), i = (0.05, 3.0), seed = 0)
+    positions, velocities = elements_to_state(*(elements[name] for name in elements.dtype.names), MU_SUN)
+    recovered = state_to_elements(positions, velocities, MU_SUN)
+    np.testing.assert_allclose(recovered["a"], elements["a"], rtol = 1e-10)
+    np.testing.assert_allclose(recovered["e"], elements["e"], rtol = 0, atol = 1e-10)
+    np.testing.assert_allclose(recovered["i"], elements["i"], rtol = 0, atol = 1e-10)
+    for name in ("Omega", "omega", "M"):
+        np.testing.assert_allclose(angle_difference(recovered[name], elements[name]), 0, atol = 1e-8)
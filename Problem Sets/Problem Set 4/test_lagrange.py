@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from lagrange import (collinear_points, cr3bp_acceleration, halo_orbits, lagrange_points_nondimensional,
+                      lyapunov_orbits, propagate_cr3bp)
+
+MU_EARTH_MOON = 0.01215
+
+
+@pytest.mark.parametrize("mu", [3.0035e-6, MU_EARTH_MOON, 0.3])
+def test_lagrange_points_are_equilibria(mu):
+    # At rest in the rotating frame, the acceleration is the gradient of the effective potential, which must vanish
+    points = lagrange_points_nondimensional(mu)
+    accelerations = cr3bp_acceleration(np.hstack([points, np.zeros_like(points)]), mu)
+    np.testing.assert_allclose(accelerations, 0.0, atol = 1e-12)
+    x_l1, x_l2, x_l3 = collinear_points(mu)
+    assert -mu < x_l1 < 1 - mu < x_l2 and x_l3 < -mu
+
+
+def test_lyapunov_orbit_closes():
+    states, periods = lyapunov_orbits(MU_EARTH_MOON, point = 1, amplitudes = [0.01])
+    assert states[0, 2] == 0 and states[0, 5] == 0  # planar
+    np.testing.assert_allclose(propagate_cr3bp(states, MU_EARTH_MOON, periods), states, rtol = 0, atol = 5e-9)
+
+
+def test_halo_orbit_closes():
+    states, periods = halo_orbits(MU_EARTH_MOON, point = 2, z_amplitudes = [0.02])
+    assert states[0, 2] > 0.01  # a northern halo, well out of the plane
+    np.testing.assert_allclose(propagate_cr3bp(states, MU_EARTH_MOON, periods), states, rtol = 0, atol = 5e-9)
@@ -0,0 +1,33 @@
+import numpy as np
+
+from lambert import solve_lambert
+
+MU_EARTH = 398600 * 1e9  # m^3/s^2
+
+
+def test_curtis_example():
+    # Curtis, Orbital Mechanics for Engineering Students, Example 5.2
+    r1 = np.array([5000.0, 10000.0, 2100.0]) * 1e3
+    r2 = np.array([-14600.0, 2500.0, 7000.0]) * 1e3
+    v1, v2 = solve_lambert(r1, r2, 3600.0, MU_EARTH, prograde = True)
+    np.testing.assert_allclose(v1, np.array([-5.9925, 1.9254, 3.2456]) * 1e3, rtol = 1e-4)
+    np.testing.assert_allclose(v2, np.array([-3.3125, -4.1966, -0.38529]) * 1e3, rtol = 1e-4)
+
+
+def test_batch_matches_single_transfers():
+    r1 = np.array([[5000.0, 10000.0, 2100.0], [7000.0, 0.0, 0.0]]) * 1e3
+    r2 = np.array([[-14600.0, 2500.0, 7000.0], [0.0, 9000.0, 1000.0]]) * 1e3
+    tof = np.array([3600.0, 2400.0])
+    v1, v2 = solve_lambert(r1, r2, tof, MU_EARTH)
+    for i in range(2):
+        single = solve_lambert(r1[i], r2[i], tof[i], MU_EARTH)
+        np.testing.assert_allclose(v1[i], single[0])
+        np.testing.assert_allclose(v2[i], single[1])
+
+
+def test_undefined_transfers_are_nan():
+    r1 = np.array([7000.0, 0.0, 0.0]) * 1e3
+    v1, v2 = solve_lambert(r1, -r1, 3600.0, MU_EARTH)
+    assert np.all(np.isnan(v1)) and np.all(np.isnan(v2))
+    v1, v2 = solve_lambert(r1, [0.0, 7e6, 0.0], 0.0, MU_EARTH)
+    assert np.all(np.isnan(v1)) and np.all(np.isnan(v2))
@@ -0,0 +1,225 @@
+import numpy as np
+import pytest
+
+from context import SimulationContext
+from nbody import (BatchedNBodySimulation, BodyArray, G, NBodySimulation, StateSnapshot, body_states,
+                   compute_accelerations, kahan_add, pairwise_sum, tiled_accelerations)
+
+
+def direct_accelerations(positions, masses):
+    """The acceleration of every body from a plain double loop over the pairs, to check the vectorized kernels"""
+    accelerations = np.zeros_like(positions)
+    for i in range(len(positions)):
+        for j in range(len(positions)):
+            if i != j:
+                separation = positions[j] - positions[i]
+                accelerations[i] += G * masses[j] * separation / np.linalg.norm(separation) ** 3
+    return accelerations
+
+
+def random_system(n, seed = 0):
+    """Random positions (about 1 AU across) and masses (up to about a solar mass) of n bodies"""
+    rng = np.random.default_rng(seed)
+    return rng.normal(scale = 1.5e11, size = (n, 3)), rng.uniform(1e22, 2e30, size = n)
+
+
+def test_deterministic_accelerations_match_direct():
+    positions, masses = random_system(37)
+    expected = direct_accelerations(positions, masses)
+    scale = np.max(np.abs(expected))
+    np.testing.assert_allclose(compute_accelerations(positions, masses), expected, rtol = 0, atol = 1e-12 * scale)
+    np.testing.assert_allclose(compute_accelerations(positions, masses, deterministic = True), expected, rtol = 0,
+                               atol = 1e-12 * scale)
+
+
+def python_pairwise_sum(values):
+    """pairwise_sum() of a list of floats, one Python addition at a time in the same fixed order"""
+    while len(values) > 1:
+        pairs = [values[i] + values[i + 1] for i in range(0, len(values) - 1, 2)]
+        values = pairs + values[-1:] if len(values) % 2 else pairs
+    return values[0]
+
+
+def test_pairwise_sum_adds_in_a_fixed_order():
+    rng = np.random.default_rng(1)
+    for n in (1, 2, 3, 8, 33, 100):
+        # Values of wildly different sizes and signs, so any other order of additions rounds differently
+        values = rng.normal(size = (n, 4)) * 10.0 ** rng.integers(-8, 9, size = (n, 4))
+        expected = [python_pairwise_sum(list(values[:, k])) for k in range(4)]
+        np.testing.assert_array_equal(pairwise_sum(values), expected)
+        np.testing.assert_array_equal(pairwise_sum(values.T, axis = 1), expected)
+
+
+def test_deterministic_runs_are_bitwise_identical():
+    positions, masses = random_system(40, seed = 6)
+    velocities = np.random.default_rng(7).normal(scale = 3e4, size = (40, 3))
+    runs = []
+    for layout in (np.ascontiguousarray, np.asfortranarray):  # the same numbers, laid out differently in memory
+        simulation = NBodySimulation(masses, (layout(positions), layout(velocities)), SimulationContext(dt = 3600),
+                                     deterministic = True)
+        for _ in range(50):
+            simulation.step()
+        runs.append(simulation.state)
+    np.testing.assert_array_equal(runs[0][0], runs[1][0])
+    np.testing.assert_array_equal(runs[0][1], runs[1][1])
+
+
+def test_tiled_accelerations_match_direct():
+    positions, masses = random_system(150, seed = 3)
+    expected = direct_accelerations(positions, masses)
+    scale = np.max(np.abs(expected))
+    for tile_size in (1, 7, 64, 1000):  # tiles smaller than, not dividing, and larger than the number of bodies
+        np.testing.assert_allclose(tiled_accelerations(positions, positions, masses, tile_size), expected, rtol = 0,
+                                   atol = 1e-12 * scale)
+
+
+def test_tiled_accelerations_of_separate_targets():
+    """Targets which are not sources (e.g. test particles) feel every source and pull on nothing"""
+    sources, masses = random_system(20, seed = 4)
+    targets = np.random.default_rng(5).normal(scale = 1.5e11, size = (33, 3))
+    out = np.empty_like(targets)
+    result = tiled_accelerations(targets, sources, masses, tile_size = 8, out = out)
+    assert result is out
+    everything = direct_accelerations(np.concatenate([targets, sources]), np.concatenate([np.zeros(33), masses]))
+    np.testing.assert_allclose(result, everything[:33], rtol = 1e-12)
+
+
+def test_batch_steps_match_single_simulations():
+    masses, positions, velocities = random_bodies(5, seed = 9)
+    batch_masses = masses * np.array([[1.0], [0.5], [2.0]])  # three systems, each with its own masses
+    batch = BatchedNBodySimulation.from_perturbations(masses, (positions, velocities), SimulationContext(dt = 3600), 3,
+                                                      position_scale = 1e9, velocity_scale = 100, seed = 0)
+    batch = BatchedNBodySimulation(batch_masses, batch.state, SimulationContext(dt = 3600))
+    singles = [NBodySimulation(batch_masses[k], (batch.state[0][k], batch.state[1][k]), SimulationContext(dt = 3600))
+               for k in range(3)]
+    batch.step(20)
+    for k, single in enumerate(singles):
+        for _ in range(20):
+            single.step()
+        np.testing.assert_array_equal(batch.state[0][k], single.state[0])
+        np.testing.assert_array_equal(batch.state[1][k], single.state[1])
+
+
+def test_batch_diagnostics():
+    masses, positions, velocities = random_bodies(4, seed = 10)
+    batch = BatchedNBodySimulation(masses, (positions[None], velocities[None]), SimulationContext(dt = 60))
+    diagnostics = batch.diagnostics()
+    assert diagnostics["energy_error"][0] == 0 and diagnostics["angular_momentum_error"][0] == 0
+
+    kinetic = 0.5 * np.sum(masses * np.sum(velocities ** 2, axis = 1))
+    potential = -sum(G * masses[i] * masses[j] / np.linalg.norm(positions[i] - positions[j])
+                     for i in range(4) for j in range(i + 1, 4))
+    np.testing.assert_allclose(diagnostics["energy"][0], kinetic + potential, rtol = 1e-12)
+    np.testing.assert_allclose(diagnostics["angular_momentum"][0],
+                               np.sum(masses[:, None] * np.cross(positions, velocities), axis = 0), rtol = 1e-12)
+    batch.step(10)
+    assert 0 < batch.diagnostics()["energy_error"][0] < 1e-3
+
+
+def test_kahan_add_keeps_small_increments():
+    total = np.ones(3, dtype = np.float32)
+    compensation = np.zeros_like(total)
+    for _ in range(10000):
+        kahan_add(total, compensation, np.full(3, 1e-8, dtype = np.float32))  # each increment alone rounds away
+    np.testing.assert_allclose(total.astype(float) - compensation, 1.0001, rtol = 1e-7)
+
+
+def test_mixed_precision_sun_earth_orbit():
+    # One year of the Earth around the Sun in hour steps stays about 200 km from the float64 run; plain float32
+    # storage with the same kernel drifts more than ten times as far
+    masses = np.array([1.989e30, 5.972e24])
+    state = (np.array([[0.0, 0.0, 0.0], [1.496e11, 0.0, 0.0]]), np.array([[0.0, 0.0, 0.0], [0.0, 29780.0, 0.0]]))
+    steps = 8766
+    reference = NBodySimulation(masses, state, SimulationContext(dt = 3600))
+    mixed = NBodySimulation(masses, state, SimulationContext(dt = 3600), precision = "float32")
+    assert mixed.mixed.offsets.dtype == np.float32 and mixed.mixed.velocities.dtype == np.float32
+    for _ in range(steps):
+        reference.step()
+        mixed.step()
+
+    positions, velocities = (array.astype(np.float32) for array in state)
+    masses32, dt = masses.astype(np.float32), np.float32(3600)
+    for _ in range(steps):
+        velocities += compute_accelerations(positions, masses32) * dt
+        positions += velocities * dt
+
+    mixed_error = np.linalg.norm(mixed.positions[1] - reference.positions[1])
+    plain_error = np.linalg.norm(positions[1] - reference.positions[1])
+    assert mixed_error < 1e6
+    assert plain_error > 10 * mixed_error
+
+
+def test_snapshot_copies_only_what_could_change():
+    positions, masses = random_system(4)
+    velocities = np.zeros_like(positions)
+    copied = StateSnapshot(masses, (positions, velocities), SimulationContext(dt = 1))
+    assert not np.shares_memory(copied.state[0], positions) and positions.flags.writeable
+    taken = StateSnapshot(masses, (positions, velocities), SimulationContext(dt = 1), copy = False)
+    assert taken.state[0] is positions and not positions.flags.writeable
+    assert StateSnapshot(masses, taken.state, SimulationContext(dt = 1)).state[0] is positions  # already read-only
+
+
+def test_branches_share_the_snapshot_until_they_change():
+    masses, positions, velocities = random_bodies(6, seed = 8)
+    simulation = NBodySimulation(masses, (positions, velocities), SimulationContext(dt = 3600))
+    snapshot = simulation.snapshot()
+    saved = tuple(array.copy() for array in snapshot.state)
+    burned, stepped, untouched = snapshot.fork(), snapshot.fork(), snapshot.fork()
+    for branch in (burned, stepped, untouched):
+        assert branch.state[0] is snapshot.state[0] and branch.state[1] is snapshot.state[1]
+    assert not snapshot.state[0].flags.writeable and not snapshot.state[1].flags.writeable
+
+    # A burn copies the velocities only, and changes only the burning body's
+    burned.apply_burn(2, [10.0, 0.0, -5.0])
+    assert burned.state[0] is snapshot.state[0] and burned.state[1] is not snapshot.state[1]
+    np.testing.assert_array_equal(burned.state[1] - saved[1], np.eye(6)[2][:, None] * [10.0, 0.0, -5.0])
+
+    # Stepping branches (and the simulation itself) leaves the snapshot and the other branches alone
+    for _ in range(5):
+        simulation.step()
+        burned.step()
+        stepped.step()
+    for array, original in zip(snapshot.state, saved):
+        np.testing.assert_array_equal(array, original)
+    assert untouched.state[0] is snapshot.state[0] and untouched.state[1] is snapshot.state[1]
+    np.testing.assert_array_equal(stepped.state[0], simulation.state[0])
+    assert not np.array_equal(burned.state[0], stepped.state[0])
+    assert snapshot.context.t == 0 and stepped.context.t == 5 * 3600
+
+
+def random_bodies(n, seed = 0):
+    """The masses, positions and velocities (tens of km/s) of n random bodies"""
+    positions, masses = random_system(n, seed)
+    return masses, positions, np.random.default_rng(seed + 1).normal(scale = 3e4, size = (n, 3))
+
+
+def test_body_array_handles_read_and_write_the_array():
+    masses, positions, velocities = random_bodies(5)
+    bodies = BodyArray.from_arrays(masses, positions, velocities, radii = 7e6)
+    handle = bodies[-2]
+    assert handle.index == 3 and handle.mass == masses[3] and handle.radius == 7e6
+    assert (handle.x, handle.vz) == (positions[3, 0], velocities[3, 2])
+
+    handle.vz = 1.5
+    handle.pos = (1.0, 2.0, 3.0)
+    assert bodies.velocities[3, 2] == 1.5
+    np.testing.assert_array_equal(bodies.positions[3], [1.0, 2.0, 3.0])
+    np.testing.assert_array_equal(body_states(bodies)[0], bodies.positions)
+    with pytest.raises(IndexError):
+        bodies[-6]
+    with pytest.raises(IndexError):
+        bodies[5]
+
+
+def test_body_array_grows():
+    masses, positions, velocities = random_bodies(40)
+    bodies = BodyArray(capacity = 1)
+    for i in range(10):
+        bodies.append(masses[i], positions[i], velocities[i])
+    bodies.extend(masses[10:], positions[10:], velocities[10:], radii = 2.0)
+    assert len(bodies) == 40 and len(bodies.records) >= 40
+    np.testing.assert_array_equal(bodies.masses, masses)
+    np.testing.assert_array_equal(bodies.positions, positions)
+    np.testing.assert_array_equal(bodies.velocities, velocities)
+    np.testing.assert_array_equal(bodies.radii, [1e8] * 10 + [2.0] * 30)
+    assert [body.mass for body in bodies] == list(masses)
@@ -0,0 +1,32 @@
+import numpy as np
+
+from parareal import Propagator, parareal
+
+# The Sun, the Earth and Mars on roughly circular orbits
+MASSES = np.array([1.989e30, 5.97e24, 0.642e24])
+POSITIONS = np.array([[0.0, 0.0, 0.0], [1.496e11, 0.0, 0.0], [0.0, 2.279e11, 0.0]])
+VELOCITIES = np.array([[0.0, 0.0, 0.0], [0.0, 29.78e3, 0.0], [-24.07e3, 0.0, 0.0]])
+DAY = 24 * 3600
+
+
+def test_parareal_matches_serial_fine_run():
+    duration = 120 * DAY
+    coarse = Propagator(MASSES, 5 * DAY)
+    fine = Propagator(MASSES, DAY / 4, method = "leapfrog")
+    boundaries, iterations = parareal((POSITIONS, VELOCITIES), duration, 6, coarse, fine, tol = 1e-12, processes = 1)
+    assert len(boundaries) == 7 and iterations <= 6
+
+    # Each boundary must be where the fine propagator alone gets to
+    state = (POSITIONS, VELOCITIES)
+    for boundary in boundaries[1:]:
+        state = fine(state, duration / 6)
+        np.testing.assert_allclose(boundary[0], state[0], rtol = 0, atol = 1e-9 * 2.279e11)
+        np.testing.assert_allclose(boundary[1], state[1], rtol = 0, atol = 1e-9 * 29.78e3)
+
+
+def test_parareal_in_worker_processes():
+    coarse = Propagator(MASSES, 5 * DAY)
+    fine = Propagator(MASSES, DAY, method = "leapfrog")
+    inline, _ = parareal((POSITIONS, VELOCITIES), 40 * DAY, 2, coarse, fine, processes = 1)
+    pooled, _ = parareal((POSITIONS, VELOCITIES), 40 * DAY, 2, coarse, fine, processes = 2)
+    np.testing.assert_allclose(pooled[-1][0], inline[-1][0], rtol = 1e-12)
@@ -0,0 +1,90 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from context import SimulationContext
+from nbody import NBodySimulation
+from server import DELTA_FRAME, FRAME_HEADER, KEY_FRAME, FrameDecoder, FrameEncoder, SimulationServer, subscribe
+
+# The Sun and the Earth
+MASSES = np.array([1.989e30, 5.97e24])
+POSITIONS = np.array([[0.0, 0.0, 0.0], [1.496e11, 0.0, 0.0]])
+VELOCITIES = np.array([[0.0, 0.0, 0.0], [0.0, 29.78e3, 0.0]])
+
+
+def frame_kind(frame):
+    return FRAME_HEADER.unpack_from(frame)[1]
+
+
+def test_round_trip_keeps_small_motions_precise():
+    rng = np.random.default_rng(0)
+    positions = rng.normal(0, 1.5e11, (20, 3))
+    encoder, decoder = FrameEncoder(3, keyframe_interval = 10), FrameDecoder()
+    kinds = []
+    for iteration in range(25):
+        positions = positions + rng.normal(0, 1e3, positions.shape)
+        frame = encoder.encode(positions, iteration, iteration * 3600.0)
+        kinds.append(frame_kind(frame))
+        simulation_id, decoded_iteration, t, decoded = decoder.decode(frame)
+        assert (simulation_id, decoded_iteration, t) == (3, iteration, iteration * 3600.0)
+        np.testing.assert_array_equal(decoded, encoder.reconstructed)
+        if kinds[-1] == DELTA_FRAME:
+            # a delta frame is only off by the float32 rounding of the step itself, which never accumulates
+            np.testing.assert_allclose(decoded, positions, rtol = 0, atol = 1e-3)
+    assert kinds == ([KEY_FRAME] + [DELTA_FRAME] * 10) * 2 + [KEY_FRAME] + [DELTA_FRAME] * 2
+
+
+def test_key_frame_on_a_change_of_shape():
+    encoder, decoder = FrameEncoder(0), FrameDecoder()
+    decoder.decode(encoder.encode(np.zeros((2, 3)), 0, 0.0))
+    frame = encoder.encode(np.ones((3, 3)), 1, 1.0)
+    assert frame_kind(frame) == KEY_FRAME
+    np.testing.assert_array_equal(decoder.decode(frame)[3], np.ones((3, 3)))
+
+
+def test_delta_frame_before_key_frame_raises():
+    encoder = FrameEncoder(5)
+    encoder.encode(np.zeros((2, 3)), 0, 0.0)
+    with pytest.raises(ValueError):
+        FrameDecoder().decode(encoder.encode(np.ones((2, 3)), 1, 1.0))
+
+
+def new_simulation():
+    return NBodySimulation(MASSES, (POSITIONS, VELOCITIES), SimulationContext(dt = 3600))
+
+
+async def serve_and_subscribe(frames):
+    """Runs a server on a free local port, collects frames from a subscriber, then stops the server"""
+    server = SimulationServer(steps_per_frame = 3, frame_interval = 0.001, workers = 2, keyframe_interval = 4)
+    server.add(new_simulation())
+    host, port = await server.start()
+    runner = asyncio.create_task(server.run())
+    received = []
+
+    async def listen():
+        async for frame in subscribe(host, port):
+            received.append(frame)
+
+    listener = asyncio.create_task(listen())
+    while len(received) < frames:
+        await asyncio.sleep(0.001)
+    await server.stop()
+    # stop() must end both the stepping and the subscriber's stream
+    await asyncio.wait_for(asyncio.gather(runner, listener), timeout = 5)
+    return received
+
+
+def test_server_streams_to_a_local_subscriber():
+    received = asyncio.run(serve_and_subscribe(frames = 12))
+    assert len(received) >= 12
+    iterations = [iteration for _, iteration, _, _ in received]
+    assert iterations == sorted(iterations) and iterations[-1] > 0
+
+    # Every frame holds the positions the simulation had at that iteration, to float32 precision
+    reference = new_simulation()
+    for simulation_id, iteration, t, positions in received:
+        while reference.context.iteration < iteration:
+            reference.step()
+        assert simulation_id == 0 and t == reference.context.t
+        np.testing.assert_allclose(positions, reference.positions, rtol = 0, atol = 1e-7 * 1.496e11)
@@ -0,0 +1,129 @@
+import queue
+import threading
+import time
+
+# Shared with the other problem set's simulator; see test_shared_modules.py before changing it.
+#
+# This module runs the physics of a simulation in its own thread, so the render loop (and vpython's round trips to the
+# browser) never hold up the steps, and the steps never hold up the drawing.
+#
+# The two threads share nothing but a SnapshotSlot(), which carries states from the physics to the render loop, and a
+# CommandQueue(), which carries parameter changes the other way. Neither thread ever waits for the other: publishing a
+# snapshot is a single reference assignment, which is atomic in CPython, and putting to or polling a queue.SimpleQueue
+# never blocks. The physics thread is the only one which ever changes the simulation.
+
+
+class SnapshotSlot:
+    """
+    This class hands the latest snapshot of a simulation from the physics thread to the render loop. A snapshot must
+    never be changed once it is published (e.g. a StateSnapshot(), or a tuple of fresh copies), so the reader always
+    sees a whole one, new or old, and never a half-written state. Snapshots the reader was too slow to see are simply
+    replaced, so a slow render loop draws fewer frames rather than making the physics wait or buffer them.
+    """
+
+    def __init__(self):
+        self._latest = (0, None)  # (sequence number, snapshot)
+
+    def publish(self, snapshot):
+        """
+        Replaces the latest snapshot; call this from one thread only
+        :param snapshot: the new snapshot, which must not be changed afterwards
+        """
+        self._latest = (self._latest[0] + 1, snapshot)
+
+    def latest(self, seen = 0):
+        """
+        Gets the latest snapshot if it is newer than one already seen
+        :param seen: the sequence number of the last snapshot the caller got, or 0 for none
+        :return: a tuple of (sequence number, snapshot), where snapshot is None if nothing newer has been published
+        """
+        sequence, snapshot = self._latest
+        return (sequence, snapshot) if sequence > seen else (seen, None)
+
+
+class CommandQueue:
+    """
+    This class carries changes to a simulation (e.g. from the sliders) to whichever loop steps it, which applies them
+    between steps, so a step never sees a parameter change halfway through and the widgets never wait for a step
+    """
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+
+    def submit(self, function, *args, **kwargs):
+        """
+        Queues a change, e.g. submit(setattr, context, "dt", 10)
+        :param function: the function making the change
+        :param args, kwargs: the arguments to call it with
+        """
+        self._queue.put((function, args, kwargs))
+
+    def apply(self):
+        """
+        Makes every queued change, in the order they were submitted; call this between steps
+        :return: the number of changes made
+        """
+        applied = 0
+        while True:
+            try:
+                function, args, kwargs = self._queue.get_nowait()
+            except queue.Empty:
+                return applied
+            function(*args, **kwargs)
+            applied += 1
+
+
+class PhysicsThread(threading.Thread):
+    """
+    This class steps a simulation as fast as it can in a background thread, applying the queued commands before each
+    step and publishing a snapshot at most every publish_interval seconds. Python threads take turns holding the
+    interpreter, so the physics does not run in parallel with the drawing, but it no longer waits for it: vpython's
+    rate() and its messages to the browser release the interpreter, and the physics steps in the meantime.
+    """
+
+    def __init__(self, step, snapshot, commands = None, publish_interval = 1 / 60):
+        """
+        :param step: a function () -> None which advances the simulation by one step
+        :param snapshot: a function () -> snapshot of the simulation's current state, which must never change later
+        :param commands: the CommandQueue() to apply before each step; a new one is made if not given
+        :param publish_interval: the shortest time between snapshots in seconds; about the time between frames
+        """
+        super().__init__(name = "physics", daemon = True)  # a daemon thread ends with the program
+        self.step = step
+        self.snapshot = snapshot
+        self.commands = commands if commands is not None else CommandQueue()
+        self.publish_interval = publish_interval
+        self.slot = SnapshotSlot()
+        self.steps = 0
+        self._seen = 0
+        self._stopping = threading.Event()
+
+    def run(self):
+        self.slot.publish(self.snapshot())
+        last_publish = time.perf_counter()
+        while not self._stopping.is_set():
+            self.commands.apply()
+            self.step()
+            self.steps += 1
+            now = time.perf_counter()
+            if now - last_publish >= self.publish_interval:
+                self.slot.publish(self.snapshot())
+                last_publish = now
+        self.commands.apply()
+        self.slot.publish(self.snapshot())
+
+    def poll(self):
+        """
+        Gets the latest snapshot if it has not been returned already; call this from one (the render) thread only
+        :return: the snapshot, or None if no new one has been published since the last call
+        """
+        self._seen, snapshot = self.slot.latest(self._seen)
+        return snapshot
+
+    def stop(self, timeout = None):
+        """
+        Stops the thread after its current step and waits for it to finish
+        :param timeout: the longest time to wait in seconds; None to wait as long as it takes
+        """
+        self._stopping.set()
+        self.join(timeout)
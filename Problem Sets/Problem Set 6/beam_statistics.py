@@ -0,0 +1,221 @@
+import numpy as np
+
+from pushers import kinetic_energy, rf_phase
+
+
+class StreamingHistogram:
+    """
+    This class represents a histogram with fixed bins which values are added to a batch at a time, so the distribution
+    of a quantity over millions of particles can be built up without keeping the values themselves. Values which fall
+    outside the bins are counted separately as underflow and overflow.
+    """
+
+    def __init__(self, lower, upper, bins = 100):
+        """
+        :param lower: the lower edge of the first bin
+        :param upper: the upper edge of the last bin
+        :param bins: the number of bins
+        """
+        self.edges = np.linspace(lower, upper, bins + 1)
+        self.counts = np.zeros(bins)
+        self.underflow = 0.0
+        self.overflow = 0.0
+
+    @property
+    def centers(self):
+        return (self.edges[:-1] + self.edges[1:]) / 2
+
+    @property
+    def total(self):
+        return self.counts.sum() + self.underflow + self.overflow
+
+    def add(self, values, weights = None):
+        """
+        Adds a batch of values to the histogram
+        :param values: an array of values
+        :param weights: the weight of each value, a scalar or an array like values; defaults to 1
+        """
+        values = np.ravel(values)
+        weights = np.broadcast_to(1.0 if weights is None else np.ravel(weights), values.shape)
+        bins = len(self.counts)
+        index = np.floor((values - self.edges[0]) / (self.edges[-1] - self.edges[0]) * bins).astype(int)
+        index[values == self.edges[-1]] = bins - 1  # the last bin includes its upper edge
+        below = index < 0
+        above = index >= bins
+        inside = ~below & ~above
+        self.underflow += weights[below].sum()
+        self.overflow += weights[above].sum()
+        self.counts += np.bincount(index[inside], weights = weights[inside], minlength = bins)
+
+    def mean(self):
+        """The mean of the values in the bins, estimated from the bin centers"""
+        return np.sum(self.counts * self.centers) / self.counts.sum() if self.counts.sum() > 0 else np.nan
+
+    def merge(self, other):
+        """Adds the counts of another histogram with the same bins, e.g. from a run in another process"""
+        self.counts += other.counts
+        self.underflow += other.underflow
+        self.overflow += other.overflow
+
+
+class EmittanceAccumulator:
+    """
+    This class accumulates the second moments of a beam in one trace-space plane (u, u') a batch at a time, and gives
+    its rms emittance sqrt(<u^2><u'^2> - <u u'>^2) with the means removed. Batches are combined with Chan's parallel
+    update of the centered moments, which avoids the cancellation that summing raw u^2 over millions of particles
+    would suffer from.
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = np.zeros(2)
+        self.scatter = np.zeros((2, 2))  # sum of the outer products of the deviations from the mean
+
+    def _combine(self, count, mean, scatter):
+        """Merges the moments of another set of particles into these ones"""
+        if count == 0:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.scatter += scatter + np.outer(delta, delta) * self.count * count / total
+        self.mean += delta * count / total
+        self.count = total
+
+    def add(self, u, u_prime):
+        """
+        Adds a batch of particles to the accumulator
+        :param u: an array of the particles' transverse positions in meters
+        :param u_prime: an array of the particles' transverse angles (transverse / longitudinal momentum) in radians
+        """
+        batch = np.stack([np.ravel(u), np.ravel(u_prime)], axis = 1)
+        if len(batch) == 0:
+            return
+        mean = batch.mean(axis = 0)
+        deviation = batch - mean
+        self._combine(len(batch), mean, deviation.T @ deviation)
+
+    def merge(self, other):
+        """Adds the moments of another accumulator, e.g. from a run in another process"""
+        self._combine(other.count, other.mean, other.scatter)
+
+    @property
+    def covariance(self):
+        return self.scatter / self.count if self.count > 0 else np.full((2, 2), np.nan)
+
+    @property
+    def emittance(self):
+        """The rms emittance in meter radians"""
+        return np.sqrt(max(np.linalg.det(self.covariance), 0.0)) if self.count > 0 else np.nan
+
+
+class BeamStatistics:
+    """
+    This class accumulates statistics about a bunch of particles as the simulation runs: how many times each particle
+    has crossed the gap, the RF phase at each crossing, and the energy, time, number of turns and emittance at the
+    moment each particle leaves the cyclotron. Only a turn count and an extracted flag are stored per particle, and
+    everything else goes straight into histograms, so the memory used does not grow with the length of the run.
+    Call observe() after every step with the positions before and after it.
+    """
+
+    def __init__(self, n_particles, radius = 10.0, gap_center = 0.0, rf_frequency = None, phase0 = 0.0,
+                 energy_range = (0.0, 1e7), time_range = (0.0, 1e-6), max_turns = 1000, bins = 100,
+                 reference_angle = None):
+        """
+        :param n_particles: the number of particles in the bunch
+        :param radius: the radius of the cyclotron in meters; particles which go past it are extracted
+        :param gap_center: the y coordinate of the middle of the gap in meters
+        :param rf_frequency: the frequency of the accelerating voltage in Hz, or None to skip the gap phase histogram
+        :param phase0: the phase of the accelerating voltage at t = 0
+        :param energy_range: the range of the extraction energy histogram in eV
+        :param time_range: the range of the extraction time histogram in seconds
+        :param max_turns: the upper edge of the turn count histogram
+        :param bins: the number of bins in each histogram
+        :param reference_angle: the angle around the edge that horizontal positions of extracted particles are measured
+                                from; defaults to the angle of the first particle to leave. Set it when merging runs.
+        """
+        self.radius = radius
+        self.gap_center = gap_center
+        self.rf_frequency = rf_frequency
+        self.phase0 = phase0
+
+        # The only per-particle state: how many times each particle crossed the gap, and whether it has left
+        self.gap_crossings = np.zeros(n_particles, dtype = np.int32)
+        self.extracted = np.zeros(n_particles, dtype = bool)
+
+        # Distributions, filled in as the particles cross the gap and leave the cyclotron
+        self.gap_phase = StreamingHistogram(-np.pi, np.pi, bins)
+        self.energy = StreamingHistogram(*energy_range, bins)
+        self.extraction_time = StreamingHistogram(*time_range, bins)
+        self.turns = StreamingHistogram(0, max_turns, bins)
+
+        # Emittance of the extracted beam, along the edge of the cyclotron (horizontal) and out of the plane (vertical)
+        self.horizontal_emittance = EmittanceAccumulator()
+        self.vertical_emittance = EmittanceAccumulator()
+        self.reference_angle = reference_angle
+
+    def observe(self, old_positions, positions, momenta, q, mass, time, dt):
+        """
+        Records the gap crossings and extractions which happened during a step
+        :param old_positions: an (n, 3) array of the particles' positions at the start of the step, in meters
+        :param positions: an (n, 3) array of the particles' positions at the end of the step, in meters
+        :param momenta: an (n, 3) array of the particles' momenta at the end of the step, in kg m/s
+        :param q: charge of the particles in coulomb, a scalar or an (n,) array
+        :param mass: rest mass of the particles in kg, a scalar or an (n,) array
+        :param time: the simulation time at the end of the step, in seconds
+        :param dt: the length of the step in seconds
+        """
+        q = np.broadcast_to(np.abs(q), self.extracted.shape)
+        mass = np.broadcast_to(mass, self.extracted.shape)
+        active = ~self.extracted
+
+        # Gap crossings, at times interpolated linearly within the step
+        y0 = old_positions[:, 1] - self.gap_center
+        y1 = positions[:, 1] - self.gap_center
+        crossed = active & (((y0 < 0) & (y1 >= 0)) | ((y0 > 0) & (y1 <= 0)))
+        self.gap_crossings[crossed] += 1
+        if self.rf_frequency is not None and crossed.any():
+            crossing_times = time - dt + dt * y0[crossed] / (y0[crossed] - y1[crossed])
+            self.gap_phase.add(rf_phase(crossing_times, self.rf_frequency, self.phase0))
+
+        # Extraction, when a particle first goes past the edge of the cyclotron
+        r0 = np.linalg.norm(old_positions[:, :2], axis = 1)
+        r1 = np.linalg.norm(positions[:, :2], axis = 1)
+        leaving = active & (r1 > self.radius)
+        if not leaving.any():
+            return
+        self.extracted[leaving] = True
+        fraction = np.clip((self.radius - r0[leaving]) / np.maximum(r1[leaving] - r0[leaving], 1e-300), 0, 1)
+        self.energy.add(kinetic_energy(momenta[leaving], mass[leaving]) / q[leaving])
+        self.extraction_time.add(time - dt + dt * fraction)
+        self.turns.add(self.gap_crossings[leaving] / 2)
+
+        # Trace space at the edge: position along the edge and out of the plane, and their angles to the radial
+        # direction the particle is leaving along
+        x, y, z = positions[leaving].T
+        px, py, pz = momenta[leaving].T
+        angle = np.arctan2(y, x)
+        if self.reference_angle is None:
+            self.reference_angle = angle[0]
+        p_radial = px * np.cos(angle) + py * np.sin(angle)
+        p_azimuthal = py * np.cos(angle) - px * np.sin(angle)
+        offset = (angle - self.reference_angle + np.pi) % (2 * np.pi) - np.pi
+        self.horizontal_emittance.add(self.radius * offset, p_azimuthal / p_radial)
+        self.vertical_emittance.add(z, pz / p_radial)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another bunch, e.g. one simulated in another process; the particles of the other bunch
+        are appended after the particles of this one
+        :param other: a BeamStatistics() instance with the same histogram bins
+        """
+        self.gap_crossings = np.concatenate([self.gap_crossings, other.gap_crossings])
+        self.extracted = np.concatenate([self.extracted, other.extracted])
+        for histogram in ("gap_phase", "energy", "extraction_time", "turns"):
+            getattr(self, histogram).merge(getattr(other, histogram))
+        self.horizontal_emittance.merge(other.horizontal_emittance)
+        self.vertical_emittance.merge(other.vertical_emittance)
+
+    def summary(self):
+        """A short text summary of the extracted beam, e.g. for a label"""
+        return "extracted {} / {}\n<E> = {:.3e} eV\nemittance = {:.2e} m rad".format(
+                self.extracted.sum(), len(self.extracted), self.energy.mean(), self.horizontal_emittance.emittance)
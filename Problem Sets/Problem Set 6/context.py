@@ -0,0 +1,44 @@
+# Shared with the other problem set's simulator; see test_shared_modules.py before changing it.
+
+
+class SimulationContext:
+    """
+    This class holds the clock, the timestep and the adjustable parameters (such as |E| and |B|) of one simulation.
+    Everything which changes as a simulation runs lives here rather than in module globals, so several simulations
+    can run side by side in one interpreter (or one per thread), each with its own context.
+    """
+
+    def __init__(self, dt, t = 0.0, **parameters):
+        """
+        :param dt: the simulation timestep in seconds
+        :param t: the simulation time in seconds
+        :param parameters: any other parameters of the simulation, e.g. E_mag = 1e7; they become attributes
+        """
+        self.t = t
+        self.dt = dt
+        self.iteration = 0
+        self.__dict__.update(parameters)
+
+    def advance(self, elapsed = None):
+        """
+        Moves the clock forward after a step
+        :param elapsed: the time the step took in seconds; defaults to dt
+        """
+        self.t += self.dt if elapsed is None else elapsed
+        self.iteration += 1
+
+    def copy(self, **changes):
+        """
+        Makes an independent copy of this context, e.g. to start another simulation with the same settings
+        :param changes: parameters to change in the copy, e.g. dt = 10
+        :return: a SimulationContext() instance
+        """
+        parameters = dict(self.__dict__, **changes)
+        iteration = parameters.pop("iteration")
+        context = SimulationContext(**parameters)
+        context.iteration = iteration
+        return context
+
+    def __repr__(self):
+        parameters = ", ".join("{} = {!r}".format(name, value) for name, value in self.__dict__.items())
+        return "SimulationContext({})".format(parameters)
@@ -2,6 +2,14 @@ import numpy as np
 import vpython as vis
 from vpython import vec
 
+from background import CommandQueue, PhysicsThread
+from context import SimulationContext
+from events import EventDetector, plane_crossing, radius_crossing
+from particles import ParticleArray
+from profiling import Profiler
+from pushers import (boris_push, dee_transit, dee_transit_time, gyration_push, kinetic_energy, momenta_from_velocities,
+                     velocities_from_momenta)
+
 
 class Particle:
     """
@@ -16,12 +24,10 @@ class Particle:
                  vel = vec(0.0, 0.0, 0.0),  # vx, vy, vz  of the body in m/s
                  color = (1.0, 1.0, 1.0)  # color of the body
                  ):
-        # Register properties of the body
+        # Register properties of the body; the charge, mass, position and velocity are kept in a record of a
+        # ParticleArray(), which a Cyclotron() gathers into one array with the records of its other particles
         self.name = name
-        self.q = q
-        self.mass = mass
-        self.pos = pos
-        self.vel = vel
+        self.record = ParticleArray.from_arrays([[pos.x, pos.y, pos.z]], [[vel.x, vel.y, vel.z]], q, mass)[0]
         self.color = color
 
         # Make vpython visual objects
@@ -30,61 +36,221 @@ class Particle:
         self.info = vis.label(pos = self.visual.pos, xoffset = 50, yoffset = -25, height = 9,
                               align = "left", opacity = 0.0, visible = True)
 
-    def update_visuals(self):
-        """Updates the position of the visual object to render changes to the screen"""
+    @property
+    def q(self):
+        return self.record.q
+
+    @q.setter
+    def q(self, q):
+        self.record.q = q
+
+    @property
+    def mass(self):
+        return self.record.mass
+
+    @mass.setter
+    def mass(self, mass):
+        self.record.mass = mass
+
+    @property
+    def pos(self):
+        return vec(*self.record.pos)
+
+    @pos.setter
+    def pos(self, pos):
+        self.record.pos = (pos.x, pos.y, pos.z)
+
+    @property
+    def vel(self):
+        return vec(*self.record.vel)
+
+    @vel.setter
+    def vel(self, vel):
+        self.record.vel = (vel.x, vel.y, vel.z)
+
+    def update_visuals(self, pos = None, vel = None):
+        """
+        Updates the position of the visual object to render changes to the screen
+        :param pos: the position to draw the particle at, e.g. from a snapshot; defaults to the particle's own position
+        :param vel: the velocity to show in the infobox; defaults to the particle's own velocity
+        """
+        if pos is None:
+            pos = self.pos
+        if vel is None:
+            vel = self.vel
 
         # Update sphere position
-        self.visual.pos = self.pos
+        self.visual.pos = pos
 
         # Update info text
-        radius = self.pos.mag
-        speed = self.vel.mag
+        radius = pos.mag
+        speed = vel.mag
         self.info.pos = self.visual.pos
         self.info.text = "{}\n|r| = {:.2e}m\n|v| = {:.2e}m/s".format(self.name, radius, speed)
 
 
+class CyclotronSnapshot:
+    """
+    This class holds a copy of everything the screen shows of a Cyclotron() at one moment, so the render loop can draw
+    it while a background thread keeps stepping the cyclotron itself
+    """
+
+    def __init__(self, cyclotron):
+        """
+        :param cyclotron: the Cyclotron() instance to copy
+        """
+        self.t = cyclotron.context.t
+        self.positions = [vec(*pos) for pos in cyclotron.particles.positions]
+        self.velocities = [vec(*vel) for vel in cyclotron.particles.velocities]
+        self.polarity = cyclotron.polarity
+        self.summary = cyclotron.statistics.summary() if cyclotron.statistics is not None else None
+
+
 class Cyclotron:
     """
     This class represents a gravitational system which contains many bodies
     """
 
-    def __init__(self, radius = 10.0, bodies = []):
+    def __init__(self, radius = 10.0, bodies = [], context = None, e_map = None, b_map = None, space_charge = None,
+                 statistics = None, profiler = None):
         self.radius = radius
         self.bodies = bodies
+        # Move the records of the particles into one ParticleArray(), whose positions and velocities the array pushers
+        # update in place; the particles keep working as before, through handles into it
+        self.particles = ParticleArray.from_particles(bodies)
+        for body, record in zip(bodies, self.particles):
+            body.record = record
+        # Clock, timestep, field strengths and options of this simulation
+        self.context = context if context is not None else default_context()
+        # Timers for each phase of the main loop; disabled unless a Profiler() is passed or the checkbox is ticked
+        self.profiler = profiler if profiler is not None else Profiler(enabled = False)
+        self.e_map = e_map  # optional FieldMap() of the gap field; if None, E is uniform between the plates
+        self.b_map = b_map  # optional FieldMap() of the magnetic field; if None, B is uniform inside the radius
+        self.space_charge = space_charge  # optional SpaceCharge() for Coulomb repulsion between the particles
+        if space_charge is not None and not self.context.relativistic:
+            # Only the relativistic pusher moves every particle and adds their field; the classical update moves just
+            # the electron, through compute_electric_force(), so the repulsion would silently be left out
+            raise ValueError("Space charge needs the relativistic pusher; pass a context with relativistic = True")
+        self.statistics = statistics  # optional BeamStatistics() of the bunch, updated by relativistic_step()
         self.base = vis.cylinder(pos = vec(0, 0, -2), axis = vec(0, 0, 1), radius = self.radius,
                                  color = vis.color.gray(0.6))
         self.top_plate = vis.box(pos = vec(0, .5, -1), length = 20, height = .25, width = 1, color = vis.color.red)
         self.bottom_plate = vis.box(pos = vec(0, -.5, -1), length = 20, height = .25, width = 1, color = vis.color.blue)
         self.polarity = "up"
-        self.e_field = vec(0, E_mag, 0)
+        self.drawn_polarity = "up"  # the polarity the plates and the arrow currently show, see draw_polarity()
+        self.e_field = vec(0, self.context.E_mag, 0)
         self.e_indicator = vis.arrow(pos = vec(-11, 0, 0), axis = vec(0, 2, 0), color = vis.color.yellow)
-        self.b_field = vec(0, 0, -B_mag)  # 1 mT in -z direction
+        self.b_field = vec(0, 0, -self.context.B_mag)  # 1 mT in -z direction
         self.time_label = vis.label(pixel_pos = vec(0, 0, 0), xoffset = 100, yoffset = -1 * (scene.height - 30),
                                     align = "left", box = True, line = False)
+        # Changes from the widgets, made between steps, and the PhysicsThread() stepping the cyclotron
+        self.commands = CommandQueue()
+        self.physics = None
 
     def polarity_up(self):
         if self.polarity is not "up":
             self.polarity = "up"
-            self.e_field = vec(0, E_mag, 0)
-            self.e_indicator.rotate(angle = np.pi, axis = vec(0, 0, 1))
-            self.top_plate.color = vis.color.red
-            self.bottom_plate.color = vis.color.blue
+            self.e_field = vec(0, self.context.E_mag, 0)
 
     def polarity_down(self):
         if self.polarity is not "down":
             self.polarity = "down"
-            self.e_field = vec(0, -E_mag, 0)
+            self.e_field = vec(0, -self.context.E_mag, 0)
+
+    def draw_polarity(self, polarity):
+        """
+        Colors the plates and points the field arrow for a polarity; only the render loop should call this
+        :param polarity: "up" or "down"
+        """
+        if polarity != self.drawn_polarity:
+            self.drawn_polarity = polarity
             self.e_indicator.rotate(angle = np.pi, axis = vec(0, 0, 1))
-            self.top_plate.color = vis.color.blue
-            self.bottom_plate.color = vis.color.red
-
-    def update_visuals(self):
-        """Update all visuals for each body in the system"""
+            self.top_plate.color = vis.color.red if polarity == "up" else vis.color.blue
+            self.bottom_plate.color = vis.color.blue if polarity == "up" else vis.color.red
+
+    def sample_e_field(self, positions):
+        """
+        Samples the electric field map at many positions at once, scaled by the current plate polarity and |E|
+        :param positions: an (n, 3) array of positions in meters
+        :return: an (n, 3) array of electric field vectors
+        """
+        polarity_sign = 1 if self.polarity == "up" else -1
+        return polarity_sign * self.e_field.mag * self.e_map.sample(positions)
+
+    def sample_b_field(self, positions):
+        """
+        Samples the magnetic field map at many positions at once, scaled by the current |B|
+        :param positions: an (n, 3) array of positions in meters
+        :return: an (n, 3) array of magnetic field vectors
+        """
+        return self.b_field.mag * self.b_map.sample(positions)
+
+    def in_dee(self, particle):
+        """
+        Checks whether a particle is inside one of the dees, where there is no electric field and B is uniform
+        :param particle: a Particle() instance
+        :return: True if the particle's orbit can be advanced analytically
+        """
+        if self.e_map is not None or self.b_map is not None or self.space_charge is not None:
+            return False  # the analytic orbit is only exact for the uniform fields of the simple geometry, alone
+        between_plates = self.bottom_plate.pos.y <= particle.pos.y <= self.top_plate.pos.y
+        return particle.pos.mag < self.radius and not between_plates
+
+    def fields_at(self, positions):
+        """
+        Computes the electric and magnetic fields at many positions at once, using the field maps if they were given
+        :param positions: an (n, 3) array of positions in meters
+        :return: a tuple of (E, B), each an (n, 3) array
+        """
+        positions = np.asarray(positions, dtype = float)
+        if self.e_map is not None:
+            E = self.sample_e_field(positions)
+        else:  # E is only present between the plates
+            y = positions[:, 1]
+            between_plates = (self.bottom_plate.pos.y <= y) & (y <= self.top_plate.pos.y)
+            E = between_plates[:, None] * np.array([self.e_field.x, self.e_field.y, self.e_field.z])
+        if self.b_map is not None:
+            B = self.sample_b_field(positions)
+        else:  # B is only present inside the cyclotron
+            inside = np.linalg.norm(positions, axis = 1) < self.radius
+            B = inside[:, None] * np.array([self.b_field.x, self.b_field.y, self.b_field.z])
+        return E, B
+
+    def snapshot(self):
+        """
+        Copies what the screen shows of the cyclotron now, e.g. for the render loop to draw while the physics moves on
+        :return: a CyclotronSnapshot() instance
+        """
+        return CyclotronSnapshot(self)
+
+    def start_physics(self, step, publish_interval = 1 / 60):
+        """
+        Starts stepping the cyclotron in a background PhysicsThread(), which applies self.commands before each step
+        and publishes a snapshot() for the render loop about once a frame. From then on only that thread may change the
+        particles, the fields or the context; submit changes to self.commands instead, as the widgets do.
+        :param step: a function () -> None which advances the cyclotron by one step, like the body of the main loop
+        :param publish_interval: the shortest time between snapshots in seconds
+        :return: the PhysicsThread() instance; draw its poll() results with update_visuals()
+        """
+        self.physics = PhysicsThread(step, self.snapshot, self.commands, publish_interval)
+        self.physics.start()
+        return self.physics
+
+    def update_visuals(self, snapshot = None):
+        """
+        Update all visuals for each body in the system
+        :param snapshot: a CyclotronSnapshot() from snapshot() to draw; defaults to the current state of the cyclotron
+        """
+        if snapshot is None:
+            snapshot = self.snapshot()
         # Update time visuals
-        self.time_label.text = "t = {:.3e}".format(t)
+        self.time_label.text = "t = {:.3e}".format(snapshot.t)
+        if snapshot.summary is not None:
+            self.time_label.text += "\n" + snapshot.summary
+        self.draw_polarity(snapshot.polarity)
         # Update visuals for all bodies
-        for body in self.bodies:
-            body.update_visuals()
+        for body, pos, vel in zip(self.bodies, snapshot.positions, snapshot.velocities):
+            body.update_visuals(pos, vel)
 
 
 scene = vis.canvas(title = "Cyclotron simulation!   ", width = 1600, height = 900)
@@ -99,21 +265,46 @@ def add_widgets(scene, cyclotron):
     def follow_body(menu):
         scene.camera.follow(cyclotron.bodies[menu.index].visual)
 
+    context = cyclotron.context
+    commands = cyclotron.commands  # changes to the simulation are queued, and made between steps
+
     def change_dt(slider):
-        global dt
-        dt = 10 ** slider.value
-        dt_text.text = "dt={:.2e}s:".format(dt)
+        commands.submit(setattr, context, "dt", 10 ** slider.value)
+        dt_text.text = "dt={:.2e}s:".format(10 ** slider.value)
 
     def change_E(slider):
-        global E_mag
-        E_mag = 10 ** slider.value
-        E_text.text = "|E|={:.2e}s:".format(E_mag)
+        commands.submit(setattr, context, "E_mag", 10 ** slider.value)
+        E_text.text = "|E|={:.2e}s:".format(10 ** slider.value)
 
-    def change_B(slider):
-        global B_mag
-        B_mag = 10 ** slider.value
+    def set_B(B_mag):
+        context.B_mag = B_mag
         cyclotron.b_field = vec(0, 0, -B_mag)
-        B_text.text = "|B|={:.2e}s:".format(B_mag)
+
+    def change_B(slider):
+        commands.submit(set_B, 10 ** slider.value)
+        B_text.text = "|B|={:.2e}s:".format(10 ** slider.value)
+
+    def toggle_relativistic(checkbox):
+        if cyclotron.space_charge is not None and not checkbox.checked:
+            checkbox.checked = True  # space charge only works with the relativistic pusher, see Cyclotron()
+            return
+        commands.submit(setattr, context, "relativistic", checkbox.checked)
+
+    def toggle_gyration(checkbox):
+        commands.submit(setattr, context, "analytic_gyration", checkbox.checked)
+
+    def toggle_exact_crossings(checkbox):
+        commands.submit(setattr, context, "exact_crossings", checkbox.checked)
+
+    def set_profiling(enabled):
+        cyclotron.profiler.set_enabled(enabled)
+        if not enabled:  # report and save what was recorded
+            print(cyclotron.profiler.summary())
+            cyclotron.profiler.save_json("profile.json")
+            cyclotron.profiler.save_chrome_trace("profile_trace.json")
+
+    def toggle_profiler(checkbox):
+        commands.submit(set_profiling, checkbox.checked)
 
     def toggle_infobox(checkbox):
         for body in cyclotron.bodies:
@@ -129,12 +320,23 @@ def add_widgets(scene, cyclotron):
              bind = follow_body)
     vis.wtext(pos = scene.title_anchor, text = "    ")
 
-    dt_text = vis.wtext(pos = scene.title_anchor, text = "dt={:.2e}s:".format(dt))
-    vis.slider(pos = scene.title_anchor, min = -15, max = -9, value = np.log10(dt), bind = change_dt, length = 200)
-    E_text = vis.wtext(pos = scene.title_anchor, text = "|E|={:.2e}N/m:".format(E_mag))
-    vis.slider(pos = scene.title_anchor, min = 0, max = 12, value = np.log10(E_mag), bind = change_E, length = 200)
-    B_text = vis.wtext(pos = scene.title_anchor, text = "|B|={:.2e}N/m:".format(B_mag))
-    vis.slider(pos = scene.title_anchor, min = -4, max = 0, value = np.log10(B_mag), bind = change_B, length = 200)
+    dt_text = vis.wtext(pos = scene.title_anchor, text = "dt={:.2e}s:".format(context.dt))
+    vis.slider(pos = scene.title_anchor, min = -15, max = -9, value = np.log10(context.dt), bind = change_dt,
+               length = 200)
+    E_text = vis.wtext(pos = scene.title_anchor, text = "|E|={:.2e}N/m:".format(context.E_mag))
+    vis.slider(pos = scene.title_anchor, min = 0, max = 12, value = np.log10(context.E_mag), bind = change_E,
+               length = 200)
+    B_text = vis.wtext(pos = scene.title_anchor, text = "|B|={:.2e}N/m:".format(context.B_mag))
+    vis.slider(pos = scene.title_anchor, min = -4, max = 0, value = np.log10(context.B_mag), bind = change_B,
+               length = 200)
+    vis.checkbox(pos = scene.title_anchor, text = "Relativistic", checked = context.relativistic,
+                 bind = toggle_relativistic)
+    vis.checkbox(pos = scene.title_anchor, text = "Analytic gyration", checked = context.analytic_gyration,
+                 bind = toggle_gyration)
+    vis.checkbox(pos = scene.title_anchor, text = "Exact crossings", checked = context.exact_crossings,
+                 bind = toggle_exact_crossings)
+    vis.checkbox(pos = scene.title_anchor, text = "Profile", checked = cyclotron.profiler.enabled,
+                 bind = toggle_profiler)
 
 
 # Define constants and global variables ================================================================================
@@ -142,12 +344,26 @@ def add_widgets(scene, cyclotron):
 # Physical constants
 e0 = 8.854e-12  # vacuum permittivity epsilon_0, Farad / meter
 mu0 = 4 * np.pi * 10 ** -7  # vacuum permeability mu_0, Tesla meter / amperes
+c = 2.998e8  # speed of light, meters / second
+
+# Set this to True to step the simulation in a background thread, as fast as it can go, while the main loop only draws
+# the latest state, 60 times a second; with False, the main loop steps and draws in turn as usual
+BACKGROUND_PHYSICS = False
 
-# Global time variables
-t = 0  # simulation time in seconds
-dt = 1e-14  # simulation timestep in seconds; this value can be changed by the slider
-E_mag = 1e7 # N/m
-B_mag = 1e-2 # Tesla
+
+def default_context():
+    """
+    Makes the clock and settings a simulation starts with; each Cyclotron() has its own, so several can run side by side
+    :return: a SimulationContext() instance
+    """
+    return SimulationContext(
+            t = 0,  # simulation time in seconds
+            dt = 1e-14,  # simulation timestep in seconds; this value can be changed by the slider
+            E_mag = 1e7,  # N/m
+            B_mag = 1e-2,  # Tesla
+            relativistic = False,  # if True, use the relativistic Boris pusher, which keeps |v| below c at any |E|
+            analytic_gyration = False,  # if True, jump along the exact orbit inside the dees and only step the gap
+            exact_crossings = False)  # if True, find the exact time particles leave the gap and flip polarity then
 
 
 def compute_electric_force(particle, cyclotron):
@@ -157,6 +373,10 @@ def compute_electric_force(particle, cyclotron):
     :return: a vector (imported as vec) instance which represents the electric force on the particle
     """
 
+    if cyclotron.e_map is not None:  # sample the field map instead of using the hard-coded plate geometry
+        E = cyclotron.sample_e_field([[particle.pos.x, particle.pos.y, particle.pos.z]])[0]
+        return particle.q * vec(*E)
+
     field_region = [cyclotron.bottom_plate.pos.y, cyclotron.top_plate.pos.y]
     if field_region[0] <= particle.pos.y <= field_region[1]:  # field is only present if electron is between the plates
         E = cyclotron.e_field # E is a vec() instance
@@ -179,6 +399,10 @@ def compute_magnetic_force(particle, cyclotron):
     :return: a vector (imported as vec) instance which represents the magnetic force on the particle
     """
 
+    if cyclotron.b_map is not None:  # sample the field map instead of using the hard-coded cyclotron geometry
+        B = cyclotron.sample_b_field([[particle.pos.x, particle.pos.y, particle.pos.z]])[0]
+        return particle.q * particle.vel.cross(vec(*B))
+
     radius = particle.pos.mag
     if radius < cyclotron.radius:  # magnetic field is only present inside the cyclotron
         q = particle.q
@@ -195,41 +419,223 @@ def compute_magnetic_force(particle, cyclotron):
         return vec(0, 0, 0)
 
 
-electron = Particle(color = vis.color.yellow)
-cyclotron = Cyclotron(bodies = [electron, ])
+def crossing_events(cyclotron):
+    """
+    Makes the events which exact_crossings locates: a particle leaving the gap (below or above), which flips the
+    plate polarity, and a particle leaving the cyclotron
+    :param cyclotron: a Cyclotron() instance
+    :return: a list of Event() instances, to be handled by crossing_handler()
+    """
+    return [plane_crossing("below gap", cyclotron.bottom_plate.pos.y, direction = -1),
+            plane_crossing("above gap", cyclotron.top_plate.pos.y, direction = 1),
+            radius_crossing("extracted", cyclotron.radius, direction = 1)]
 
-add_widgets(scene, cyclotron)
 
-# Main simulation loop
-while True:
-    # Begin code here ==================================================================================================
-    # Update the velocity of the particle by computing acceleration due to electric field and due to magnetic fields
+def crossing_handler(cyclotron, particles, energy):
+    """
+    Makes a handler for the events of crossing_events(), which flips the plate polarity the moment a particle leaves
+    the gap, and reports each particle leaving the cyclotron
+    :param cyclotron: a Cyclotron() instance
+    :param particles: the Particle() instances, one per event channel
+    :param energy: a function (record) -> the kinetic energy in eV of the particle in an EventRecord()
+    :return: a function to pass to EventDetector.advance()
+    """
+
+    def handle_event(record):
+        if record.name == "below gap":
+            cyclotron.polarity_up()
+        elif record.name == "above gap":
+            cyclotron.polarity_down()
+        else:  # the particle left the cyclotron
+            print("{} left the cyclotron at t = {:.6e}s with {:.3e} eV".format(
+                    particles[record.channel].name, cyclotron.context.t + record.time, energy(record)))
+
+    return handle_event
+
+
+def exact_crossing_step(particle, cyclotron, dt):
+    """
+    Advances a particle by one timestep with the same update as the main loop, using compute_electric_force() and
+    compute_magnetic_force(), but split at the exact moment it leaves the gap, so the plate polarity flips on time no
+    matter how large dt is
+    :param particle: a Particle() instance
+    :param cyclotron: a Cyclotron() instance
+    :param dt: the timestep in seconds
+    """
 
-    # TODO: compute acceleration due to E and B
-    F_E = compute_electric_force(electron, cyclotron)
-    a_E = F_E / electron.mass
+    def propagate(state, tau):
+        particle.pos, particle.vel = vec(*state[0][0]), vec(*state[1][0])
+        a = (compute_electric_force(particle, cyclotron) + compute_magnetic_force(particle, cyclotron)) / particle.mass
+        vel = particle.vel + a * tau
+        pos = particle.pos + vel * tau
+        return np.array([[pos.x, pos.y, pos.z]]), np.array([[vel.x, vel.y, vel.z]])
 
-    F_B = compute_magnetic_force(electron, cyclotron)
-    a_B = F_B / electron.mass
+    def energy(record):
+        return 0.5 * particle.mass * np.sum(record.state[1][record.channel] ** 2) / abs(particle.q)
 
-    # TODO: update velocity for the electron
-    electron.vel += a_E * dt
-    electron.vel += a_B * dt
-    # End code here ====================================================================================================
+    state = (np.array([[particle.pos.x, particle.pos.y, particle.pos.z]]),
+             np.array([[particle.vel.x, particle.vel.y, particle.vel.z]]))
+    handler = crossing_handler(cyclotron, [particle], energy)
+    positions, velocities = EventDetector(crossing_events(cyclotron), propagate).advance(state, dt, handler)[0]
+    particle.pos = vec(*positions[0])
+    particle.vel = vec(*velocities[0])
 
-    # TODO: update the position of the electron
-    # Begin code here ==================================================================================================
-    electron.pos += electron.vel * dt
-    # End code here ====================================================================================================
+
+def relativistic_step(cyclotron, dt):
+    """
+    Advances every particle in the cyclotron by one timestep with the relativistic Boris pusher, including the
+    repulsion between the particles if the cyclotron has space charge enabled. If exact_crossings is set, the step is
+    split at the exact moment a particle leaves the gap, so the plate polarity flips on time no matter how large dt is.
+    :param cyclotron: a Cyclotron() instance
+    :param dt: the timestep in seconds
+    """
+    particles = cyclotron.particles
+    q, mass = particles.charges, particles.masses
+    old_positions = particles.positions.copy()
+    state = (old_positions, momenta_from_velocities(particles.velocities, mass))
+
+    def propagate(state, tau):
+        E, B = cyclotron.fields_at(state[0])
+        if cyclotron.space_charge is not None:
+            E = E + cyclotron.space_charge.field(state[0], q)
+        return boris_push(state[0], state[1], q, mass, E, B, tau)
+
+    def energy(record):
+        return kinetic_energy(record.state[1][[record.channel]], mass[record.channel])[0] / abs(q[record.channel])
+
+    if cyclotron.context.exact_crossings:
+        handler = crossing_handler(cyclotron, cyclotron.bodies, energy)
+        positions, momenta = EventDetector(crossing_events(cyclotron), propagate).advance(state, dt, handler)[0]
+    else:
+        positions, momenta = propagate(state, dt)
+    if cyclotron.statistics is not None:
+        cyclotron.statistics.observe(old_positions, positions, momenta, q, mass, cyclotron.context.t + dt, dt)
+    particles.positions[:] = positions
+    particles.velocities[:] = velocities_from_momenta(momenta, mass)
+
+
+def gyration_step(cyclotron):
+    """
+    Moves every particle in the cyclotron, all of which must be inside the dees, along its exact circular orbit until
+    the first of them reaches the gap (or the edge of the cyclotron). There is no electric field inside the dees, so
+    this replaces thousands of small steps with a single one, no matter how strong B is. The other particles advance by
+    the same time, so the whole bunch stays in step with the clock. Unless the cyclotron is relativistic, the orbits are
+    the classical ones (with gamma = 1), like the rest of the classical update, even once the particles outrun light.
+    :param cyclotron: a Cyclotron() instance
+    :return: the time in seconds it took the first particle to get there
+    """
+    particles = cyclotron.particles
+    q, mass = particles.charges, particles.masses
+    positions, velocities = particles.positions.copy(), particles.velocities
+    relativistic = cyclotron.context.relativistic
+    momenta = momenta_from_velocities(velocities, mass) if relativistic else mass[:, None] * velocities
+    gap_bounds = (cyclotron.bottom_plate.pos.y, cyclotron.top_plate.pos.y)
+    B_z = cyclotron.b_field.z
+
+    # Advance everyone by the shortest transit, and land the particles which take exactly that long on their boundary
+    transit = dee_transit_time(positions, momenta, q, mass, B_z, gap_bounds, cyclotron.radius, relativistic)
+    elapsed = np.min(transit)
+    B = np.zeros_like(positions)
+    B[:, 2] = B_z
+    new_positions, new_momenta = gyration_push(positions, momenta, q, mass, B, elapsed, relativistic)
+    first = transit == elapsed
+    new_positions[first], new_momenta[first], _ = dee_transit(positions[first], momenta[first], q[first], mass[first],
+                                                              B_z, gap_bounds, cyclotron.radius, relativistic)
+    if cyclotron.statistics is not None:
+        cyclotron.statistics.observe(positions, new_positions, new_momenta, q, mass, cyclotron.context.t + elapsed,
+                                     elapsed)
+
+    new_velocities = velocities_from_momenta(new_momenta, mass) if relativistic else new_momenta / mass[:, None]
+    particles.positions[:] = new_positions
+    particles.velocities[:] = new_velocities
+    return elapsed
+
+
+electron = Particle(color = vis.color.yellow)
+cyclotron = Cyclotron(bodies = [electron, ])
+# To simulate fringe fields at the plate and magnet edges, pass field maps instead:
+# from field_maps import dee_gap_field, uniform_b_field
+# cyclotron = Cyclotron(bodies = [electron, ],
+#                       e_map = dee_gap_field(fringe = 0.1), b_map = uniform_b_field(fringe = 0.5))
+# To make a bunch of particles repel each other, pass space_charge = SpaceCharge(e0 = e0) (from space_charge import
+# SpaceCharge) and context = default_context().copy(relativistic = True), since only the relativistic pusher adds it
+# To collect the energy spectrum, turn count and emittance of the extracted bunch, pass
+# statistics = BeamStatistics(n_particles = len(bodies)) (from beam_statistics import BeamStatistics) and enable
+# "Relativistic"
+
+add_widgets(scene, cyclotron)
+
+
+def step_simulation():
+    """
+    Advances the cyclotron by one step: everything the main simulation loop does except drawing
+    """
+    dt = cyclotron.context.dt
+    profiler = cyclotron.profiler
+    step_dt = dt
+    if cyclotron.context.analytic_gyration and all(cyclotron.in_dee(particle) for particle in cyclotron.bodies):
+        # Inside a dee there is no electric field, so jump straight to the next time a particle reaches the gap
+        with profiler.phase("gyration"):
+            step_dt = gyration_step(cyclotron)
+    elif cyclotron.context.relativistic:
+        # Advance every particle with the relativistic Boris pusher, which keeps |v| below c at any |E|
+        with profiler.phase("push"):
+            relativistic_step(cyclotron, dt)
+    elif cyclotron.context.exact_crossings:
+        # The same update as below, split at the exact moment the electron leaves the gap to flip the polarity then
+        with profiler.phase("events"):
+            exact_crossing_step(electron, cyclotron, dt)
+    else:
+        with profiler.phase("forces"):
+            # Begin code here ==========================================================================================
+            # Update the velocity of the particle by computing acceleration due to electric and magnetic fields
+
+            # TODO: compute acceleration due to E and B
+            F_E = compute_electric_force(electron, cyclotron)
+            a_E = F_E / electron.mass
+
+            F_B = compute_magnetic_force(electron, cyclotron)
+            a_B = F_B / electron.mass
+
+            # TODO: update velocity for the electron
+            electron.vel += a_E * dt
+            electron.vel += a_B * dt
+            # End code here ============================================================================================
+
+        with profiler.phase("positions"):
+            # TODO: update the position of the electron
+            # Begin code here ==========================================================================================
+            electron.pos += electron.vel * dt
+            # End code here ============================================================================================
 
     # Update time and iteration
-    t += dt
+    cyclotron.context.advance(step_dt)
+    profiler.step()
+
+    # Switch plate polarity when electron passes one of the plates, unless the exact crossings already did
+    if not cyclotron.context.exact_crossings:
+        with profiler.phase("polarity"):
+            if electron.pos.y < cyclotron.bottom_plate.pos.y:
+                cyclotron.polarity_up()
+            elif electron.pos.y > cyclotron.top_plate.pos.y:
+                cyclotron.polarity_down()
 
-    # Switch plate polarity when electron passes one of the plates
-    if electron.pos.y < cyclotron.bottom_plate.pos.y:
-        cyclotron.polarity_up()
-    elif electron.pos.y > cyclotron.top_plate.pos.y:
-        cyclotron.polarity_down()
 
-    # Update the visuals
-    cyclotron.update_visuals()
+# Main simulation loop
+if BACKGROUND_PHYSICS:
+    # Step in the background and draw whichever state is newest each frame, skipping any the screen was too slow for
+    physics = cyclotron.start_physics(step_simulation)
+    while True:
+        vis.rate(60)
+        snapshot = physics.poll()
+        if snapshot is not None:
+            with cyclotron.profiler.phase("visuals"):
+                cyclotron.update_visuals(snapshot)
+else:
+    while True:
+        cyclotron.commands.apply()
+        step_simulation()
+
+        # Update the visuals
+        with cyclotron.profiler.phase("visuals"):
+            cyclotron.update_visuals()
@@ -0,0 +1,213 @@
+import numpy as np
+
+# Shared with the other problem set's simulator; see test_shared_modules.py before changing it.
+#
+# The simulation state is a tuple of (positions, velocities) arrays, each of shape (n, 3). For the cyclotron the second
+# array may hold momenta instead, which point in the same direction as the velocities.
+
+
+class Event:
+    """
+    This class represents something that happens when a function of the simulation state changes sign, such as a
+    particle crossing a plate or two bodies colliding. The function returns one value per channel (e.g. one per
+    particle, or one per pair of bodies), so a single Event can watch every particle at once.
+    """
+
+    def __init__(self, name, function, direction = 0, terminal = False):
+        """
+        :param name: a name for the event, e.g. "periapsis"
+        :param function: a function mapping a state (positions, velocities) to an (m,) array of values
+        :param direction: +1 to only detect crossings from negative to positive, -1 for positive to negative, or 0 for
+                          both
+        :param terminal: if True, the simulation should stop when this event happens
+        """
+        self.name = name
+        self.function = function
+        self.direction = direction
+        self.terminal = terminal
+
+    def __call__(self, state):
+        return np.atleast_1d(self.function(state))
+
+    def crossed(self, before, after):
+        """Which channels changed sign in the watched direction between two evaluations of the event function"""
+        rising = (before < 0) & (after >= 0)
+        falling = (before > 0) & (after <= 0)
+        if self.direction > 0:
+            return rising
+        if self.direction < 0:
+            return falling
+        return rising | falling
+
+
+class EventRecord:
+    """
+    A record of an event which happened during a step
+    """
+
+    def __init__(self, event, channel, time, state):
+        self.event = event
+        self.name = event.name
+        self.channel = channel  # which particle, body, or pair of bodies the event happened to
+        self.time = time  # time since the start of the step, in seconds
+        self.state = state  # the simulation state just after the event
+
+    def __repr__(self):
+        return "EventRecord({}, channel = {}, time = {:.6e})".format(self.name, self.channel, self.time)
+
+
+class EventDetector:
+    """
+    This class finds the exact times at which events happen within a timestep. Instead of checking a condition after
+    each step (which notices a crossing up to one dt late), it brackets every sign change of the event functions and
+    refines it with the Illinois variant of regula falsi, re-integrating from the start of the step with the same
+    integrator the simulation uses. This makes the timing of events independent of dt, so larger steps can be taken.
+    """
+
+    def __init__(self, events, propagate, tol = 1e-9, max_iter = 60):
+        """
+        :param events: a list of Event() instances
+        :param propagate: a function (state, tau) -> state which advances a state by a time tau with the simulation's
+                          integrator; tau may be any fraction of the timestep
+        :param tol: the tolerance on event times, as a fraction of the timestep
+        :param max_iter: the maximum number of root-finding iterations per event
+        """
+        self.events = events
+        self.propagate = propagate
+        self.tol = tol
+        self.max_iter = max_iter
+
+    def _refine(self, event, channel, state, dt, g_start, g_end):
+        """Finds the time of a single sign change within [0, dt], returning the time and state just after it"""
+        lower, upper = 0.0, dt
+        g_lower, g_upper = g_start, g_end
+        upper_state = None
+        side = 0
+        for _ in range(self.max_iter):
+            if upper - lower <= self.tol * dt:
+                break
+            # Regula falsi, with the Illinois trick of halving the stale endpoint so convergence stays superlinear
+            tau = (lower * g_upper - upper * g_lower) / (g_upper - g_lower)
+            if not lower < tau < upper:
+                tau = (lower + upper) / 2
+            trial_state = self.propagate(state, tau)
+            g_tau = event(trial_state)[channel]
+            if event.crossed(np.array([g_lower]), np.array([g_tau]))[0]:
+                upper, g_upper, upper_state = tau, g_tau, trial_state
+                if side == -1:
+                    g_lower /= 2
+                side = -1
+            else:
+                lower, g_lower = tau, g_tau
+                if side == 1:
+                    g_upper /= 2
+                side = 1
+        if upper_state is None:
+            upper_state = self.propagate(state, upper)
+        return upper, upper_state
+
+    def locate(self, state, new_state, dt):
+        """
+        Finds all events which happened during a step
+        :param state: the state at the start of the step
+        :param new_state: the state at the end of the step
+        :param dt: the length of the step in seconds
+        :return: a list of EventRecord() instances, sorted by time
+        """
+        records = []
+        for event in self.events:
+            g_start = event(state)
+            g_end = event(new_state)
+            for channel in np.flatnonzero(event.crossed(g_start, g_end)):
+                time, event_state = self._refine(event, channel, state, dt, g_start[channel], g_end[channel])
+                records.append(EventRecord(event, channel, time, event_state))
+        return sorted(records, key = lambda record: record.time)
+
+    def advance(self, state, dt, handler = None):
+        """
+        Advances a state by dt, stopping at each event to let a handler react to it (e.g. by flipping the plate
+        polarity) before integrating the rest of the step. Stops early at a terminal event.
+        :param state: the state at the start of the step
+        :param dt: the length of the step in seconds
+        :param handler: a function called with each EventRecord() as it happens, or None
+        :return: a tuple of (new state, time elapsed, list of EventRecord() instances with times since the start)
+        """
+        elapsed = 0.0
+        history = []
+        while True:
+            remaining = dt - elapsed
+            new_state = self.propagate(state, remaining)
+            records = self.locate(state, new_state, remaining)
+            if not records:
+                return new_state, dt, history
+
+            # Only the first event can be trusted, since the handler may change the dynamics after it
+            first = records[0]
+            first.time += elapsed
+            history.append(first)
+            if handler is not None:
+                handler(first)
+            state = first.state
+            elapsed = first.time
+            if first.event.terminal or elapsed >= dt:
+                return state, elapsed, history
+
+
+# Common events ========================================================================================================
+
+def plane_crossing(name, level, axis = 1, direction = 0, terminal = False):
+    """
+    An event for particles crossing a plane perpendicular to a coordinate axis, such as the cyclotron plates
+    :param level: the coordinate of the plane in meters
+    :param axis: 0, 1 or 2 for a plane perpendicular to x, y or z
+    :return: an Event() instance with one channel per particle
+    """
+    return Event(name, lambda state: state[0][:, axis] - level, direction, terminal)
+
+
+def radius_crossing(name, radius, center = None, direction = 0, terminal = False):
+    """
+    An event for particles crossing a sphere, such as the edge of the cyclotron or a region around a Lagrange point
+    :param radius: the radius of the sphere in meters
+    :param center: the center of the sphere, either a fixed (3,) array, or a function of the state for a moving center
+                   (e.g. the current position of L2); defaults to the origin
+    :param direction: +1 for particles leaving the sphere, -1 for particles entering it, or 0 for both
+    :return: an Event() instance with one channel per particle
+    """
+
+    def function(state):
+        origin = np.zeros(3) if center is None else center(state) if callable(center) else np.asarray(center)
+        return np.linalg.norm(state[0] - origin, axis = 1) - radius
+
+    return Event(name, function, direction, terminal)
+
+
+def pair_collision(name, radii, terminal = False):
+    """
+    An event for any two bodies touching; channel k is the k-th pair (i, j) with i < j, as given by np.triu_indices
+    :param radii: an (n,) array of the radii of the bodies in meters
+    :return: an Event() instance with one channel per pair of bodies
+    """
+    radii = np.asarray(radii, dtype = float)
+    i, j = np.triu_indices(len(radii), k = 1)
+
+    def function(state):
+        return np.linalg.norm(state[0][i] - state[0][j], axis = 1) - (radii[i] + radii[j])
+
+    return Event(name, function, direction = -1, terminal = terminal)
+
+
+def periapsis(name, index, primary_index, terminal = False):
+    """
+    An event for a body passing its closest point to a primary body, where its radial velocity turns from inward to
+    outward
+    :param index: the index of the orbiting body in the state arrays
+    :param primary_index: the index of the primary body (e.g. the Sun)
+    :return: an Event() instance with a single channel
+    """
+
+    def function(state):
+        positions, velocities = state
+        return np.dot(positions[index] - positions[primary_index], velocities[index] - velocities[primary_index])
+
+    return Event(name, function, direction = 1, terminal = terminal)
@@ -0,0 +1,181 @@
+import numpy as np
+
+# Physical constants
+c = 2.998e8  # speed of light, meters / second
+
+
+class FieldMap:
+    """
+    This class represents a vector field (such as E or B) sampled on a regular 2D or 3D grid. Fields are looked up with
+    trilinear interpolation for many positions at once, so arbitrary field geometry (fringe fields, multiple dees,
+    non-uniform B) costs the same as the hard-coded checks, with no Python branch per particle. A grid with a single
+    layer along an axis is treated as constant along that axis, e.g. shape (nx, ny, 1) describes a field which does
+    not depend on z. The field is zero outside the grid.
+    """
+
+    def __init__(self, values, lower, upper):
+        """
+        :param values: an (nx, ny, nz, 3) array of the field vectors at the grid points
+        :param lower: the (x, y, z) coordinates of the grid point values[0, 0, 0]
+        :param upper: the (x, y, z) coordinates of the grid point values[-1, -1, -1]
+        """
+        self.values = np.asarray(values, dtype = float)
+        self.lower = np.asarray(lower, dtype = float)
+        self.upper = np.asarray(upper, dtype = float)
+        self.shape = np.array(self.values.shape[:3])
+        self.spacing = np.where(self.shape > 1, (self.upper - self.lower) / np.maximum(self.shape - 1, 1), 1.0)
+
+    @classmethod
+    def from_function(cls, function, lower, upper, shape):
+        """
+        Builds a field map by evaluating a vectorized function at every grid point
+        :param function: a function mapping an (n, 3) array of positions to an (n, 3) array of field vectors
+        :param lower: the (x, y, z) coordinates of the lower corner of the grid
+        :param upper: the (x, y, z) coordinates of the upper corner of the grid
+        :param shape: the number of grid points (nx, ny, nz) along each axis
+        :return: a FieldMap() instance
+        """
+        axes = [np.linspace(lo, hi, n) if n > 1 else np.array([lo]) for lo, hi, n in zip(lower, upper, shape)]
+        grid = np.stack(np.meshgrid(*axes, indexing = "ij"), axis = -1)
+        values = function(grid.reshape(-1, 3)).reshape(tuple(shape) + (3,))
+        return cls(values, lower, upper)
+
+    def __add__(self, other):
+        """Superposes two field maps defined on the same grid"""
+        return FieldMap(self.values + other.values, self.lower, self.upper)
+
+    def __mul__(self, scale):
+        """Scales the field by a constant"""
+        return FieldMap(self.values * scale, self.lower, self.upper)
+
+    __rmul__ = __mul__
+
+    def sample(self, positions):
+        """
+        Interpolates the field at many positions in one vectorized gather
+        :param positions: an (n, 3) array of positions in meters
+        :return: an (n, 3) array of field vectors
+        """
+        positions = np.atleast_2d(np.asarray(positions, dtype = float))
+        fractional_index = (positions - self.lower) / self.spacing
+
+        # Points outside the grid feel no field; single-layer axes are constant so they never count as outside
+        varies = self.shape > 1
+        inside = np.all((fractional_index >= 0) & (fractional_index <= self.shape - 1) | ~varies, axis = 1)
+
+        # Index of the lower corner of each particle's grid cell, and its fractional position within the cell
+        i0 = np.clip(np.floor(fractional_index).astype(int), 0, np.maximum(self.shape - 2, 0))
+        i0[:, ~varies] = 0
+        weight = np.where(varies, fractional_index - i0, 0.0)
+        i1 = np.minimum(i0 + 1, self.shape - 1)
+
+        # Gather the eight corners of each cell and blend them
+        field = np.zeros((len(positions), 3))
+        for corner in range(8):
+            upper_corner = np.array([(corner >> axis) & 1 for axis in range(3)], dtype = bool)
+            index = np.where(upper_corner, i1, i0)
+            corner_weight = np.prod(np.where(upper_corner, weight, 1 - weight), axis = 1)
+            field += corner_weight[:, None] * self.values[index[:, 0], index[:, 1], index[:, 2]]
+        field[~inside] = 0
+        return field
+
+
+# Field geometries =====================================================================================================
+
+def _grid_bounds(radius, margin):
+    """Lower and upper corners of a single-layer grid covering the cyclotron plus a margin for fringe fields"""
+    extent = radius * (1 + margin)
+    return (-extent, -extent, 0.0), (extent, extent, 0.0)
+
+
+def _edge_profile(distance, fringe):
+    """Smooth step which is 1 well inside an edge (distance > 0), 0 well outside, and 1/2 at the edge"""
+    if fringe <= 0:
+        return np.where(distance > 0, 1.0, np.where(distance == 0, 0.5, 0.0))
+    return 0.5 * (1 + np.tanh(distance / fringe))
+
+
+def dee_gap_field(radius = 10.0, gap = 1.0, n_dees = 2, fringe = 0.0, resolution = 201, margin = 0.1):
+    """
+    Builds the accelerating electric field in the gaps between the dees, normalized to a magnitude of 1 N/C between
+    the plates; multiply by the signed field magnitude to get the field at a given RF phase. The gaps are radial strips
+    at angles 2 pi k / n_dees, and the field across neighboring gaps alternates direction, as it does when neighboring
+    dees are driven with opposite polarity. For n_dees = 2 this reproduces the single straight gap between the plates at
+    y = -gap / 2 and y = +gap / 2, with the field pointing in +y.
+    :param radius: radius of the cyclotron in meters
+    :param gap: width of each gap in meters
+    :param n_dees: number of dees (should be even, so the gap polarities alternate consistently)
+    :param fringe: length scale in meters over which the field falls off at the plate edges; 0 for a sharp edge
+    :param resolution: number of grid points along x and y
+    :param margin: fraction of the radius by which the grid extends past the cyclotron
+    :return: a FieldMap() instance
+    """
+
+    def field(positions):
+        values = np.zeros_like(positions)
+        for k in range(n_dees):
+            angle = 2 * np.pi * k / n_dees
+            radial = np.array([np.cos(angle), np.sin(angle), 0.0])
+            azimuthal = np.array([-np.sin(angle), np.cos(angle), 0.0])
+
+            # Distance along and across the gap; the half-open test along the gap avoids double-counting the center
+            along = positions @ radial
+            across = positions @ azimuthal
+            in_gap = np.where(along > 0, 1.0, np.where(along == 0, 0.5, 0.0)) * (along <= radius)
+            strength = in_gap * _edge_profile(gap / 2 - np.abs(across), fringe)
+            values += (-1) ** k * strength[:, None] * azimuthal
+        return values
+
+    lower, upper = _grid_bounds(radius, margin)
+    return FieldMap.from_function(field, lower, upper, (resolution, resolution, 1))
+
+
+def uniform_b_field(radius = 10.0, fringe = 0.0, resolution = 201, margin = 0.1):
+    """
+    Builds a magnetic field which is uniform inside the cyclotron and falls off at its edge, normalized to 1 T in the -z
+    direction; multiply by the field magnitude to get the field
+    :param radius: radius of the cyclotron in meters
+    :param fringe: length scale in meters over which the field falls off at the edge; 0 for a sharp edge
+    :param resolution: number of grid points along x and y
+    :param margin: fraction of the radius by which the grid extends past the cyclotron
+    :return: a FieldMap() instance
+    """
+
+    def field(positions):
+        r = np.linalg.norm(positions[:, :2], axis = 1)
+        values = np.zeros_like(positions)
+        values[:, 2] = -_edge_profile(radius - r, fringe)
+        return values
+
+    lower, upper = _grid_bounds(radius, margin)
+    return FieldMap.from_function(field, lower, upper, (resolution, resolution, 1))
+
+
+def isochronous_b_field(B0, q = 1.6e-19, mass = 9.109e-31, radius = 10.0, fringe = 0.0, max_beta = 0.99,
+                        resolution = 201, margin = 0.1):
+    """
+    Builds an isochronous magnetic field, which grows with radius as B(r) = B0 * gamma(r) so that the relativistic
+    cyclotron frequency q B / (gamma m) stays constant as the particle speeds up. The field is normalized so that
+    B(0) = 1 T in the -z direction; multiply by B0 to get the field. Beyond the radius at which a particle would reach
+    max_beta the field is held constant, since no real particle can get there at the design frequency.
+    :param B0: the central field in Tesla, which sets the design cyclotron frequency
+    :param q: charge of the design particle in coulomb
+    :param mass: mass of the design particle in kg
+    :param radius: radius of the cyclotron in meters
+    :param fringe: length scale in meters over which the field falls off at the edge; 0 for a sharp edge
+    :param max_beta: largest v / c for which the isochronous condition is applied
+    :param resolution: number of grid points along x and y
+    :param margin: fraction of the radius by which the grid extends past the cyclotron
+    :return: a FieldMap() instance
+    """
+    omega = abs(q) * B0 / mass
+
+    def field(positions):
+        r = np.linalg.norm(positions[:, :2], axis = 1)
+        beta = np.minimum(omega * r / c, max_beta)
+        values = np.zeros_like(positions)
+        values[:, 2] = -_edge_profile(radius - r, fringe) / np.sqrt(1 - beta ** 2)
+        return values
+
+    lower, upper = _grid_bounds(radius, margin)
+    return FieldMap.from_function(field, lower, upper, (resolution, resolution, 1))
@@ -0,0 +1,210 @@
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from context import SimulationContext
+from pushers import boris_push, kahan_add, kinetic_energy, momenta_from_velocities
+
+# Columns of the array returned by parameter_scan(), one row per run
+SCAN_DTYPE = np.dtype([
+    ("E_mag", float),  # electric field between the plates, N/C
+    ("B_mag", float),  # magnetic field inside the cyclotron, Tesla
+    ("rf_frequency", float),  # frequency of the accelerating voltage in Hz, or nan to flip it at the plates
+    ("dt", float),  # timestep in seconds
+    ("initial_condition", int),  # index into the initial positions and velocities
+    ("energy", float),  # kinetic energy at extraction (or at max_time if the particle never left), eV
+    ("extraction_time", float),  # time at which the particle left the cyclotron in seconds, or nan if it never did
+    ("extracted", bool),
+])
+
+
+def cyclotron_fields(positions, polarity, time, E_mag, B_mag, rf_frequency, phase0 = 0.0, radius = 10.0, gap = 1.0):
+    """
+    Computes the fields of the simple cyclotron geometry (a uniform E in +y between the plates, a uniform B in -z inside
+    the radius) for many particles, each with its own field settings
+    :param positions: an (n, 3) array of positions in meters
+    :param polarity: an (n,) array of +1 or -1 plate polarities, used where rf_frequency is nan
+    :param time: the simulation time in seconds
+    :param E_mag: an (n,) array of electric field magnitudes in N/C
+    :param B_mag: an (n,) array of magnetic field magnitudes in Tesla
+    :param rf_frequency: an (n,) array of frequencies of the accelerating voltage in Hz; where it is nan the polarity
+                         flips when the particle leaves the gap, as in the interactive simulation
+    :param phase0: the phase of the accelerating voltage at t = 0
+    :param radius: radius of the cyclotron in meters
+    :param gap: distance between the plates in meters
+    :return: a tuple of (E, B), each an (n, 3) array
+    """
+    between_plates = np.abs(positions[:, 1]) <= gap / 2
+    rf_voltage = np.cos(2 * np.pi * np.nan_to_num(rf_frequency) * time + phase0)
+    voltage = np.where(np.isnan(rf_frequency), polarity, rf_voltage)
+    E = np.zeros_like(positions)
+    E[:, 1] = between_plates * E_mag * voltage
+    B = np.zeros_like(positions)
+    B[:, 2] = -B_mag * (np.linalg.norm(positions, axis = 1) < radius)
+    return E, B
+
+
+class CyclotronBunch:
+    """
+    This class represents many independent particles going through the simple cyclotron geometry with no visuals.
+    The clock and the field settings (E_mag, B_mag and rf_frequency, each a scalar or one value per particle) live in
+    a SimulationContext(), so many bunches can run side by side in one interpreter. With precision = "float32" the
+    positions and momenta are stored and pushed in float32, which halves the memory traffic for large ensembles;
+    positions are then measured from the center of the cyclotron and updated with Kahan compensation, so the rounding
+    of many small steps does not add up.
+    """
+
+    def __init__(self, positions, velocities, context, q = 1.6e-19, mass = 9.109e-31, phase0 = 0.0, radius = 10.0,
+                 gap = 1.0, precision = "float64"):
+        """
+        :param positions: an (n, 3) array of initial positions in meters
+        :param velocities: an (n, 3) array of initial velocities in m/s
+        :param context: a SimulationContext() with dt, E_mag, B_mag and (optionally) rf_frequency; an rf_frequency of
+                        nan, or none at all, flips the polarity at the plates
+        :param q: charge of the particles in coulomb
+        :param mass: rest mass of the particles in kg
+        :param phase0: the phase of the accelerating voltage at t = 0
+        :param radius: radius of the cyclotron in meters
+        :param gap: distance between the plates in meters
+        :param precision: "float64", or "float32" for compensated single-precision storage
+        """
+        if precision not in ("float64", "float32"):
+            raise ValueError("Unknown precision: {}".format(precision))
+        self.dtype = np.dtype(precision)
+        self.positions = np.array(positions, dtype = self.dtype)
+        self.position_compensation = np.zeros_like(self.positions) if precision == "float32" else None
+        self.momenta = momenta_from_velocities(np.asarray(velocities, dtype = float), mass).astype(self.dtype)
+        self.context = context
+        self.q = self.dtype.type(q)
+        self.mass = self.dtype.type(mass)
+        self.phase0 = phase0
+        self.radius = radius
+        self.gap = gap
+        self.polarity = np.ones(len(self.positions))
+        self.extraction_time = np.full(len(self.positions), np.nan)
+        self.active = np.arange(len(self.positions))  # indices of the particles still inside the cyclotron
+
+    @property
+    def done(self):
+        return len(self.active) == 0
+
+    @property
+    def energies(self):
+        """Kinetic energy of every particle in eV"""
+        return kinetic_energy(self.momenta.astype(float), float(self.mass)) / abs(float(self.q))
+
+    def step(self):
+        """Advances the particles still inside the cyclotron by one timestep with the relativistic Boris pusher"""
+        context = self.context
+        active = self.active
+        n = len(self.positions)
+        E_mag, B_mag, rf_frequency = (np.broadcast_to(value, (n,))[active] for value in
+                                      (context.E_mag, context.B_mag, getattr(context, "rf_frequency", np.nan)))
+        pos = self.positions[active]
+        E, B = cyclotron_fields(pos, self.polarity[active], context.t, E_mag, B_mag, rf_frequency, self.phase0,
+                                self.radius, self.gap)
+        dt = self.dtype.type(context.dt)
+        if self.position_compensation is None:
+            new_pos, self.momenta[active] = boris_push(pos, self.momenta[active], self.q, self.mass, E, B, dt)
+        else:  # push from the origin to get just the drift, then add it to the positions with compensation
+            drift, self.momenta[active] = boris_push(np.zeros_like(pos), self.momenta[active], self.q, self.mass, E,
+                                                     B, dt)
+            new_pos, compensation = pos.copy(), self.position_compensation[active]
+            kahan_add(new_pos, compensation, drift)
+            self.position_compensation[active] = compensation
+        self.positions[active] = new_pos
+        context.advance()
+
+        # Switch plate polarity when a particle passes one of the plates
+        self.polarity[active[new_pos[:, 1] < -self.gap / 2]] = 1
+        self.polarity[active[new_pos[:, 1] > self.gap / 2]] = -1
+
+        # Stop pushing particles once they leave the cyclotron
+        left = np.linalg.norm(new_pos, axis = 1) >= self.radius
+        self.extraction_time[active[left]] = context.t
+        self.active = active[~left]
+
+
+def run_batch(E_mag, B_mag, rf_frequency, positions, velocities, dt, max_time, **kwargs):
+    """
+    Runs many independent particles through the cyclotron at once, each with its own field settings, until they all
+    leave the cyclotron or max_time is reached
+    :param E_mag: an (n,) array of electric field magnitudes in N/C
+    :param B_mag: an (n,) array of magnetic field magnitudes in Tesla
+    :param rf_frequency: an (n,) array of RF frequencies in Hz, or nan to flip the polarity at the plates
+    :param positions: an (n, 3) array of initial positions in meters
+    :param velocities: an (n, 3) array of initial velocities in m/s
+    :param dt: the timestep in seconds
+    :param max_time: the longest time to simulate in seconds
+    :param kwargs: other arguments to CyclotronBunch(), e.g. q, mass, phase0, radius or gap
+    :return: a tuple of (energies in eV, extraction times in seconds with nan for particles which never left)
+    """
+    context = SimulationContext(dt = dt, E_mag = E_mag, B_mag = B_mag, rf_frequency = rf_frequency)
+    bunch = CyclotronBunch(positions, velocities, context, **kwargs)
+    while context.t < max_time and not bunch.done:
+        bunch.step()
+    return bunch.energies, bunch.extraction_time
+
+
+def _run_chunk(args):
+    """Runs one chunk of a scan in a worker process"""
+    rows, initial_positions, initial_velocities, kwargs = args
+    energy, extraction_time = run_batch(rows["E_mag"], rows["B_mag"], rows["rf_frequency"],
+                                        initial_positions[rows["initial_condition"]],
+                                        initial_velocities[rows["initial_condition"]], rows["dt"][0], **kwargs)
+    rows = rows.copy()
+    rows["energy"] = energy
+    rows["extraction_time"] = extraction_time
+    rows["extracted"] = ~np.isnan(extraction_time)
+    return rows
+
+
+def parameter_scan(E_mags, B_mags, rf_frequencies = (np.nan,), dts = (1e-11,), initial_positions = ((1.0, 0.0, 0.0),),
+                   initial_velocities = None, max_time = 1e-6, processes = None, chunk_size = 4096, **kwargs):
+    """
+    Runs the cyclotron headless over every combination of the given parameters, and returns the final energy and
+    extraction time of each run. Every run is an independent particle, so each chunk of runs is pushed at once as one
+    batch, and the chunks are spread across processes. On Windows and macOS this must be called from under
+    if __name__ == "__main__", since the worker processes import the calling script.
+    :param E_mags: electric field magnitudes to try, in N/C
+    :param B_mags: magnetic field magnitudes to try, in Tesla
+    :param rf_frequencies: RF frequencies to try, in Hz; nan flips the polarity at the plates like the simulation
+    :param dts: timesteps to try, in seconds
+    :param initial_positions: a (k, 3) array of initial positions to try, in meters
+    :param initial_velocities: a (k, 3) array of the matching initial velocities in m/s; defaults to starting at rest
+    :param max_time: the longest time to simulate each run for, in seconds
+    :param processes: the number of worker processes; defaults to one per CPU, and 1 runs everything in this process
+    :param chunk_size: the number of runs to push at once in each batch
+    :param kwargs: other arguments to run_batch(), e.g. q, mass, phase0, radius or gap
+    :return: an array with dtype SCAN_DTYPE and one row per run, ordered like itertools.product(E_mags, B_mags,
+             rf_frequencies, dts, initial conditions), so the initial condition varies fastest
+    """
+    initial_positions = np.atleast_2d(np.asarray(initial_positions, dtype = float))
+    if initial_velocities is None:
+        initial_velocities = np.zeros_like(initial_positions)
+    initial_velocities = np.atleast_2d(np.asarray(initial_velocities, dtype = float))
+
+    # One row per combination of parameters
+    grid = list(itertools.product(E_mags, B_mags, rf_frequencies, dts, range(len(initial_positions))))
+    results = np.zeros(len(grid), dtype = SCAN_DTYPE)
+    for name, column in zip(["E_mag", "B_mag", "rf_frequency", "dt", "initial_condition"], zip(*grid)):
+        results[name] = column
+
+    # Chunks of runs which share a timestep, so each chunk can be pushed as one batch
+    kwargs["max_time"] = max_time
+    tasks = []
+    for dt in np.unique(results["dt"]):
+        indices = np.flatnonzero(results["dt"] == dt)
+        for start in range(0, len(indices), chunk_size):
+            chunk = indices[start:start + chunk_size]
+            tasks.append((chunk, (results[chunk], initial_positions, initial_velocities, kwargs)))
+
+    if processes == 1:
+        chunks = map(_run_chunk, [task for _, task in tasks])
+    else:
+        with ProcessPoolExecutor(max_workers = processes) as executor:
+            chunks = list(executor.map(_run_chunk, [task for _, task in tasks]))
+    for (indices, _), rows in zip(tasks, chunks):
+        results[indices] = rows
+    return results
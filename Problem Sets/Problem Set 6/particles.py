@@ -0,0 +1,103 @@
+import numpy as np
+
+from records import RecordArray, RecordHandle, record_field
+
+# Everything the pushers need to know about a particle, packed into 64 bytes; a million particles take 64 MB
+PARTICLE_DTYPE = np.dtype([
+    ("q", float),  # charge of the particle in coulomb
+    ("mass", float),  # mass of the particle in kg
+    ("pos", float, 3),  # x, y, z coordinates of the particle in meters
+    ("vel", float, 3),  # vx, vy, vz of the particle in m/s
+])
+
+
+class ParticleHandle(RecordHandle):
+    """
+    This class is a lightweight view of one particle in a ParticleArray(), with the same .q, .mass, .pos and .vel
+    attributes as a Particle() (as (3,) arrays rather than vpython vectors), plus .x ... .vz. It stores nothing but the
+    array and an index, so reading or writing its attributes changes the array directly.
+    """
+
+    __slots__ = ()
+
+    q = record_field("q")
+    mass = record_field("mass")
+    pos = record_field("pos")
+    vel = record_field("vel")
+    x, y, z = (record_field("pos", axis) for axis in range(3))
+    vx, vy, vz = (record_field("vel", axis) for axis in range(3))
+
+    def __repr__(self):
+        return "ParticleHandle({}, q = {:.3e}, pos = {}, vel = {})".format(self.index, self.q, self.pos, self.vel)
+
+
+class ParticleArray(RecordArray):
+    """
+    This class stores many particles in one NumPy structured array rather than as separate Particle() objects, so they
+    take 64 bytes each and the positions, velocities, charges and masses are array views that the pushers can use
+    directly. Indexing it gives a ParticleHandle() which behaves like a Particle().
+    """
+
+    dtype = PARTICLE_DTYPE
+    handle = ParticleHandle
+
+    @classmethod
+    def from_arrays(cls, positions, velocities, q = 1.6e-19, mass = 9.109e-31):
+        """
+        Makes an array of particles from arrays of their properties, without making any per-particle objects
+        :param positions: an (n, 3) array of positions in meters
+        :param velocities: an (n, 3) array of velocities in m/s
+        :param q: charge of the particles in coulomb, a scalar or an (n,) array
+        :param mass: mass of the particles in kg, a scalar or an (n,) array
+        :return: a ParticleArray() instance
+        """
+        particles = cls(capacity = len(positions))
+        particles.extend(positions, velocities, q, mass)
+        return particles
+
+    @classmethod
+    def from_particles(cls, particles):
+        """
+        Copies the state of some Particle() instances into a new array
+        :param particles: a list of Particle() instances
+        :return: a ParticleArray() instance
+        """
+        positions = [[particle.pos.x, particle.pos.y, particle.pos.z] for particle in particles]
+        velocities = [[particle.vel.x, particle.vel.y, particle.vel.z] for particle in particles]
+        return cls.from_arrays(np.reshape(positions, (-1, 3)), np.reshape(velocities, (-1, 3)),
+                               [particle.q for particle in particles], [particle.mass for particle in particles])
+
+    def append(self, pos = (1.0, 0.0, 0.0), vel = (0.0, 0.0, 0.0), q = 1.6e-19, mass = 9.109e-31):
+        """
+        Adds a particle to the end of the array, doubling its capacity if it is full
+        :return: a ParticleHandle() of the new particle
+        """
+        self._grow(1)[0] = (q, mass, pos, vel)
+        return self[-1]
+
+    def extend(self, positions, velocities, q = 1.6e-19, mass = 9.109e-31):
+        """
+        Adds many particles to the end of the array at once, growing it at most once
+        :param positions: an (n, 3) array of positions in meters
+        :param velocities: an (n, 3) array of velocities in m/s
+        :param q: charge of the new particles in coulomb, a scalar or an (n,) array
+        :param mass: mass of the new particles in kg, a scalar or an (n,) array
+        """
+        new = self._grow(len(positions))
+        new["q"], new["mass"], new["pos"], new["vel"] = q, mass, positions, velocities
+
+    @property
+    def charges(self):
+        return self.records["q"][:self.count]
+
+    @property
+    def masses(self):
+        return self.records["mass"][:self.count]
+
+    @property
+    def positions(self):
+        return self.records["pos"][:self.count]
+
+    @property
+    def velocities(self):
+        return self.records["vel"][:self.count]
@@ -0,0 +1,292 @@
+import numpy as np
+
+# Physical constants
+c = 2.998e8  # speed of light, meters / second
+
+
+def lorentz_factor(momenta, mass):
+    """
+    Computes the Lorentz factor gamma of many particles from their momenta
+    :param momenta: an (n, 3) array of relativistic momenta gamma * m * v in kg m/s
+    :param mass: the rest mass of the particles in kg, a scalar or an (n,) array
+    :return: an (n,) array of Lorentz factors
+    """
+    u = momenta / np.reshape(mass, (-1, 1))
+    return np.sqrt(1 + np.sum(u ** 2, axis = 1) / c ** 2)
+
+
+def momenta_from_velocities(velocities, mass):
+    """
+    Converts velocities (which must be slower than light) to relativistic momenta
+    :param velocities: an (n, 3) array of velocities in m/s
+    :param mass: the rest mass of the particles in kg, a scalar or an (n,) array
+    :return: an (n, 3) array of momenta
+    """
+    gamma = 1 / np.sqrt(1 - np.sum(velocities ** 2, axis = 1) / c ** 2)
+    return np.reshape(mass, (-1, 1)) * gamma[:, None] * velocities
+
+
+def velocities_from_momenta(momenta, mass):
+    """
+    Converts relativistic momenta to velocities
+    :param momenta: an (n, 3) array of momenta in kg m/s
+    :param mass: the rest mass of the particles in kg, a scalar or an (n,) array
+    :return: an (n, 3) array of velocities
+    """
+    return momenta / (np.reshape(mass, (-1, 1)) * lorentz_factor(momenta, mass)[:, None])
+
+
+def kinetic_energy(momenta, mass):
+    """
+    Computes the relativistic kinetic energy (gamma - 1) m c^2 of many particles
+    :param momenta: an (n, 3) array of momenta in kg m/s
+    :param mass: the rest mass of the particles in kg, a scalar or an (n,) array
+    :return: an (n,) array of kinetic energies in joules
+    """
+    return (lorentz_factor(momenta, mass) - 1) * mass * c ** 2
+
+
+def kahan_add(total, compensation, increment):
+    """
+    Adds an increment to a running total in place with Kahan compensated summation: the low-order bits which are lost
+    when a small increment is added to a large total are kept in compensation and fed back into the next addition, so
+    the error stays at the level of one rounding instead of growing with the number of additions
+    :param total: an array to add to, modified in place
+    :param compensation: an array of the same shape holding the lost bits (start it at zero), modified in place
+    :param increment: an array of the same shape to add
+    """
+    corrected = increment - compensation
+    new_total = total + corrected
+    compensation[...] = (new_total - total) - corrected
+    total[...] = new_total
+
+
+def boris_push(positions, momenta, q, mass, E, B, dt):
+    """
+    Advances many charged particles by one timestep with the relativistic Boris pusher. The electric field is applied
+    in two half-kicks around an exact-magnitude rotation in the magnetic field, so the speed of every particle stays
+    below c no matter how strong the fields or how large the timestep.
+    :param positions: an (n, 3) array of positions in meters
+    :param momenta: an (n, 3) array of momenta in kg m/s
+    :param q: charge of the particles in coulomb, a scalar or an (n,) array
+    :param mass: rest mass of the particles in kg, a scalar or an (n,) array
+    :param E: an (n, 3) array of the electric field at each particle, in N/C
+    :param B: an (n, 3) array of the magnetic field at each particle, in Tesla
+    :param dt: the timestep in seconds
+    :return: a tuple of the new (positions, momenta)
+    """
+    q = np.reshape(q, (-1, 1))
+    mass = np.reshape(mass, (-1, 1))
+    u = momenta / mass  # u = gamma * v
+
+    # First half of the electric kick
+    half_kick = q * E / mass * (dt / 2)
+    u_minus = u + half_kick
+
+    # Magnetic rotation, using gamma at the half step
+    gamma_minus = np.sqrt(1 + np.sum(u_minus ** 2, axis = 1, keepdims = True) / c ** 2)
+    t = q * B / mass * (dt / (2 * gamma_minus))
+    s = 2 * t / (1 + np.sum(t ** 2, axis = 1, keepdims = True))
+    u_prime = u_minus + np.cross(u_minus, t)
+    u_plus = u_minus + np.cross(u_prime, s)
+
+    # Second half of the electric kick, then drift with the new velocity
+    u_new = u_plus + half_kick
+    gamma_new = np.sqrt(1 + np.sum(u_new ** 2, axis = 1, keepdims = True) / c ** 2)
+    return positions + u_new / gamma_new * dt, u_new * mass
+
+
+def vay_push(positions, momenta, q, mass, E, B, dt):
+    """
+    Advances many charged particles by one timestep with the Vay pusher (Vay, 2008). It takes the same arguments as
+    boris_push(), but it also preserves the E x B drift of ultra-relativistic particles, which Boris does not.
+    :return: a tuple of the new (positions, momenta)
+    """
+    q = np.reshape(q, (-1, 1))
+    mass = np.reshape(mass, (-1, 1))
+    u = momenta / mass
+    gamma = np.sqrt(1 + np.sum(u ** 2, axis = 1, keepdims = True) / c ** 2)
+    epsilon = q / mass * (dt / 2)
+
+    # Full electric kick plus the magnetic force evaluated with the old velocity
+    u_prime = u + epsilon * (2 * E + np.cross(u / gamma, B))
+    tau = epsilon * B
+    tau_squared = np.sum(tau ** 2, axis = 1, keepdims = True)
+    u_star = np.sum(u_prime * tau, axis = 1, keepdims = True) / c
+    sigma = 1 + np.sum(u_prime ** 2, axis = 1, keepdims = True) / c ** 2 - tau_squared
+
+    # Solve for the new gamma implicitly, then apply the remaining half of the magnetic rotation
+    gamma_new = np.sqrt((sigma + np.sqrt(sigma ** 2 + 4 * (tau_squared + u_star ** 2))) / 2)
+    t = tau / gamma_new
+    s = 1 / (1 + np.sum(t ** 2, axis = 1, keepdims = True))
+    u_new = s * (u_prime + np.sum(u_prime * t, axis = 1, keepdims = True) * t + np.cross(u_prime, t))
+    return positions + u_new / gamma_new * dt, u_new * mass
+
+
+def cyclotron_frequency(q, mass, B, gamma = 1.0):
+    """
+    Computes the frequency at which a particle circles in a uniform magnetic field
+    :param q: charge of the particle in coulomb
+    :param mass: rest mass of the particle in kg
+    :param B: magnitude of the magnetic field in Tesla
+    :param gamma: Lorentz factor of the particle; the frequency drops as the particle becomes relativistic
+    :return: the frequency in Hz
+    """
+    return np.abs(q) * B / (2 * np.pi * gamma * mass)
+
+
+def rf_phase(times, rf_frequency, phase0 = 0.0):
+    """
+    Computes the phase of the accelerating voltage at the given times, wrapped to [-pi, pi)
+    :param times: an array of times in seconds
+    :param rf_frequency: the frequency of the accelerating voltage in Hz
+    :param phase0: the phase of the voltage at t = 0
+    :return: an array of phases in radians
+    """
+    phase = 2 * np.pi * rf_frequency * np.asarray(times) + phase0
+    return (phase + np.pi) % (2 * np.pi) - np.pi
+
+
+def phase_slip(crossing_times, rf_frequency, phase0 = 0.0, synchronous_phase = 0.0, half_turn = True):
+    """
+    Computes how far a particle has slipped in phase against the accelerating voltage at each gap crossing. A particle
+    which stays in step with the RF crosses the gap at the synchronous phase every time; as it becomes relativistic its
+    orbit frequency drops and the crossings drift later, until it is decelerated instead of accelerated.
+    :param crossing_times: an array of the times at which the particle crossed the gap, in seconds
+    :param rf_frequency: the frequency of the accelerating voltage in Hz
+    :param phase0: the phase of the voltage at t = 0
+    :param synchronous_phase: the phase at which an ideal particle crosses the gap
+    :param half_turn: if True, the particle crosses a gap every half RF period and the voltage flips sign in between
+                      (as with two dees), so crossings half a period apart are in step
+    :return: an array of phase slips in radians, wrapped to [-pi, pi) (or [-pi / 2, pi / 2) if half_turn is True)
+    """
+    phase = rf_phase(crossing_times, rf_frequency, phase0) - synchronous_phase
+    if half_turn:
+        return (phase + np.pi / 2) % np.pi - np.pi / 2
+    return (phase + np.pi) % (2 * np.pi) - np.pi
+
+
+# Analytic gyration ====================================================================================================
+
+def _gamma(momenta, mass, relativistic):
+    """The Lorentz factor of each particle, or 1 for classical particles, whose momenta are just m v"""
+    return lorentz_factor(momenta, mass) if relativistic else np.ones(len(momenta))
+
+
+def gyration_push(positions, momenta, q, mass, B, dt, relativistic = True):
+    """
+    Advances many charged particles exactly along their helical orbits through a uniform magnetic field with no electric
+    field. The momentum just rotates about B, so this is exact for any timestep, however many gyrations it spans.
+    :param positions: an (n, 3) array of positions in meters
+    :param momenta: an (n, 3) array of momenta in kg m/s
+    :param q: charge of the particles in coulomb, a scalar or an (n,) array
+    :param mass: rest mass of the particles in kg, a scalar or an (n,) array
+    :param B: an (n, 3) array of the (uniform) magnetic field each particle moves through, in Tesla
+    :param dt: the time to advance by in seconds, a scalar or an (n,) array
+    :param relativistic: if False, the momenta are the classical m v (which may exceed m c) and gamma is taken to be 1
+    :return: a tuple of the new (positions, momenta)
+    """
+    q = np.reshape(q, (-1, 1))
+    mass = np.reshape(mass, (-1, 1))
+    dt = np.reshape(dt, (-1, 1))
+    gamma = _gamma(momenta, mass, relativistic)[:, None]
+    velocities = momenta / (gamma * mass)
+
+    # The velocity rotates about B with angular velocity -q B / (gamma m)
+    omega = -q * B / (gamma * mass)
+    omega_mag = np.linalg.norm(omega, axis = 1, keepdims = True)
+    axis = np.divide(omega, omega_mag, out = np.zeros_like(omega), where = omega_mag > 0)
+    v_parallel = np.sum(velocities * axis, axis = 1, keepdims = True) * axis
+    v_perp = velocities - v_parallel
+    v_normal = np.cross(axis, v_perp)
+
+    # Rotate the perpendicular velocity and integrate it exactly; a particle in zero field moves in a straight line
+    angle = omega_mag * dt
+    cos, sin = np.cos(angle), np.sin(angle)
+    safe_omega = np.where(omega_mag > 0, omega_mag, 1.0)
+    sin_term = np.where(omega_mag > 0, sin / safe_omega, dt)
+    cos_term = np.where(omega_mag > 0, (1 - cos) / safe_omega, 0.0)
+    new_positions = positions + v_parallel * dt + v_perp * sin_term + v_normal * cos_term
+    new_velocities = v_parallel + v_perp * cos + v_normal * sin
+    return new_positions, new_velocities * gamma * mass
+
+
+def _first_crossing_time(phase, target, omega, period, cosine = False):
+    """
+    Smallest positive time t at which sin(phase + omega t) = target (or cos, if cosine is True), or inf if never
+    """
+    valid = np.abs(target) <= 1
+    base = np.arccos(np.clip(target, -1, 1)) if cosine else np.arcsin(np.clip(target, -1, 1))
+    solutions = [base, -base] if cosine else [base, np.pi - base]
+    best = np.full(np.shape(phase), np.inf)
+    for solution in solutions:
+        t = (np.sign(omega) * (solution - phase)) % (2 * np.pi) / np.abs(omega)
+        t = np.where(t < 1e-9 * period, t + period, t)  # ignore the crossing the particle is sitting on right now
+        best = np.minimum(best, np.where(valid, t, np.inf))
+    return best
+
+
+def dee_transit_time(positions, momenta, q, mass, B_z, gap_bounds, radius, relativistic = True):
+    """
+    Computes how long each particle can coast on its circular orbit inside a dee before it reaches the accelerating gap
+    (the strip gap_bounds[0] <= y <= gap_bounds[1]) or the edge of the cyclotron, assuming a uniform field B_z along z
+    and no electric field inside the dees. Advancing each particle by this time with gyration_push() lands it exactly on
+    the boundary, so only the gap crossings need to be resolved with small timesteps.
+    :param positions: an (n, 3) array of positions in meters
+    :param momenta: an (n, 3) array of momenta in kg m/s
+    :param q: charge of the particles in coulomb, a scalar or an (n,) array
+    :param mass: rest mass of the particles in kg, a scalar or an (n,) array
+    :param B_z: the z component of the magnetic field in Tesla
+    :param gap_bounds: a tuple of the (lower, upper) y coordinates of the gap
+    :param radius: radius of the cyclotron in meters
+    :param relativistic: if False, the momenta are the classical m v (which may exceed m c) and gamma is taken to be 1
+    :return: an (n,) array of times in seconds; at most one gyration period
+    """
+    q = np.reshape(q, (-1,))
+    mass = np.reshape(mass, (-1,))
+    gamma = _gamma(momenta, mass, relativistic)
+    velocities = momenta / (gamma * mass)[:, None]
+    omega = -q * B_z / (gamma * mass) * np.ones(len(positions))
+    period = 2 * np.pi / np.abs(omega)
+
+    # Center, radius, and phase of each particle's circular orbit in the xy plane
+    center_x = positions[:, 0] - velocities[:, 1] / omega
+    center_y = positions[:, 1] + velocities[:, 0] / omega
+    orbit_radius = np.hypot(velocities[:, 0], velocities[:, 1]) / np.abs(omega)
+    phase = np.arctan2(positions[:, 1] - center_y, positions[:, 0] - center_x)
+
+    # y = center_y + orbit_radius cos(phase - pi / 2 + omega t) reaches either edge of the gap
+    times = [_first_crossing_time(phase - np.pi / 2, (bound - center_y) / orbit_radius, omega, period, cosine = True)
+             for bound in gap_bounds]
+
+    # |r|^2 = |center|^2 + orbit_radius^2 + 2 orbit_radius |center| cos(phase + omega t - center_angle) reaches radius^2
+    center_distance = np.hypot(center_x, center_y)
+    with np.errstate(divide = "ignore", invalid = "ignore"):
+        target = (radius ** 2 - center_distance ** 2 - orbit_radius ** 2) / (2 * orbit_radius * center_distance)
+    target = np.where(np.isfinite(target), target, 2.0)
+    center_angle = np.arctan2(center_y, center_x)
+    times.append(_first_crossing_time(phase - center_angle, target, omega, period, cosine = True))
+
+    return np.minimum(np.min(times, axis = 0), period)
+
+
+def dee_transit(positions, momenta, q, mass, B_z, gap_bounds, radius, relativistic = True):
+    """
+    Moves each particle inside a dee along its exact circular orbit to the point where it next reaches the gap or the
+    edge of the cyclotron (see dee_transit_time()). Particles are placed exactly on the boundary they reach, so that
+    roundoff can never leave a particle just inside the dee, where it would coast for another full turn.
+    :return: a tuple of the new (positions, momenta, elapsed times)
+    """
+    elapsed = dee_transit_time(positions, momenta, q, mass, B_z, gap_bounds, radius, relativistic)
+    B = np.zeros_like(positions)
+    B[:, 2] = B_z
+    positions, momenta = gyration_push(positions, momenta, q, mass, B, elapsed, relativistic)
+
+    # Snap onto whichever boundary was reached
+    for bound in gap_bounds:
+        on_bound = np.abs(positions[:, 1] - bound) < 1e-9 * radius
+        positions[on_bound, 1] = bound
+    r = np.hypot(positions[:, 0], positions[:, 1])
+    on_edge = np.abs(r - radius) < 1e-9 * radius
+    positions[on_edge, :2] *= (radius / r[on_edge])[:, None]
+    return positions, momenta, elapsed
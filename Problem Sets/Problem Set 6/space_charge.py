@@ -0,0 +1,146 @@
+import numpy as np
+
+# Physical constants
+e0 = 8.854e-12  # vacuum permittivity epsilon_0, Farad / meter
+
+
+def direct_sum_field(positions, charges, softening = 0.0, e0 = e0, block_size = 1024):
+    """
+    Computes the electric field each particle feels from all of the other particles by summing Coulomb's law over every
+    pair. This is exact but costs O(N^2), so it is meant for small bunches. Targets are processed in blocks so the
+    scratch memory stays bounded.
+    :param positions: an (n, 3) array of positions in meters
+    :param charges: charge of each particle in coulomb, a scalar or an (n,) array
+    :param softening: length in meters added in quadrature to every separation, to tame very close encounters
+    :param e0: the vacuum permittivity
+    :param block_size: number of target particles to process at once
+    :return: an (n, 3) array of electric fields in N/C
+    """
+    positions = np.asarray(positions, dtype = float)
+    charges = np.broadcast_to(np.asarray(charges, dtype = float), (len(positions),))
+    field = np.zeros_like(positions)
+    for start in range(0, len(positions), block_size):
+        stop = min(start + block_size, len(positions))
+        separation = positions[start:stop, None, :] - positions[None, :, :]
+        distance_squared = np.sum(separation ** 2, axis = -1) + softening ** 2
+
+        # A particle does not push on itself; its separation from itself is zero, so drop those terms
+        with np.errstate(divide = "ignore"):
+            inverse_cube = np.where(distance_squared > 0, distance_squared ** -1.5, 0.0)
+        field[start:stop] = np.einsum("ij,ijk->ik", charges * inverse_cube, separation)
+    return field / (4 * np.pi * e0)
+
+
+def _cloud_in_cell(positions, lower, spacing, shape):
+    """Flat grid indices and weights of the eight cells each particle's charge cloud overlaps"""
+    fractional_index = (positions - lower) / spacing
+    i0 = np.clip(np.floor(fractional_index).astype(int), 0, np.array(shape) - 2)
+    weight = fractional_index - i0
+    indices = []
+    weights = []
+    for corner in range(8):
+        upper_corner = np.array([(corner >> axis) & 1 for axis in range(3)], dtype = bool)
+        index = i0 + upper_corner
+        indices.append(np.ravel_multi_index(index.T, shape))
+        weights.append(np.prod(np.where(upper_corner, weight, 1 - weight), axis = 1))
+    return indices, weights
+
+
+def particle_in_mesh_field(positions, charges, grid_shape = (64, 64, 64), softening = None, e0 = e0):
+    """
+    Computes the space-charge field of a bunch with the particle-in-mesh method: charges are deposited onto a grid
+    around the bunch (cloud-in-cell), Poisson's equation is solved with FFTs using Hockney's zero-padding method for
+    free-space boundary conditions, and the field is interpolated back to the particles. The cost is O(N + M log M) for
+    N particles on M grid cells, so it scales to 10^5+ macro-particles.
+    :param positions: an (n, 3) array of positions in meters
+    :param charges: charge of each particle in coulomb, a scalar or an (n,) array
+    :param grid_shape: number of grid points along each axis
+    :param softening: smoothing length of the Green's function in meters; defaults to half the smallest grid spacing
+    :param e0: the vacuum permittivity
+    :return: an (n, 3) array of electric fields in N/C
+    """
+    positions = np.asarray(positions, dtype = float)
+    charges = np.broadcast_to(np.asarray(charges, dtype = float), (len(positions),))
+    shape = tuple(grid_shape)
+
+    # Grid around the bunch, with a margin of one cell on each side
+    n = np.array(shape)
+    lower = positions.min(axis = 0)
+    extent = positions.max(axis = 0) - lower
+    if extent.max() == 0:
+        return np.zeros_like(positions)
+    spacing = extent * (1 + 2 / n) / (n - 1)
+    lower = lower - extent / n
+
+    # A flat axis (e.g. a bunch in the z = 0 plane) gets the average spacing of the other axes, with the particles
+    # sitting exactly on its middle grid plane
+    flat = extent <= 1e-9 * extent.max()
+    spacing[flat] = spacing[~flat].mean()
+    lower[flat] = positions[0, flat] - spacing[flat] * (n[flat] // 2)
+    cell_volume = np.prod(spacing)
+    if softening is None:
+        softening = 0.5 * spacing.min()
+
+    # Deposit the charge density onto the grid
+    indices, weights = _cloud_in_cell(positions, lower, spacing, shape)
+    density = np.zeros(np.prod(shape))
+    for index, weight in zip(indices, weights):
+        density += np.bincount(index, weights = charges * weight, minlength = density.size)
+    density = density.reshape(shape) / cell_volume
+
+    # Free-space Green's function on a grid twice as large, with distances that wrap around for the convolution
+    padded_shape = tuple(2 * n for n in shape)
+    offsets = [np.minimum(np.arange(2 * n), 2 * n - np.arange(2 * n)) * h for n, h in zip(shape, spacing)]
+    dx, dy, dz = np.meshgrid(*offsets, indexing = "ij", sparse = True)
+    green = 1 / (4 * np.pi * e0 * np.sqrt(dx ** 2 + dy ** 2 + dz ** 2 + softening ** 2))
+
+    # Potential = density convolved with the Green's function, then E = -grad(potential)
+    axes = (0, 1, 2)
+    potential = np.fft.irfftn(np.fft.rfftn(density, padded_shape, axes) * np.fft.rfftn(green), padded_shape, axes)
+    potential = potential[:shape[0], :shape[1], :shape[2]] * cell_volume
+    grid_field = -np.stack(np.gradient(potential, *spacing), axis = -1).reshape(-1, 3)
+
+    # Interpolate the field back to the particles with the same cloud-in-cell weights
+    field = np.zeros_like(positions)
+    for index, weight in zip(indices, weights):
+        field += weight[:, None] * grid_field[index]
+    return field
+
+
+class SpaceCharge:
+    """
+    This class computes the Coulomb repulsion between the particles in a bunch, choosing between the exact direct sum
+    for small bunches and the particle-in-mesh solver for large ones
+    """
+
+    def __init__(self, method = "auto", threshold = 2000, grid_shape = (64, 64, 64), softening = None, e0 = e0):
+        """
+        :param method: "direct", "mesh", or "auto" to use the direct sum below threshold particles and the mesh above
+        :param threshold: number of particles above which "auto" switches to the mesh solver
+        :param grid_shape: number of grid points along each axis for the mesh solver
+        :param softening: smoothing length in meters; defaults to 0 for the direct sum and half a cell for the mesh
+        :param e0: the vacuum permittivity
+        """
+        if method not in ("auto", "direct", "mesh"):
+            raise ValueError("Unknown space charge method: {}".format(method))
+        self.method = method
+        self.threshold = threshold
+        self.grid_shape = grid_shape
+        self.softening = softening
+        self.e0 = e0
+
+    def field(self, positions, charges):
+        """
+        Computes the space-charge electric field at every particle
+        :param positions: an (n, 3) array of positions in meters
+        :param charges: charge of each particle in coulomb, a scalar or an (n,) array
+        :return: an (n, 3) array of electric fields in N/C
+        """
+        if len(positions) < 2:
+            return np.zeros((len(positions), 3))
+        method = self.method
+        if method == "auto":
+            method = "direct" if len(positions) <= self.threshold else "mesh"
+        if method == "direct":
+            return direct_sum_field(positions, charges, softening = self.softening or 0.0, e0 = self.e0)
+        return particle_in_mesh_field(positions, charges, self.grid_shape, softening = self.softening, e0 = self.e0)
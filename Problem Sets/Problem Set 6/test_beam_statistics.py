@@ -0,0 +1,47 @@
+import numpy as np
+
+from beam_statistics import EmittanceAccumulator, StreamingHistogram
+
+
+def correlated_beam(n, seed):
+    rng = np.random.default_rng(seed)
+    u = rng.normal(1e-3, 2e-3, n)
+    u_prime = 0.4 * u + rng.normal(-5e-4, 1e-3, n)
+    return u, u_prime
+
+
+def test_emittance_matches_np_cov():
+    u, u_prime = correlated_beam(10000, 0)
+    accumulator = EmittanceAccumulator()
+    for batch in np.array_split(np.arange(len(u)), 7):
+        accumulator.add(u[batch], u_prime[batch])
+    covariance = np.cov(u, u_prime, bias = True)
+    np.testing.assert_allclose(accumulator.covariance, covariance, rtol = 1e-10)
+    np.testing.assert_allclose(accumulator.emittance, np.sqrt(np.linalg.det(covariance)), rtol = 1e-10)
+
+
+def test_merged_accumulators_match_one():
+    u, u_prime = correlated_beam(5000, 1)
+    whole, first, second = EmittanceAccumulator(), EmittanceAccumulator(), EmittanceAccumulator()
+    whole.add(u, u_prime)
+    first.add(u[:1234], u_prime[:1234])
+    second.add(u[1234:], u_prime[1234:])
+    first.merge(second)
+    assert first.count == whole.count
+    np.testing.assert_allclose(first.covariance, whole.covariance, rtol = 1e-10)
+
+
+def test_empty_accumulator_is_nan():
+    accumulator = EmittanceAccumulator()
+    accumulator.add([], [])
+    assert accumulator.count == 0 and np.isnan(accumulator.emittance)
+
+
+def test_histogram_matches_np_histogram():
+    values = np.random.default_rng(2).normal(0, 1, 10000)
+    histogram = StreamingHistogram(-2, 2, bins = 40)
+    for batch in np.array_split(values, 3):
+        histogram.add(batch)
+    inside = values[(values >= -2) & (values <= 2)]
+    np.testing.assert_array_equal(histogram.counts, np.histogram(inside, bins = histogram.edges)[0])
+    assert histogram.underflow == np.sum(values < -2) and histogram.overflow == np.sum(values > 2)
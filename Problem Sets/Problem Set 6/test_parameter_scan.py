@@ -0,0 +1,29 @@
+import numpy as np
+import pytest
+
+from context import SimulationContext
+from parameter_scan import CyclotronBunch
+
+
+def run_bunch(precision, steps = 2000):
+    positions = np.column_stack([np.linspace(0.5, 2.0, 4), np.zeros(4), np.zeros(4)])
+    context = SimulationContext(dt = 1e-11, E_mag = 1e7, B_mag = 1e-2)
+    bunch = CyclotronBunch(positions, np.zeros_like(positions), context, precision = precision)
+    for _ in range(steps):
+        bunch.step()
+    return bunch
+
+
+def test_float32_bunch_follows_float64():
+    reference = run_bunch("float64")
+    bunch = run_bunch("float32")
+    assert bunch.positions.dtype == np.float32 and bunch.momenta.dtype == np.float32
+    assert bunch.position_compensation.dtype == np.float32
+    np.testing.assert_allclose(bunch.energies, reference.energies, rtol = 1e-4)
+    np.testing.assert_allclose(bunch.positions, reference.positions, atol = 1e-3)
+
+
+def test_unknown_precision():
+    with pytest.raises(ValueError):
+        CyclotronBunch(np.zeros((1, 3)), np.zeros((1, 3)), SimulationContext(dt = 1e-11, E_mag = 1e7, B_mag = 1e-2),
+                       precision = "float16")
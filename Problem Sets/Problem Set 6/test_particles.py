@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from particles import ParticleArray
+
+
+def random_particles(n, seed = 0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, 1, (n, 3)), rng.normal(0, 1e6, (n, 3)), rng.choice([1.6e-19, -1.6e-19], n)
+
+
+def test_particle_array_handles_read_and_write_the_array():
+    positions, velocities, charges = random_particles(4)
+    particles = ParticleArray.from_arrays(positions, velocities, charges)
+    handle = particles[-1]
+    assert handle.index == 3 and handle.q == charges[3] and handle.mass == 9.109e-31
+    assert (handle.y, handle.vx) == (positions[3, 1], velocities[3, 0])
+
+    handle.x = 5.0
+    handle.vel = (1.0, 2.0, 3.0)
+    handle.mass = 1.67e-27
+    assert particles.positions[3, 0] == 5.0 and particles.masses[3] == 1.67e-27
+    np.testing.assert_array_equal(particles.velocities[3], [1.0, 2.0, 3.0])
+    with pytest.raises(IndexError):
+        particles[-5]
+    with pytest.raises(IndexError):
+        particles[4]
+
+
+def test_particle_array_grows():
+    positions, velocities, charges = random_particles(25)
+    particles = ParticleArray(capacity = 0)
+    for i in range(5):
+        particles.append(positions[i], velocities[i], charges[i])
+    particles.extend(positions[5:], velocities[5:], charges[5:], mass = 1.67e-27)
+    assert len(particles) == 25 and len(particles.records) >= 25
+    np.testing.assert_array_equal(particles.positions, positions)
+    np.testing.assert_array_equal(particles.velocities, velocities)
+    np.testing.assert_array_equal(particles.charges, charges)
+    np.testing.assert_array_equal(particles.masses, [9.109e-31] * 5 + [1.67e-27] * 20)
+    assert [particle.q for particle in particles] == list(charges)
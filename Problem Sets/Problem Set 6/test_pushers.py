@@ -0,0 +1,99 @@
+import numpy as np
+import pytest
+
+from pushers import (boris_push, c, dee_transit, gyration_push, lorentz_factor, momenta_from_velocities, phase_slip,
+                     vay_push, velocities_from_momenta)
+
+# The defaults of the cyclotron simulator: a 1 m gap with |E| = 1e7 N/C in a 10 m cyclotron with |B| = 1e-2 T
+Q = 1.6e-19
+MASS = 9.109e-31
+E_MAG = 1e7
+B_Z = -1e-2
+GAP_BOUNDS = (-0.5, 0.5)
+RADIUS = 10.0
+
+
+def test_dee_transit_after_one_gap_crossing():
+    # The particle crosses the gap once, from rest, and then coasts through the upper dee back to the gap; classically
+    # it leaves the gap at about 6c, which the classical orbit must handle as well as the relativistic one does
+    energy = Q * E_MAG * (GAP_BOUNDS[1] - GAP_BOUNDS[0])
+    classical_momentum = MASS * np.sqrt(2 * energy / MASS)
+    relativistic_momentum = MASS * c * np.sqrt((1 + energy / (MASS * c ** 2)) ** 2 - 1)
+    assert classical_momentum / MASS > 5 * c
+
+    for relativistic, momentum in [(False, classical_momentum), (True, relativistic_momentum)]:
+        positions = np.array([[1.0, GAP_BOUNDS[1], 0.0]])
+        momenta = np.array([[0.0, momentum, 0.0]])
+        new_positions, new_momenta, elapsed = dee_transit(positions, momenta, Q, MASS, B_Z, GAP_BOUNDS, RADIUS,
+                                                          relativistic = relativistic)
+        gamma = lorentz_factor(momenta, MASS)[0] if relativistic else 1.0
+        orbit_radius = momentum / (Q * abs(B_Z))
+
+        # Half a turn later it is back on the gap, on the other side of its orbit, moving the other way as fast
+        assert np.all(np.isfinite(new_positions)) and np.all(np.isfinite(new_momenta))
+        np.testing.assert_allclose(elapsed, np.pi * gamma * MASS / (Q * abs(B_Z)), rtol = 1e-12)
+        assert new_positions[0, 1] == GAP_BOUNDS[1]
+        np.testing.assert_allclose(abs(new_positions[0, 0] - 1.0), 2 * orbit_radius, rtol = 1e-9)
+        np.testing.assert_allclose(new_momenta[0], [0.0, -momentum, 0.0], atol = 1e-9 * momentum)
+
+
+@pytest.mark.parametrize("push", [boris_push, vay_push])
+def test_speed_stays_below_c_in_a_huge_field(push):
+    positions = np.zeros((3, 3))
+    momenta = momenta_from_velocities(np.array([[0.0, 0.0, 0.0], [0.5 * c, 0.0, 0.0], [0.0, 0.0, -0.9 * c]]), MASS)
+    E = np.tile([0.0, 1e12, 0.0], (3, 1))
+    B = np.tile([0.0, 0.0, 1.0], (3, 1))
+    for _ in range(1000):
+        positions, momenta = push(positions, momenta, Q, MASS, E, B, 1e-11)
+        speeds = np.linalg.norm(velocities_from_momenta(momenta, MASS), axis = 1)
+        assert np.all(speeds < c)
+    assert np.all(lorentz_factor(momenta, MASS) > 1e3)  # the field really did accelerate them that hard
+
+
+def test_gyration_in_pure_magnetic_field_keeps_gamma_and_radius():
+    velocities = np.array([[0.3 * c, 0.0, 0.0], [0.0, 0.99 * c, 0.0], [1e5, -2e5, 0.0]])
+    momenta = momenta_from_velocities(velocities, MASS)
+    positions = np.array([[1.0, 2.0, 0.0], [-3.0, 0.0, 0.0], [0.0, 0.0, 0.0]])
+    B = np.tile([0.0, 0.0, B_Z], (3, 1))
+    gamma = lorentz_factor(momenta, MASS)
+    orbit_radius = np.linalg.norm(momenta, axis = 1) / (Q * abs(B_Z))
+    center = positions[:, :2] + np.stack([momenta[:, 1], -momenta[:, 0]], axis = 1) / (Q * B_Z)
+
+    # Steps of any size, up to many gyrations at once, keep the particles on the same circles at the same speed
+    for dt in [1e-12, 3.7e-9, 2.5e-7]:
+        positions, momenta = gyration_push(positions, momenta, Q, MASS, B, dt)
+        np.testing.assert_allclose(lorentz_factor(momenta, MASS), gamma, rtol = 1e-12)
+        np.testing.assert_allclose(np.linalg.norm(positions[:, :2] - center, axis = 1), orbit_radius, rtol = 1e-9)
+
+
+def test_dee_transit_lands_on_the_boundary_like_fine_boris_steps():
+    # A particle in the upper dee, heading up and to the left, comes back down to the top of the gap
+    positions = np.array([[2.0, 0.6, 0.0]])
+    momenta = momenta_from_velocities(np.array([[-0.3 * c, 0.4 * c, 0.0]]), MASS)
+    new_positions, new_momenta, elapsed = dee_transit(positions, momenta, Q, MASS, B_Z, GAP_BOUNDS, RADIUS)
+    assert new_positions[0, 1] == GAP_BOUNDS[1]
+
+    # Fine Boris steps over the same time end up in the same place, without leaving the dee on the way
+    n_steps = 20000
+    E = np.zeros((1, 3))
+    B = np.array([[0.0, 0.0, B_Z]])
+    boris_positions, boris_momenta = positions, momenta
+    for _ in range(n_steps - 1):
+        boris_positions, boris_momenta = boris_push(boris_positions, boris_momenta, Q, MASS, E, B, elapsed[0] / n_steps)
+        assert boris_positions[0, 1] > GAP_BOUNDS[1] and np.linalg.norm(boris_positions[0]) < RADIUS
+    boris_positions, boris_momenta = boris_push(boris_positions, boris_momenta, Q, MASS, E, B, elapsed[0] / n_steps)
+    # Boris positions lag its momenta by half a step, so they only agree to within the drift of one step
+    drift = np.linalg.norm(velocities_from_momenta(momenta, MASS)) * elapsed[0] / n_steps
+    np.testing.assert_allclose(boris_positions, new_positions, rtol = 0, atol = drift)
+    np.testing.assert_allclose(boris_momenta, new_momenta, rtol = 0, atol = 1e-6 * np.linalg.norm(momenta))
+
+
+def test_phase_slip():
+    rf_frequency = 1e6
+    in_step = np.arange(10) / (2 * rf_frequency)  # a crossing every half period, always at the synchronous phase
+    np.testing.assert_allclose(phase_slip(in_step, rf_frequency), 0.0, atol = 1e-9)
+    late = in_step + 0.1 / (2 * np.pi * rf_frequency)  # every crossing 0.1 rad late
+    np.testing.assert_allclose(phase_slip(late, rf_frequency), 0.1, rtol = 1e-9)
+    np.testing.assert_allclose(phase_slip(late, rf_frequency, synchronous_phase = 0.1), 0.0, atol = 1e-9)
+    # Without the half turns, a crossing half a period off is as far out of step as it can be
+    np.testing.assert_allclose(np.abs(phase_slip(in_step[1::2], rf_frequency, half_turn = False)), np.pi)
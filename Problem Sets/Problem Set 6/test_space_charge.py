@@ -0,0 +1,47 @@
+import numpy as np
+import pytest
+
+from space_charge import SpaceCharge, direct_sum_field, particle_in_mesh_field
+
+GRID_SHAPE = (32, 32, 32)
+
+
+def mesh_softening(positions, grid_shape = GRID_SHAPE):
+    """The default softening of particle_in_mesh_field(), half its smallest grid spacing, so both solvers can match"""
+    n = np.array(grid_shape)
+    extent = np.ptp(positions, axis = 0)
+    spacing = extent * (1 + 2 / n) / (n - 1)
+    flat = extent <= 1e-9 * extent.max()
+    spacing[flat] = spacing[~flat].mean()
+    return 0.5 * spacing.min()
+
+
+@pytest.mark.parametrize("sigma, tolerance", [
+    ((1e-3, 2e-3, 1.5e-3), 0.08),  # a 3D bunch: about 6% median error on a 32^3 grid
+    ((1e-3, 2e-3, 0.0), 0.15),  # a flat bunch: about 12%, since the grid resolves a sheet less well
+])
+def test_mesh_field_matches_direct_sum(sigma, tolerance):
+    # The median error is mostly the graininess of the 3000 particles, which the direct sum sees and the mesh smooths
+    positions = np.random.default_rng(0).normal(0, 1, (3000, 3)) * sigma
+    softening = mesh_softening(positions)
+    mesh = particle_in_mesh_field(positions, 1.6e-19, GRID_SHAPE, softening = softening)
+    direct = direct_sum_field(positions, 1.6e-19, softening = softening)
+    error = np.linalg.norm(mesh - direct, axis = 1) / np.linalg.norm(direct, axis = 1)
+    assert np.median(error) < tolerance
+
+
+def test_direct_sum_of_two_charges():
+    positions = np.array([[0.0, 0.0, 0.0], [0.0, 2e-3, 0.0]])
+    field = direct_sum_field(positions, [1.6e-19, -3.2e-19], block_size = 1)
+    k = 1 / (4 * np.pi * 8.854e-12)
+    np.testing.assert_allclose(field, [[0.0, k * 3.2e-19 / 4e-6, 0.0], [0.0, k * 1.6e-19 / 4e-6, 0.0]], rtol = 1e-12)
+
+
+def test_space_charge_picks_a_method():
+    positions = np.random.default_rng(1).normal(0, 1e-3, (50, 3))
+    np.testing.assert_array_equal(SpaceCharge(threshold = 100).field(positions, 1.6e-19),
+                                  direct_sum_field(positions, 1.6e-19))
+    np.testing.assert_array_equal(SpaceCharge(threshold = 10, grid_shape = (16, 16, 16)).field(positions, 1.6e-19),
+                                  particle_in_mesh_field(positions, 1.6e-19, (16, 16, 16)))
+    with pytest.raises(ValueError):
+        SpaceCharge(method = "tree")
@@ -0,0 +1,22 @@
+"""
+The modules in SHARED_MODULES are shared by the solar system simulator (Problem Set 4) and the cyclotron simulator
+(Problem Set 6). Each problem set is handed out as a folder of its own, so these modules are copied into both folders
+rather than imported from one place. Make every change to both copies; the test below fails as soon as they differ.
+"""
+import os
+
+import pytest
+
+SHARED_MODULES = ["background.py", "context.py", "events.py", "profiling.py", "records.py", "server.py"]
+FOLDERS = [os.path.join(os.path.dirname(os.path.abspath(__file__)), folder)
+           for folder in ("Problem Set 4", "Problem Set 6")]
+
+
+@pytest.mark.parametrize("module", SHARED_MODULES)
+def test_copies_match(module):
+    """Every copy of a shared module must be byte for byte the same"""
+    copies = []
+    for folder in FOLDERS:
+        with open(os.path.join(folder, module), "rb") as file:
+            copies.append(file.read())
+    assert all(copy == copies[0] for copy in copies[1:]), "{} differs between {}".format(module, FOLDERS)